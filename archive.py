@@ -0,0 +1,267 @@
+# archive.py
+import asyncio
+import datetime
+import gzip
+import logging
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+
+import timeutil
+
+logger = logging.getLogger(__name__)
+
+# В каждой таблице архива — колонка с меткой времени, по которой строка попадает в месяц
+TS_COLUMNS = {"transactions": "created_ts", "transfer_batches": "created_ts", "logs": "ts"}
+
+
+def month_of(ts) -> str:
+    """Секунды Unix -> месяц 'YYYY-MM' по местному времени производства."""
+    return timeutil.local_day(ts)[:7]
+
+def month_bounds(month: str):
+    """'YYYY-MM' -> (начало месяца, начало следующего) в секундах Unix."""
+    year, mon = map(int, month.split("-"))
+    start = datetime.date(year, mon, 1)
+    end = datetime.date(year + (mon == 12), mon % 12 + 1, 1)
+    return timeutil.day_start_ts(start), timeutil.day_start_ts(end)
+
+
+class Archive:
+    """Помесячные архивы транзакций и журнала, вынесенных из factory.db.
+
+    Пока месяц ещё пополняется очисткой, архив лежит как обычный файл
+    SQLite <dir>/YYYY-MM.db. Когда весь месяц старше срока хранения,
+    файл сжимается (VACUUM + gzip) в YYYY-MM.db.gz и дальше только читается.
+    Для чтения сжатый архив распаковывается во временный каталог и
+    открывается в режиме только для чтения.
+
+    В архивные транзакции копируются имя и категория блюда и имя отправителя,
+    чтобы архив читался без основной БД.
+    """
+
+    def __init__(self, directory="archive"):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self._cache_dir = tempfile.mkdtemp(prefix="factory-archive-")
+        self._lock = threading.RLock()
+
+    # ---- файлы ----
+
+    def _open_path(self, month):
+        return os.path.join(self.directory, f"{month}.db")
+
+    def _sealed_path(self, month):
+        return os.path.join(self.directory, f"{month}.db.gz")
+
+    def months(self):
+        """Все месяцы, для которых есть архив, по возрастанию."""
+        result = set()
+        for name in os.listdir(self.directory):
+            if name.endswith(".db.gz"):
+                result.add(name[:-6])
+            elif name.endswith(".db"):
+                result.add(name[:-3])
+        return sorted(result)
+
+    def months_between(self, start_ts=None, end_ts=None):
+        """Месяцы с архивами, пересекающиеся с [start_ts, end_ts)."""
+        result = []
+        for month in self.months():
+            m_start, m_end = month_bounds(month)
+            if (start_ts is None or m_end > start_ts) and (end_ts is None or m_start < end_ts):
+                result.append(month)
+        return result
+
+    # ---- запись ----
+
+    def write(self, table: str, columns, rows):
+        """Добавляет строки в архивы их месяцев. Повторная запись той же строки
+        (по id) её заменяет, поэтому пачку можно безопасно повторить после сбоя."""
+        if not rows:
+            return
+        ts_idx = columns.index(TS_COLUMNS[table])
+        by_month = {}
+        for row in rows:
+            by_month.setdefault(month_of(row[ts_idx]), []).append(row)
+        with self._lock:
+            for month, month_rows in by_month.items():
+                conn = self._open_writable(month)
+                try:
+                    self._ensure_table(conn, table, columns)
+                    placeholders = ", ".join("?" for _ in columns)
+                    with conn:
+                        conn.executemany(
+                            f"INSERT OR REPLACE INTO {table} ({', '.join(columns)}) VALUES ({placeholders})",
+                            month_rows
+                        )
+                finally:
+                    conn.close()
+
+    def _open_writable(self, month):
+        path = self._open_path(month)
+        sealed = self._sealed_path(month)
+        if not os.path.exists(path) and os.path.exists(sealed):
+            # Месяц уже сжат (например, срок хранения уменьшили) — распакуем и допишем
+            with gzip.open(sealed, "rb") as src, open(path, "wb") as dst:
+                shutil.copyfileobj(src, dst)
+            os.remove(sealed)
+        return sqlite3.connect(path)
+
+    @staticmethod
+    def _ensure_table(conn, table, columns):
+        ts_column = TS_COLUMNS[table]
+        others = ", ".join(c for c in columns if c != "id")
+        conn.execute(f"CREATE TABLE IF NOT EXISTS {table} (id INTEGER PRIMARY KEY, {others})")
+        conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_{ts_column} ON {table} ({ts_column})")
+        existing = {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+        for column in columns:
+            if column not in existing:
+                # Схема основной БД выросла — добавляем новые колонки и в архив
+                conn.execute(f"ALTER TABLE {table} ADD COLUMN {column}")
+
+    def seal_before(self, cutoff_ts):
+        """Сжимает архивы месяцев, которые целиком старше cutoff_ts. Возвращает их список."""
+        sealed = []
+        with self._lock:
+            for month in self.months():
+                path = self._open_path(month)
+                if not os.path.exists(path) or month_bounds(month)[1] > cutoff_ts:
+                    continue
+                conn = sqlite3.connect(path)
+                try:
+                    conn.execute("VACUUM")
+                finally:
+                    conn.close()
+                with open(path, "rb") as src, gzip.open(self._sealed_path(month), "wb") as dst:
+                    shutil.copyfileobj(src, dst)
+                os.remove(path)
+                sealed.append(month)
+        if sealed:
+            logger.info("Архив: сжаты месяцы %s", ", ".join(sealed))
+        return sealed
+
+    # ---- чтение ----
+
+    def open_readonly(self, month):
+        """Соединение только для чтения с архивом месяца (сжатый распаковывается во временный каталог)."""
+        with self._lock:
+            path = self._open_path(month)
+            if not os.path.exists(path):
+                sealed = self._sealed_path(month)
+                path = os.path.join(self._cache_dir, f"{month}.db")
+                if not os.path.exists(path) or os.path.getmtime(path) < os.path.getmtime(sealed):
+                    tmp = path + ".tmp"
+                    with gzip.open(sealed, "rb") as src, open(tmp, "wb") as dst:
+                        shutil.copyfileobj(src, dst)
+                    os.replace(tmp, path)
+            # Генераторы чтения продолжаются в разных потоках пула, поэтому check_same_thread=False
+            return sqlite3.connect(f"file:{path}?mode=ro", uri=True, check_same_thread=False)
+
+    def iter_transactions(self, month, start_ts=None, end_ts=None, department=None, chunk_size=1000):
+        """Транзакции месяца пачками в формате database.get_export_chunk."""
+        conn = self.open_readonly(month)
+        try:
+            if not _has_table(conn, "transactions"):
+                return
+            conditions, params = ["1=1"], []
+            if start_ts is not None:
+                conditions.append("created_ts >= ?")
+                params.append(start_ts)
+            if end_ts is not None:
+                conditions.append("created_ts < ?")
+                params.append(end_ts)
+            if department:
+                conditions.append("(from_department = ? OR to_department = ?)")
+                params += [department, department]
+            cursor = conn.execute(f"""
+                SELECT id, created_at, from_department, to_department, dish_name, dish_category,
+                       quantity, label_date, status, accepted_at, from_user_name
+                FROM transactions
+                WHERE {" AND ".join(conditions)}
+                ORDER BY id
+            """, params)
+            while True:
+                rows = cursor.fetchmany(chunk_size)
+                if not rows:
+                    break
+                yield rows
+        finally:
+            conn.close()
+
+    def fetch_transactions(self, start_ts=None, end_ts=None, before_id=None, after_id=None, limit=20):
+        """До limit транзакций из архивов в формате database.get_transactions_page:
+        старше before_id (по убыванию id) или новее after_id (по возрастанию id)."""
+        months = self.months_between(start_ts, end_ts)
+        ascending = after_id is not None
+        if not ascending:
+            months = list(reversed(months))
+        result = []
+        for month in months:
+            conn = self.open_readonly(month)
+            try:
+                if not _has_table(conn, "transactions"):
+                    continue
+                conditions, params = ["1=1"], []
+                if start_ts is not None:
+                    conditions.append("created_ts >= ?")
+                    params.append(start_ts)
+                if end_ts is not None:
+                    conditions.append("created_ts < ?")
+                    params.append(end_ts)
+                if ascending:
+                    conditions.append("id > ?")
+                    params.append(after_id)
+                elif before_id is not None:
+                    conditions.append("id < ?")
+                    params.append(before_id)
+                result += conn.execute(f"""
+                    SELECT id, from_department, to_department, dish_name, quantity,
+                           label_date, created_at, accepted_at, status
+                    FROM transactions
+                    WHERE {" AND ".join(conditions)}
+                    ORDER BY id {"ASC" if ascending else "DESC"}
+                    LIMIT ?
+                """, params + [limit - len(result)]).fetchall()
+            finally:
+                conn.close()
+            if len(result) >= limit:
+                break
+        return result
+
+
+def _has_table(conn, table):
+    return conn.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name=?", (table,)).fetchone() is not None
+
+
+async def get_transactions_page(adb, archive, start_ts=None, end_ts=None, before_id=None, after_id=None,
+                                limit=20, cutoff_ts=None):
+    """database.get_transactions_page, который при необходимости дочитывает архивы.
+
+    Архивы читаются, только если период начинается раньше cutoff_ts (границы
+    срока хранения); id в архиве и в основной БД не пересекаются, поэтому
+    страницы склеиваются по id.
+    """
+    rows, has_older, has_newer = await adb.get_transactions_page(start_ts, end_ts, before_id, after_id, limit)
+    if archive is None or (start_ts is not None and cutoff_ts is not None and start_ts >= cutoff_ts):
+        return rows, has_older, has_newer
+
+    ascending = after_id is not None
+    hot_has_more = has_newer if ascending else has_older
+    loop = asyncio.get_running_loop()
+    archived = await loop.run_in_executor(
+        None, archive.fetch_transactions, start_ts, end_ts, before_id, after_id, limit + 1
+    )
+    if not archived:
+        return rows, has_older, has_newer
+
+    # Склеиваем в порядке обхода: по убыванию id для "старше", по возрастанию для "новее"
+    merged = sorted(rows + archived, key=lambda r: r[0], reverse=not ascending)
+    more = hot_has_more or len(merged) > limit
+    page = merged[:limit]
+    if ascending:
+        page.reverse()
+        return page, True, more
+    return page, more, before_id is not None
@@ -0,0 +1,265 @@
+# async_db.py
+import asyncio
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import database as db
+from config import DB_QUEUE_SIZE, DB_READ_POOL_SIZE, LOG_FLUSH_INTERVAL
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+
+class AsyncDatabase:
+    """Асинхронная обёртка над хранилищем (database.py или другой модуль из backends.BACKENDS).
+
+    Все обращения к хранилищу выполняются в одном выделенном потоке, которому
+    принадлежит соединение. Хендлеры только ставят задачу в ограниченную
+    очередь и ждут future, поэтому медленный commit или тяжёлый отчёт
+    не останавливают event loop.
+
+    Любая публичная функция хранилища доступна как корутина с тем же
+    именем, но без аргумента conn:
+        user = await adb.get_user_by_telegram_id(tg_id)
+
+    Тяжёлые чтения (отчёты, выгрузки, входящие) идут через adb.reader —
+    пул соединений только для чтения (ReadPool) с тем же набором функций.
+    """
+
+    def __init__(self, conn, backend=db, max_queue=DB_QUEUE_SIZE, read_pool_size=DB_READ_POOL_SIZE):
+        self.conn = conn
+        self.backend = backend
+        self.max_queue = max_queue
+        self._queue = queue.Queue()
+        self._slots = None  # asyncio.Semaphore, создаётся в start() внутри loop
+        self._thread = None
+        self._flusher = None
+        self._wrappers = {}
+        # Соединения для чтения открываются здесь, до запуска потока БД: open_reader читает conn
+        pool = ReadPool(self, read_pool_size) if read_pool_size > 0 else None
+        self.reader = pool if pool is not None and pool.available else self
+
+    # ---- жизненный цикл ----
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._slots = asyncio.Semaphore(self.max_queue)
+        self._thread = threading.Thread(target=self._worker, name="db-writer", daemon=True)
+        self._thread.start()
+        self._flusher = asyncio.get_running_loop().create_task(self._flush_logs_periodically())
+
+    async def close(self):
+        """Дожидается выполнения уже поставленных задач, сбрасывает буфер журнала
+        и останавливает поток."""
+        if self._thread is None:
+            return
+        if self._flusher is not None:
+            self._flusher.cancel()
+            self._flusher = None
+        await self.run(self.backend.flush_logs)
+        self._queue.put(_STOP)
+        await asyncio.get_running_loop().run_in_executor(None, self._thread.join)
+        self._thread = None
+        if self.reader is not self:
+            await self.reader.close()
+
+    def stats(self):
+        stats = {"queued": self._queue.qsize()}
+        if self.reader is not self:
+            stats.update(self.reader.stats())
+        return stats
+
+    def _worker(self):
+        while True:
+            item = self._queue.get()
+            if item is _STOP:
+                break
+            loop, future, func, args, kwargs, queued_at = item
+            # Запросы учитываются по имени функции хранилища: это и есть "имя запроса"
+            labels = (("query", getattr(func, "__name__", "run")),)
+            started = time.perf_counter()
+            metrics.observe("db_queue_wait_seconds", started - queued_at)
+            try:
+                result = func(self.conn, *args, **kwargs)
+            except BaseException as e:
+                metrics.inc("db_query_errors_total", labels)
+                loop.call_soon_threadsafe(_set_exception, future, e)
+            else:
+                loop.call_soon_threadsafe(_set_result, future, result)
+            metrics.observe("db_query_seconds", time.perf_counter() - started, labels)
+
+    # ---- выполнение задач ----
+
+    async def run(self, func, *args, **kwargs):
+        """Выполняет func(conn, *args, **kwargs) в потоке БД и возвращает результат.
+
+        Очередь ограничена max_queue задачами: при переполнении вызывающая
+        корутина ждёт свободного места, а не растит очередь бесконечно.
+        """
+        if self._thread is None:
+            self.start()
+        loop = asyncio.get_running_loop()
+        async with self._slots:
+            future = loop.create_future()
+            self._queue.put((loop, future, func, args, kwargs, time.perf_counter()))
+            return await future
+
+    async def transaction(self, func, *args, **kwargs):
+        """Выполняет func(conn, ...) внутри unit_of_work хранилища: все записи
+        функции фиксируются одним commit, при ошибке — откатываются."""
+        def in_unit_of_work(conn, *a, **kw):
+            with self.backend.unit_of_work(conn):
+                return func(conn, *a, **kw)
+        in_unit_of_work.__name__ = getattr(func, "__name__", "transaction")
+        return await self.run(in_unit_of_work, *args, **kwargs)
+
+    async def _flush_logs_periodically(self):
+        # Сбрасывает буфер журнала по времени, даже если новых действий нет
+        log_buffer = getattr(self.backend, "log_buffer", None)
+        if log_buffer is None:
+            return
+        while True:
+            await asyncio.sleep(LOG_FLUSH_INTERVAL)
+            if log_buffer.due():
+                try:
+                    await self.run(self.backend.flush_logs_if_due)
+                except Exception:
+                    logger.exception("Не удалось записать буфер журнала")
+
+    async def get_user_by_telegram_id(self, telegram_id):
+        """Проверка пользователя на каждом апдейте: при попадании в кэш
+        отвечает сразу из памяти, без очереди к потоку БД."""
+        cache = getattr(self.backend, "user_cache", None)
+        row = cache.get_by_telegram_id(telegram_id) if cache is not None else None
+        if row is not None:
+            return row
+        return await self.run(self.backend.load_user_by_telegram_id, telegram_id)
+
+    async def get_user(self, user_id):
+        cache = getattr(self.backend, "user_cache", None)
+        row = cache.get_by_id(user_id) if cache is not None else None
+        if row is not None:
+            return row
+        return await self.run(self.backend.load_user, user_id)
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        wrapper = self._wrappers.get(name)
+        if wrapper is None:
+            func = getattr(self.backend, name, None)
+            if func is None or not callable(func):
+                raise AttributeError(name)
+
+            async def wrapper(*args, **kwargs):
+                return await self.run(func, *args, **kwargs)
+
+            wrapper.__name__ = name
+            self._wrappers[name] = wrapper
+        return wrapper
+
+
+class ReadPool:
+    """Пул соединений только для чтения (backend.open_reader) для тяжёлых запросов.
+
+    В режиме WAL читатели не блокируют единственное пишущее соединение и не
+    ждут его, поэтому отчёт или выгрузка выполняются параллельно с передачами,
+    а не в общей очереди потока БД. Не больше size запросов одновременно,
+    соединений — столько же. Функции хранилища доступны как у AsyncDatabase:
+        summary = await adb.reader.get_rollup_summary(start_day, end_day)
+    Читатель видит всё, что зафиксировано commit к началу запроса.
+    """
+
+    def __init__(self, adb, size):
+        self.adb = adb
+        self.size = size
+        self._idle = queue.SimpleQueue()
+        self._conns = []
+        self._lock = threading.Lock()
+        self._executor = None
+        self._slots = None
+        self._wrappers = {}
+        # Хранилище без соединений для чтения (в памяти, не WAL) — пул не используется
+        open_reader = getattr(adb.backend, "open_reader", None)
+        first = open_reader(adb.conn) if open_reader is not None else None
+        self.available = first is not None
+        if first is not None:
+            self._conns.append(first)
+            self._idle.put(first)
+
+    def stats(self):
+        return {"read_connections": len(self._conns)}
+
+    async def close(self):
+        if self._executor is not None:
+            await asyncio.get_running_loop().run_in_executor(None, self._executor.shutdown)
+            self._executor = None
+        for conn in self._conns:
+            conn.close()
+        self._conns = []
+
+    async def run(self, func, *args, **kwargs):
+        """Выполняет func(соединение для чтения, *args, **kwargs) в пуле потоков чтения."""
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(self.size, thread_name_prefix="db-reader")
+            self._slots = asyncio.Semaphore(self.size)
+        async with self._slots:
+            return await asyncio.get_running_loop().run_in_executor(
+                self._executor, self._call, func, args, kwargs, time.perf_counter()
+            )
+
+    def _call(self, func, args, kwargs, queued_at):
+        labels = (("query", getattr(func, "__name__", "run")), ("conn", "read"))
+        started = time.perf_counter()
+        metrics.observe("db_queue_wait_seconds", started - queued_at)
+        conn = self._acquire()
+        try:
+            return func(conn, *args, **kwargs)
+        except BaseException:
+            metrics.inc("db_query_errors_total", labels)
+            raise
+        finally:
+            self._idle.put(conn)
+            metrics.observe("db_query_seconds", time.perf_counter() - started, labels)
+
+    def _acquire(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        conn = self.adb.backend.open_reader(self.adb.conn)
+        with self._lock:
+            self._conns.append(conn)
+        return conn
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        wrapper = self._wrappers.get(name)
+        if wrapper is None:
+            func = getattr(self.adb.backend, name, None)
+            if func is None or not callable(func):
+                raise AttributeError(name)
+
+            async def wrapper(*args, **kwargs):
+                return await self.run(func, *args, **kwargs)
+
+            wrapper.__name__ = name
+            self._wrappers[name] = wrapper
+        return wrapper
+
+
+def _set_result(future, result):
+    if not future.cancelled():
+        future.set_result(result)
+
+
+def _set_exception(future, exc):
+    if not future.cancelled():
+        future.set_exception(exc)
@@ -0,0 +1,91 @@
+# audit.py
+import re
+
+# Коды действий журнала (logs.action). Коды только добавляются, записанные не меняются.
+OTHER = 0               # строка старого формата, которую не удалось разобрать (текст — в logs.note)
+TRANSFER_CREATED = 1
+TRANSFER_ACCEPTED = 2
+TRANSFER_REJECTED = 3
+BATCH_CREATED = 4
+BATCH_ACCEPTED = 5
+BATCH_REJECTED = 6
+
+# Имена действий для команды /audit и их описание в истории
+ACTIONS = {
+    "create": TRANSFER_CREATED,
+    "accept": TRANSFER_ACCEPTED,
+    "reject": TRANSFER_REJECTED,
+    "batch": BATCH_CREATED,
+    "batch_accept": BATCH_ACCEPTED,
+    "batch_reject": BATCH_REJECTED,
+}
+TITLES = {
+    OTHER: "запись старого формата",
+    TRANSFER_CREATED: "создал передачу",
+    TRANSFER_ACCEPTED: "принял передачу",
+    TRANSFER_REJECTED: "отклонил передачу",
+    BATCH_CREATED: "создал партию",
+    BATCH_ACCEPTED: "принял партию",
+    BATCH_REJECTED: "отклонил партию",
+}
+
+USAGE = (
+    "История действий, новые сверху:\n"
+    "/audit 12 — пользователь с id 12\n"
+    "/audit #42 — передача #42 (и её партия)\n"
+    f"/audit accept — действие: {', '.join(ACTIONS)}"
+)
+
+# Строки журнала до перехода на коды (migrations, версия 8)
+_LEGACY = [
+    (re.compile(r"Create transaction #(\d+)$"), TRANSFER_CREATED),
+    (re.compile(r"Accepted transaction #(\d+)$"), TRANSFER_ACCEPTED),
+    (re.compile(r"Rejected transaction #(\d+)$"), TRANSFER_REJECTED),
+    (re.compile(r"Create batch #(\d+) \((\d+) items\)$"), BATCH_CREATED),
+    (re.compile(r"Accepted batch #(\d+) \((\d+) items\)$"), BATCH_ACCEPTED),
+    (re.compile(r"Rejected batch #(\d+) \((\d+) items\)$"), BATCH_REJECTED),
+]
+
+_BATCH_ACTIONS = (BATCH_CREATED, BATCH_ACCEPTED, BATCH_REJECTED)
+
+
+def parse_legacy(text):
+    """Текст старой строки журнала -> (код, transaction_id, batch_id, items, note)."""
+    text = (text or "").strip()
+    for pattern, action in _LEGACY:
+        match = pattern.match(text)
+        if match:
+            if action in _BATCH_ACTIONS:
+                return action, None, int(match.group(1)), int(match.group(2)), None
+            return action, int(match.group(1)), None, None, None
+    return OTHER, None, None, None, text
+
+def parse_query(arg: str):
+    """Аргумент /audit -> (вид, значение): ("u", user_id), ("t", trans_id) или ("a", код действия).
+    ValueError, если аргумент не распознан."""
+    arg = (arg or "").strip()
+    if arg.startswith("#") and arg[1:].isdigit():
+        return "t", int(arg[1:])
+    if arg.isdigit():
+        return "u", int(arg)
+    if arg.lower() in ACTIONS:
+        return "a", ACTIONS[arg.lower()]
+    raise ValueError(arg)
+
+def query_filter(kind: str, value: int) -> dict:
+    """(вид, значение) из parse_query или callback_data -> аргументы get_audit_page."""
+    if kind == "u":
+        return {"user_id": value}
+    if kind == "t":
+        return {"transaction_id": value}
+    if kind == "a" and value in TITLES:
+        return {"action": value}
+    raise ValueError(kind)
+
+def describe(action, transaction_id, batch_id, items, note) -> str:
+    if action == OTHER:
+        return note or TITLES[OTHER]
+    title = TITLES.get(action, f"действие {action}")
+    if action in _BATCH_ACTIONS:
+        return f"{title} П{batch_id}" + (f" ({items} поз.)" if items else "")
+    return f"{title} #{transaction_id}"
@@ -0,0 +1,56 @@
+# backends.py
+import importlib
+
+from config import DB_BACKEND, DB_PATH
+
+# Хранилище данных — модуль со свободными функциями f(conn, ...), как database.py.
+# Хендлеры и фоновые задачи обращаются к нему только через async_db.AsyncDatabase
+# (await adb.<функция>(...) без conn), поэтому движок меняется в config.DB_BACKEND,
+# а main.py и хендлеры не трогаются. Новый движок — модуль с функциями ниже
+# и init_db(path) -> conn, добавленный в BACKENDS.
+BACKENDS = {
+    "sqlite": "database",
+    "memory": "memory_db",
+}
+
+# Интерфейс хранилища: пользователи, блюда, передачи и партии, журнал,
+# отчёты, история действий, остатки и очистка по сроку хранения
+BACKEND_FUNCTIONS = (
+    "init_db", "unit_of_work",
+    # журнал
+    "log_action", "flush_logs", "flush_logs_if_due",
+    # пользователи
+    "get_user_by_telegram_id", "load_user_by_telegram_id", "get_user", "load_user", "create_user",
+    "approve_user", "set_user_role", "get_admin_telegram_ids", "get_department_telegram_ids",
+    "get_all_pending_users", "is_approved", "get_role",
+    # блюда
+    "add_dish", "get_all_dishes",
+    # передачи
+    "create_transaction", "create_transfer", "create_batch", "get_pending_transactions_for_department",
+    "accept_transaction", "reject_transaction", "settle_transaction", "settle_pending", "settle_batch",
+    # отчёты
+    "get_transactions_by_date", "get_report_summary", "get_transactions_page", "get_export_chunk",
+    "rebuild_rollup", "get_rollup_summary",
+    # журнал действий
+    "get_audit_page",
+    # остатки
+    "check_stock", "rebuild_stock", "get_stock", "get_expiring_stock",
+    # очистка
+    "get_expired_id_range", "delete_expired_batch", "archive_expired_batch", "compact_database",
+)
+
+
+def load_backend(name=DB_BACKEND):
+    """Модуль хранилища по имени из BACKENDS; проверяет, что он реализует весь интерфейс."""
+    if name not in BACKENDS:
+        raise ValueError(f"Неизвестное хранилище DB_BACKEND={name!r}, доступны: {', '.join(BACKENDS)}")
+    module = importlib.import_module(BACKENDS[name])
+    missing = [func for func in BACKEND_FUNCTIONS if not callable(getattr(module, func, None))]
+    if missing:
+        raise TypeError(f"Хранилище {name} не реализует: {', '.join(missing)}")
+    return module
+
+def open_backend(name=DB_BACKEND, path=DB_PATH):
+    """(модуль хранилища, соединение) для AsyncDatabase."""
+    backend = load_backend(name)
+    return backend, backend.init_db(path)
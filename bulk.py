@@ -0,0 +1,56 @@
+# bulk.py
+import html
+
+import timeutil
+from config import BULK_MAX_LINES
+
+FORMAT_HINT = (
+    "Отправьте список позиций, по одной в строке:\n"
+    "<b>Блюдо; количество; дата на этикетке</b>\n"
+    "Блюдо — название из каталога или его номер (#12)."
+)
+
+
+def parse_lines(text: str, catalog, need_label: bool, max_lines=BULK_MAX_LINES):
+    """Разбирает вставленный список позиций для передачи партией.
+    Ошибки — готовый HTML: введённый текст в них экранирован.
+
+    Возвращает (items, errors): items — [(dish_id, qty, label_date), ...]
+    для database.create_batch (дата — в виде ДД.ММ.ГГГГ), errors — тексты ошибок по номерам строк.
+    Партия создаётся, только если ошибок нет.
+    """
+    lines = [line.strip() for line in (text or "").splitlines() if line.strip()]
+    if not lines:
+        return [], ["Список пуст."]
+    if len(lines) > max_lines:
+        return [], [f"Слишком много строк: {len(lines)}, максимум {max_lines}."]
+    items, errors = [], []
+    for n, line in enumerate(lines, 1):
+        parts = [part.strip() for part in line.split(";")]
+        if len(parts) not in (2, 3):
+            errors.append(f"Строка {n}: нужно «блюдо; количество; дата».")
+            continue
+        dish_id = catalog.find(parts[0])
+        if dish_id is None:
+            errors.append(f"Строка {n}: блюдо «{html.escape(parts[0])}» не найдено.")
+            continue
+        try:
+            qty = float(parts[1].replace(",", "."))
+        except ValueError:
+            errors.append(f"Строка {n}: количество «{html.escape(parts[1])}» — не число.")
+            continue
+        if qty <= 0:
+            errors.append(f"Строка {n}: количество должно быть больше нуля.")
+            continue
+        label_date = parts[2] if len(parts) == 3 and parts[2] else None
+        if need_label and label_date is None:
+            errors.append(f"Строка {n}: для этого цеха нужна дата на этикетке.")
+            continue
+        if label_date is not None:
+            try:
+                label_date = timeutil.format_label_date(timeutil.parse_label_date(label_date))
+            except ValueError:
+                errors.append(f"Строка {n}: «{html.escape(label_date)}» — не дата, нужно ДД.ММ.ГГГГ.")
+                continue
+        items.append((dish_id, qty, label_date))
+    return items, errors
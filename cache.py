@@ -0,0 +1,84 @@
+# cache.py
+import threading
+import time
+from collections import OrderedDict
+
+
+class UserCache:
+    """Ограниченный LRU-кэш записей users с временем жизни записи.
+
+    Ключ — внутренний id, дополнительный индекс — telegram_id.
+    Запись хранится как кортеж строки users:
+    (id, telegram_id, full_name, role, department, approved).
+    Кэш потокобезопасен: читается из event loop, заполняется из потока БД.
+    """
+
+    def __init__(self, max_size=1000, ttl=300.0):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._by_id = OrderedDict()  # id -> (row, expires_at)
+        self._tg_to_id = {}
+        self._lock = threading.Lock()
+
+    def get_by_telegram_id(self, telegram_id):
+        with self._lock:
+            user_id = self._tg_to_id.get(telegram_id)
+            return self._get_locked(user_id)
+
+    def get_by_id(self, user_id):
+        with self._lock:
+            return self._get_locked(user_id)
+
+    def _get_locked(self, user_id):
+        entry = self._by_id.get(user_id) if user_id is not None else None
+        if entry is None:
+            self.misses += 1
+            return None
+        row, expires_at = entry
+        if expires_at < time.monotonic():
+            self._drop_locked(user_id)
+            self.misses += 1
+            return None
+        self._by_id.move_to_end(user_id)
+        self.hits += 1
+        return row
+
+    def put(self, row):
+        if row is None:
+            return
+        user_id, telegram_id = row[0], row[1]
+        with self._lock:
+            self._drop_locked(user_id)
+            self._by_id[user_id] = (row, time.monotonic() + self.ttl)
+            self._tg_to_id[telegram_id] = user_id
+            while len(self._by_id) > self.max_size:
+                old_id, _ = next(iter(self._by_id.items()))
+                self._drop_locked(old_id)
+
+    def invalidate(self, user_id=None, telegram_id=None):
+        with self._lock:
+            if user_id is None and telegram_id is not None:
+                user_id = self._tg_to_id.get(telegram_id)
+            self._drop_locked(user_id)
+
+    def clear(self):
+        with self._lock:
+            self._by_id.clear()
+            self._tg_to_id.clear()
+
+    def _drop_locked(self, user_id):
+        entry = self._by_id.pop(user_id, None)
+        if entry is not None:
+            self._tg_to_id.pop(entry[0][1], None)
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "size": len(self._by_id),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / total if total else 0.0,
+            }
@@ -0,0 +1,139 @@
+# callbacks.py
+from aiogram import types
+from aiogram.dispatcher import FSMContext
+
+import metrics
+from config import DEPARTMENTS
+
+# Версия формата: кнопки из сообщений, отправленных до смены формата,
+# распознаются как устаревшие, а не разбираются неправильно
+VERSION = "1"
+SEP = ":"
+# Ограничение Telegram на callback_data, в байтах
+MAX_LENGTH = 64
+
+# Коды действий. Формат callback_data: <версия>:<код>[:<аргумент>...]
+ROLE = "r"                   # r:<w|l>                  — роль при регистрации
+DEPARTMENT = "d"             # d:<индекс цеха>          — цех при регистрации
+ADMIN_PENDING = "ap"         # список неподтверждённых
+ADMIN_APPROVE = "aa"         # aa:<user_id>
+ADMIN_ADD_DISH = "ad"
+ADMIN_CLEANUP = "ac"
+ADMIN_CLEANUP_STATUS = "as"
+ADMIN_ROLLUP = "ar"
+ADMIN_STOCK_CHECK = "sc"     # сверка остатков с transactions
+ADMIN_STOCK_REBUILD = "sr"
+MENU_TRANSFER = "mt"
+MENU_REPORTS = "mr"
+MENU_INCOMING = "mi"
+MENU_BULK = "mb"             # передача списком (партия)
+MENU_STOCK = "ms"            # остатки своего цеха
+TO_DEPARTMENT = "t"          # t:<индекс цеха>          — получатель передачи
+CATEGORIES = "c"             # c:<версия каталога>:<страница>
+DISH_PAGE = "p"              # p:<версия каталога>:<категория>:<страница>
+DISH = "s"                   # s:<dish_id>
+ACCEPT = "y"                 # y:<trans_id>
+REJECT = "n"                 # n:<trans_id>
+BATCH_ACCEPT = "ya"          # ya:<batch_id>
+BATCH_REJECT = "na"          # na:<batch_id>
+ACCEPT_ALL = "yy"            # yy:<max trans_id> — все ожидающие цеха с id не больше указанного
+SELECT_MODE = "sm"           # режим выбора нескольких передач
+TOGGLE = "st"                # st:<trans_id> — отметить/снять отметку
+ACCEPT_SELECTED = "ys"
+REJECT_SELECTED = "ns"
+REPORT = "rs"                # rs:<период>
+REPORT_DETAIL = "rd"         # rd:<период>:<o|n>:<id>
+REPORT_EXPORT = "rx"         # rx:<период>
+AUDIT_PAGE = "au"            # au:<u|t|a>:<id или код действия>:<ts>:<id> — история старше (ts, id)
+
+# Маршрут без ограничения по состоянию FSM
+ANY_STATE = "*"
+
+
+def encode(action: str, *args) -> str:
+    data = SEP.join((VERSION, action) + tuple(str(a) for a in args))
+    if len(data.encode()) > MAX_LENGTH:
+        raise ValueError(f"callback_data длиннее {MAX_LENGTH} байт: {data}")
+    return data
+
+def decode(data: str):
+    """callback_data -> (код, [аргументы]) или None, если формат чужой или устарел."""
+    parts = (data or "").split(SEP)
+    if len(parts) < 2 or parts[0] != VERSION:
+        return None
+    return parts[1], parts[2:]
+
+def department_index(name: str) -> int:
+    return DEPARTMENTS.index(name)
+
+def department_name(index) -> str:
+    """Индекс цеха из callback_data -> название (ValueError, если такого нет)."""
+    index = int(index)
+    if not 0 <= index < len(DEPARTMENTS):
+        raise ValueError(index)
+    return DEPARTMENTS[index]
+
+
+class CallbackRouter:
+    """Таблица маршрутов для всех inline-кнопок.
+
+    Вместо цепочки хендлеров с фильтрами Text(startswith=...), которые aiogram
+    проверяет по очереди, регистрируется один хендлер: он разбирает
+    callback_data и находит обработчик по коду действия одним поиском в словаре.
+
+        @router.route(callbacks.ACCEPT)
+        async def handle_accept(callback_query, state, trans_id): ...
+
+    state маршрута — состояние FSM (State, группа состояний, их список или
+    ANY_STATE), в котором кнопка действует; по умолчанию — вне диалога,
+    как у обычных хендлеров aiogram. Аргументы передаются строками.
+    """
+
+    def __init__(self):
+        self.routes = {}
+
+    def route(self, action: str, state=None):
+        states = _state_names(state)
+
+        def decorator(handler):
+            if action in self.routes:
+                raise ValueError(f"Код действия {action} уже занят")
+            # Аргументы после callback_query и state — столько же частей ждём в callback_data
+            self.routes[action] = (handler, states, handler.__code__.co_argcount - 2)
+            return handler
+        return decorator
+
+    def register(self, dispatcher):
+        dispatcher.register_callback_query_handler(self.dispatch, state=ANY_STATE)
+
+    async def dispatch(self, callback_query: types.CallbackQuery, state: FSMContext):
+        decoded = decode(callback_query.data)
+        route = self.routes.get(decoded[0]) if decoded else None
+        if route is None:
+            await callback_query.answer("Кнопка устарела. Откройте меню заново: /menu")
+            return
+        handler, states, arg_count = route
+        if len(decoded[1]) != arg_count:
+            await callback_query.answer("Некорректная кнопка.")
+            return
+        if states is not ANY_STATE and await state.get_state() not in states:
+            await callback_query.answer("Кнопка сейчас недоступна.")
+            return
+        metrics.set_handler(handler.__name__)
+        await handler(callback_query, state, *decoded[1])
+
+
+def _state_names(state):
+    if state == ANY_STATE:
+        return ANY_STATE
+    if state is None:
+        return {None}
+    if not isinstance(state, (list, tuple, set)):
+        state = [state]
+    names = set()
+    for item in state:
+        if hasattr(item, "all_states_names"):
+            names.update(item.all_states_names)
+        else:
+            names.add(getattr(item, "state", item))
+    return names
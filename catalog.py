@@ -0,0 +1,148 @@
+# catalog.py
+import asyncio
+
+from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup
+
+import callbacks
+from config import DISH_PAGE_SIZE
+
+NO_CATEGORY = "Без категории"
+
+
+class DishCatalog:
+    """Каталог блюд в памяти с заранее построенными клавиатурами.
+
+    Загружается из БД один раз и перечитывается, только когда меняется
+    dishes_version хранилища (его увеличивает add_dish). Блюда сгруппированы по
+    категориям, каждая категория разбита на страницы по DISH_PAGE_SIZE кнопок,
+    чтобы клавиатура не упиралась в лимиты Telegram.
+
+    callback_data содержит версию каталога: нажатие на кнопку от устаревшей
+    клавиатуры распознаётся, и пользователю показывается свежий список.
+      callbacks.CATEGORIES <ver> <page>         — страница списка категорий
+      callbacks.DISH_PAGE <ver> <cat> <page>    — страница блюд категории
+      callbacks.DISH <id>                       — выбор блюда
+    """
+
+    def __init__(self, page_size=DISH_PAGE_SIZE):
+        self.page_size = page_size
+        self.version = None
+        self.categories = []      # [(название категории, [(dish_id, name), ...]), ...]
+        self.names = {}           # dish_id -> (name, category)
+        self._by_name = {}        # название в нижнем регистре -> dish_id
+        self._category_pages = []  # [InlineKeyboardMarkup, ...]
+        self._dish_pages = {}     # (cat_idx, page) -> InlineKeyboardMarkup
+        self._reload_lock = asyncio.Lock()
+
+    async def ensure_loaded(self, adb):
+        if self.version == adb.backend.dishes_version:
+            return
+        # Перезагрузку после смены версии делает один хендлер, остальные ждут её
+        async with self._reload_lock:
+            version = adb.backend.dishes_version
+            if self.version == version:
+                return
+            dishes = await adb.get_all_dishes()
+            self.build(dishes, version)
+
+    def build(self, dishes, version):
+        grouped = {}
+        names = {}
+        for dish_id, name, category in dishes:
+            category = category or NO_CATEGORY
+            grouped.setdefault(category, []).append((dish_id, name))
+            names[dish_id] = (name, category)
+        self.categories = [(cat, sorted(items, key=lambda x: x[1])) for cat, items in sorted(grouped.items())]
+        self.names = names
+        self._by_name = {}
+        for dish_id, (name, _) in sorted(names.items()):
+            self._by_name.setdefault((name or "").strip().casefold(), dish_id)
+        self.version = version
+        self._category_pages = self._render_category_pages()
+        self._dish_pages = {}
+        for cat_idx, (_, items) in enumerate(self.categories):
+            for page in range(self._page_count(len(items))):
+                self._dish_pages[(cat_idx, page)] = self._render_dish_page(cat_idx, page)
+
+    @property
+    def empty(self):
+        return not self.categories
+
+    def is_current(self, version) -> bool:
+        return str(self.version) == str(version)
+
+    def first_markup(self):
+        """Первая клавиатура шага выбора блюда: категории,
+        или сразу блюда, если категория всего одна."""
+        if len(self.categories) == 1:
+            return self.dish_page(0, 0)
+        return self.category_page(0)
+
+    def category_page(self, page: int):
+        if not self._category_pages:
+            return None
+        page = max(0, min(page, len(self._category_pages) - 1))
+        return self._category_pages[page]
+
+    def dish_page(self, cat_idx: int, page: int):
+        return self._dish_pages.get((cat_idx, page))
+
+    def find(self, text: str):
+        """dish_id по названию блюда (без учёта регистра) или по номеру вида "#12"; None, если нет."""
+        text = text.strip()
+        if text.startswith("#") and text[1:].isdigit():
+            dish_id = int(text[1:])
+            return dish_id if dish_id in self.names else None
+        return self._by_name.get(text.casefold())
+
+    def category_name(self, cat_idx: int):
+        if 0 <= cat_idx < len(self.categories):
+            return self.categories[cat_idx][0]
+        return None
+
+    # ---- построение клавиатур ----
+
+    def _page_count(self, n):
+        return max(1, (n + self.page_size - 1) // self.page_size)
+
+    def _nav_row(self, prefix, page, pages):
+        # prefix — код действия и аргументы перед номером страницы
+        row = []
+        if page > 0:
+            row.append(InlineKeyboardButton("◀", callback_data=callbacks.encode(*prefix, page - 1)))
+        if pages > 1:
+            row.append(InlineKeyboardButton(f"{page + 1}/{pages}", callback_data=callbacks.encode(*prefix, page)))
+        if page < pages - 1:
+            row.append(InlineKeyboardButton("▶", callback_data=callbacks.encode(*prefix, page + 1)))
+        return row
+
+    def _render_category_pages(self):
+        pages = self._page_count(len(self.categories))
+        result = []
+        for page in range(pages):
+            markup = InlineKeyboardMarkup(row_width=2)
+            start = page * self.page_size
+            for cat_idx in range(start, min(start + self.page_size, len(self.categories))):
+                cat, items = self.categories[cat_idx]
+                markup.add(InlineKeyboardButton(
+                    f"{cat} ({len(items)})", callback_data=callbacks.encode(callbacks.DISH_PAGE, self.version, cat_idx, 0)
+                ))
+            nav = self._nav_row((callbacks.CATEGORIES, self.version), page, pages)
+            if nav:
+                markup.row(*nav)
+            result.append(markup)
+        return result
+
+    def _render_dish_page(self, cat_idx, page):
+        _, items = self.categories[cat_idx]
+        pages = self._page_count(len(items))
+        markup = InlineKeyboardMarkup(row_width=2)
+        start = page * self.page_size
+        for dish_id, name in items[start:start + self.page_size]:
+            markup.add(InlineKeyboardButton(name, callback_data=callbacks.encode(callbacks.DISH, dish_id)))
+        nav = self._nav_row((callbacks.DISH_PAGE, self.version, cat_idx), page, pages)
+        if nav:
+            markup.row(*nav)
+        if len(self.categories) > 1:
+            markup.add(InlineKeyboardButton("« Категории", callback_data=callbacks.encode(callbacks.CATEGORIES, self.version, 0)))
+        return markup
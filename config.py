@@ -11,9 +11,121 @@ BOT_TOKEN = os.getenv("BOT_TOKEN", "7735698208:AAHC7w-UJ69p45Jx7OnzS2yG7HgyFTGV9
 # Например, чтобы не плодить "ручные" SQL-запросы, можно задать себя как "первого администратора".
 SUPER_ADMIN_TG_ID = os.getenv("SUPER_ADMIN_TG_ID", None)
 
+# Режим получения апдейтов: "polling" (long polling) или "webhook"
+RUN_MODE = os.getenv("RUN_MODE", "polling")
+
+# Пропускать ли накопившиеся апдейты при старте. По умолчанию нет:
+# сообщения, пришедшие во время перезапуска, будут обработаны.
+SKIP_UPDATES = os.getenv("SKIP_UPDATES", "0") == "1"
+
+# Настройки webhook. WEBHOOK_URL — внешний адрес (https://example.com), если пуст,
+# webhook в Telegram не регистрируется (удобно для локальной проверки).
+# WEBHOOK_SECRET проверяется в заголовке X-Telegram-Bot-Api-Secret-Token.
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+WEBAPP_HOST = os.getenv("WEBAPP_HOST", "0.0.0.0")
+WEBAPP_PORT = int(os.getenv("WEBAPP_PORT", "8080"))
+WEBHOOK_WORKERS = int(os.getenv("WEBHOOK_WORKERS", "8"))
+WEBHOOK_QUEUE_SIZE = int(os.getenv("WEBHOOK_QUEUE_SIZE", "1000"))
+WEBHOOK_DRAIN_TIMEOUT = float(os.getenv("WEBHOOK_DRAIN_TIMEOUT", "20"))
+
+# Метрики в формате Prometheus: в режиме webhook они доступны на GET /metrics
+# того же сервера, в режиме polling — на отдельном порту METRICS_PORT (0 — не поднимать)
+METRICS_HOST = os.getenv("METRICS_HOST", "0.0.0.0")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+
+# Хранилище данных: "sqlite" — файл DB_PATH, "memory" — в памяти процесса,
+# без записи на диск (для тестов и нагрузочных прогонов; данные теряются при остановке)
+DB_BACKEND = os.getenv("DB_BACKEND", "sqlite")
+
+# Путь к файлу базы данных
+DB_PATH = os.getenv("DB_PATH", "factory.db")
+
+# Хранилище состояний диалогов (FSM): "sqlite" — переживает перезапуск, "memory" — как раньше.
+# FSM_TTL — через сколько секунд неактивности диалог считается брошенным,
+# FSM_FLUSH_INTERVAL — как часто изменения состояний сбрасываются в файл
+FSM_STORAGE = os.getenv("FSM_STORAGE", "sqlite")
+FSM_DB_PATH = os.getenv("FSM_DB_PATH", "fsm.db")
+FSM_TTL = float(os.getenv("FSM_TTL", str(24 * 3600)))
+FSM_FLUSH_INTERVAL = float(os.getenv("FSM_FLUSH_INTERVAL", "2"))
+
+# Профиль SQLite для factory.db: журнал WAL (чтение не блокирует запись),
+# synchronous (NORMAL в WAL не портит БД при сбое, теряются лишь последние commit),
+# кэш страниц на соединение (КиБ), размер отображения файла в память (байт, 0 — выкл.)
+# и сколько ждать занятой блокировки, прежде чем вернуть "database is locked" (мс)
+DB_SYNCHRONOUS = os.getenv("DB_SYNCHRONOUS", "NORMAL")
+DB_CACHE_SIZE_KB = int(os.getenv("DB_CACHE_SIZE_KB", "16384"))
+DB_MMAP_SIZE = int(os.getenv("DB_MMAP_SIZE", str(128 * 1024 * 1024)))
+DB_BUSY_TIMEOUT_MS = int(os.getenv("DB_BUSY_TIMEOUT_MS", "5000"))
+
+# Соединения только для чтения для отчётов, выгрузок и входящих: тяжёлые чтения
+# идут параллельно с записью, а не в общей очереди потока БД (0 — не использовать)
+DB_READ_POOL_SIZE = int(os.getenv("DB_READ_POOL_SIZE", "3"))
+
+# Максимальное число запросов к БД, ожидающих выполнения в потоке БД.
+# Если очередь заполнена, хендлеры ждут, а не накапливают задачи без ограничений.
+DB_QUEUE_SIZE = int(os.getenv("DB_QUEUE_SIZE", "1000"))
+
+# Буфер журнала действий: сбрасывается в БД при накоплении N записей или раз в N секунд
+LOG_BUFFER_SIZE = int(os.getenv("LOG_BUFFER_SIZE", "200"))
+LOG_FLUSH_INTERVAL = float(os.getenv("LOG_FLUSH_INTERVAL", "5"))
+
+# Кэш пользователей в памяти: максимальное число записей и время жизни записи (сек)
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "5000"))
+USER_CACHE_TTL = float(os.getenv("USER_CACHE_TTL", "300"))
+
+# Максимум строк (позиций) в одной передаче списком
+BULK_MAX_LINES = int(os.getenv("BULK_MAX_LINES", "100"))
+
+# Сколько кнопок показывать на одной странице каталога блюд
+DISH_PAGE_SIZE = int(os.getenv("DISH_PAGE_SIZE", "10"))
+
+# Фоновая отправка уведомлений: число воркеров, размер очереди,
+# общий лимит сообщений в секунду, лимит в один чат и число повторов при сетевых ошибках
+NOTIFY_WORKERS = int(os.getenv("NOTIFY_WORKERS", "4"))
+NOTIFY_QUEUE_SIZE = int(os.getenv("NOTIFY_QUEUE_SIZE", "10000"))
+NOTIFY_GLOBAL_RATE = float(os.getenv("NOTIFY_GLOBAL_RATE", "25"))
+NOTIFY_PER_CHAT_RATE = float(os.getenv("NOTIFY_PER_CHAT_RATE", "1"))
+NOTIFY_MAX_RETRIES = int(os.getenv("NOTIFY_MAX_RETRIES", "3"))
+
+# Сколько транзакций показывать на одной странице подробного отчёта
+REPORT_PAGE_SIZE = int(os.getenv("REPORT_PAGE_SIZE", "20"))
+
+# Выгрузка CSV: строк в одной пачке из БД и сколько байт держать в памяти до сброса во временный файл
+EXPORT_CHUNK_SIZE = int(os.getenv("EXPORT_CHUNK_SIZE", "1000"))
+EXPORT_SPOOL_MAX_SIZE = int(os.getenv("EXPORT_SPOOL_MAX_SIZE", str(1024 * 1024)))
+
+# Часовой пояс производства: по нему считаются "сегодня" в отчётах и границы очистки
+TIMEZONE = os.getenv("TIMEZONE", "Europe/Moscow")
+
 # Период (в днях), по истечении которого старые данные будут удаляться
 OLD_DATA_RETENTION_DAYS = int(os.getenv("OLD_DATA_RETENTION_DAYS", "30"))
 
+# Архивировать ли устаревшие данные в помесячные сжатые файлы вместо удаления, и куда
+ARCHIVE_ENABLED = os.getenv("ARCHIVE_ENABLED", "1") == "1"
+ARCHIVE_DIR = os.getenv("ARCHIVE_DIR", "archive")
+
+# Фоновая очистка: размер пачки (по id), пауза между пачками (сек)
+# и период автоматического запуска (часы, 0 — только вручную)
+RETENTION_BATCH_SIZE = int(os.getenv("RETENTION_BATCH_SIZE", "500"))
+RETENTION_BATCH_PAUSE = float(os.getenv("RETENTION_BATCH_PAUSE", "0.05"))
+RETENTION_INTERVAL_HOURS = float(os.getenv("RETENTION_INTERVAL_HOURS", "24"))
+
+# Контроль сроков по дате на этикетке: какие цеха проверять, за сколько дней
+# до даты предупреждать и как часто проверять (часы, 0 — не проверять)
+EXPIRY_DEPARTMENTS = [d.strip() for d in os.getenv("EXPIRY_DEPARTMENTS", "Холодильник").split(",") if d.strip()]
+EXPIRY_WARN_DAYS = int(os.getenv("EXPIRY_WARN_DAYS", "1"))
+EXPIRY_CHECK_INTERVAL_HOURS = float(os.getenv("EXPIRY_CHECK_INTERVAL_HOURS", "6"))
+
+# Сводка администраторам о передачах без подтверждения (auto_done): одно сообщение
+# раз в ADMIN_DIGEST_INTERVAL_MINUTES вместо сообщения на каждую передачу
+# (0 — без сводки, сразу). Мимо сводки, с пометкой [СРОЧНО], всегда уходят
+# передачи с уже прошедшей датой на этикетке, а также позиции с количеством
+# от ADMIN_DIGEST_URGENT_QUANTITY (0 — порог по количеству не проверяется)
+ADMIN_DIGEST_INTERVAL_MINUTES = float(os.getenv("ADMIN_DIGEST_INTERVAL_MINUTES", "60"))
+ADMIN_DIGEST_URGENT_QUANTITY = float(os.getenv("ADMIN_DIGEST_URGENT_QUANTITY", "0"))
+
 # Список доступных цехов (для удобства)
 DEPARTMENTS = [
     "Пекарня",
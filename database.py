@@ -1,11 +1,187 @@
 # database.py
 import sqlite3
 import datetime
-from config import DEPARTMENTS, ROLE_ADMIN, ROLE_LEADER, ROLE_WORKER, OLD_DATA_RETENTION_DAYS
+import pathlib
+import threading
+import time
+from contextlib import contextmanager
+
+import audit
+import timeutil
+from cache import UserCache
+from metrics import metrics
+from config import (
+    DEPARTMENTS, ROLE_ADMIN, ROLE_LEADER, ROLE_WORKER, OLD_DATA_RETENTION_DAYS,
+    USER_CACHE_SIZE, USER_CACHE_TTL, LOG_BUFFER_SIZE, LOG_FLUSH_INTERVAL,
+    DB_SYNCHRONOUS, DB_CACHE_SIZE_KB, DB_MMAP_SIZE, DB_BUSY_TIMEOUT_MS
+)
+from migrations import migrate
+
+# Кэш записей users (по id и telegram_id). Пишущие функции ниже сами его обновляют.
+user_cache = UserCache(USER_CACHE_SIZE, USER_CACHE_TTL)
+
+# Версия справочника блюд: увеличивается при каждом изменении dishes,
+# по ней кэш каталога (catalog.py) понимает, что его нужно перечитать.
+dishes_version = 0
+
+class Connection(sqlite3.Connection):
+    """Соединение, которое знает, открыт ли сейчас unit_of_work.
+
+    Внутри unit_of_work функции записи не коммитят сами: все изменения
+    хендлера фиксируются одним commit при выходе из блока.
+    Каждый commit учитывается в metrics.
+    """
+
+    def __init__(self, database, *args, **kwargs):
+        super().__init__(database, *args, **kwargs)
+        self.path = database
+        self.journal_mode = None
+        self.uow_depth = 0
+        self.after_commit = []
+
+    def commit(self):
+        # Число и длительность commit — основная цена записи в SQLite
+        started = time.perf_counter()
+        super().commit()
+        metrics.inc("db_commits_total")
+        metrics.observe("db_commit_seconds", time.perf_counter() - started)
+
+    def on_commit(self, callback):
+        """Выполняет callback после фиксации текущих изменений
+        (сразу, если unit_of_work не открыт; не выполняет при откате)."""
+        if self.uow_depth:
+            self.after_commit.append(callback)
+        else:
+            callback()
+
+
+def _commit(conn):
+    if getattr(conn, "uow_depth", 0) == 0:
+        conn.commit()
+
+def _on_commit(conn, callback):
+    if isinstance(conn, Connection):
+        conn.on_commit(callback)
+    else:
+        callback()
+
+
+@contextmanager
+def unit_of_work(conn):
+    """Группирует записи в одну транзакцию и один commit.
+
+        with db.unit_of_work(conn):
+            trans_id = db.create_transaction(conn, ...)
+            db.accept_transaction(conn, ...)
+
+    Вложенные блоки присоединяются к внешнему. При исключении всё откатывается.
+    """
+    conn.uow_depth += 1
+    try:
+        yield conn
+    except BaseException:
+        conn.uow_depth -= 1
+        if conn.uow_depth == 0:
+            conn.rollback()
+            conn.after_commit.clear()
+        raise
+    conn.uow_depth -= 1
+    if conn.uow_depth == 0:
+        conn.commit()
+        callbacks, conn.after_commit = conn.after_commit, []
+        for callback in callbacks:
+            callback()
+
+
+class LogBuffer:
+    """Буфер записей журнала (write-behind).
+
+    log_action только добавляет строку в память; строки пишутся в logs одним
+    executemany, когда набралось LOG_BUFFER_SIZE записей или самая старая
+    ждёт дольше LOG_FLUSH_INTERVAL секунд. Журнал — вспомогательные данные,
+    поэтому при аварийном завершении допустима потеря последних секунд.
+    """
+
+    def __init__(self, max_size=LOG_BUFFER_SIZE, max_age=LOG_FLUSH_INTERVAL):
+        self.max_size = max_size
+        self.max_age = max_age
+        self.rows = []
+        self.first_at = None
+        self.lock = threading.Lock()
+
+    def add(self, row) -> bool:
+        """Добавляет строку; True, если пора сбрасывать буфер."""
+        with self.lock:
+            if not self.rows:
+                self.first_at = time.monotonic()
+            self.rows.append(row)
+            return self._due_locked()
+
+    def due(self) -> bool:
+        with self.lock:
+            return self._due_locked()
+
+    def _due_locked(self):
+        if not self.rows:
+            return False
+        return len(self.rows) >= self.max_size or time.monotonic() - self.first_at >= self.max_age
+
+    def take(self):
+        with self.lock:
+            rows, self.rows, self.first_at = self.rows, [], None
+            return rows
+
+
+log_buffer = LogBuffer()
+
+
+SYNCHRONOUS_MODES = ("OFF", "NORMAL", "FULL", "EXTRA")
+
+def apply_pragmas(conn):
+    """Профиль соединения из config: synchronous, cache_size, mmap_size, busy_timeout."""
+    synchronous = DB_SYNCHRONOUS.upper()
+    if synchronous not in SYNCHRONOUS_MODES:
+        raise ValueError(f"DB_SYNCHRONOUS={DB_SYNCHRONOUS!r}, допустимо: {', '.join(SYNCHRONOUS_MODES)}")
+    conn.execute(f"PRAGMA busy_timeout = {int(DB_BUSY_TIMEOUT_MS)}")
+    conn.execute(f"PRAGMA synchronous = {synchronous}")
+    conn.execute(f"PRAGMA cache_size = -{int(DB_CACHE_SIZE_KB)}")
+    conn.execute(f"PRAGMA mmap_size = {int(DB_MMAP_SIZE)}").fetchall()
+
+def open_reader(conn):
+    """Соединение только для чтения к файлу conn — для пула чтения AsyncDatabase.
+
+    None, если файл не в режиме WAL (без WAL читатель блокировал бы запись)
+    или БД в памяти. Функции database.py, которые только читают, работают
+    с ним так же, как с основным соединением.
+    """
+    if conn.journal_mode != "wal" or conn.path == ":memory:":
+        return None
+    reader = sqlite3.connect(pathlib.Path(conn.path).absolute().as_uri() + "?mode=ro",
+                             uri=True, check_same_thread=False)
+    register_functions(reader)
+    apply_pragmas(reader)
+    reader.execute("PRAGMA query_only = 1")
+    return reader
+
+def register_functions(conn):
+    """SQL-функции, которые используют запросы и миграции."""
+    conn.create_function("local_day", 1, timeutil.local_day, deterministic=True)
+    conn.create_function("parse_label_day", 1, timeutil.label_day, deterministic=True)
+
 
 # Инициализация / создание таблиц
 def init_db(db_path="factory.db"):
-    conn = sqlite3.connect(db_path, check_same_thread=False)
+    global dishes_version
+    conn = sqlite3.connect(db_path, check_same_thread=False, factory=Connection)
+    register_functions(conn)
+    # Для нового файла: место после очистки возвращается через incremental_vacuum
+    # (до перехода в WAL: auto_vacuum действует, только пока в файле нет таблиц)
+    conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+    # Одно пишущее соединение; отчёты читают через open_reader параллельно с записью
+    conn.journal_mode = conn.execute("PRAGMA journal_mode = WAL").fetchone()[0]
+    apply_pragmas(conn)
+    user_cache.clear()
+    dishes_version += 1
     cursor = conn.cursor()
 
     # Создаём таблицы (если не существуют)
@@ -55,23 +231,58 @@ def init_db(db_path="factory.db"):
     """)
 
     conn.commit()
+
+    # Индексы и изменения схемы для существующих файлов БД
+    migrate(conn)
     return conn
 
 
 # Функции для работы с БД
 
-def log_action(conn, user_id: int, action: str):
-    """Логирует действие пользователя (user_id, action, timestamp)."""
-    cursor = conn.cursor()
-    now = datetime.datetime.now().isoformat()
-    cursor.execute("INSERT INTO logs (user_id, action, timestamp) VALUES (?, ?, ?)",
-                   (user_id, action, now))
-    conn.commit()
+def log_action(conn, user_id: int, action: int, transaction_id=None, batch_id=None, items=None):
+    """Логирует действие пользователя: код audit.*, передача или партия, число позиций.
+    Запись попадает в буфер после commit операции (при откате её нет)
+    и пишется в БД пачкой (см. LogBuffer).
+    """
+    row = (timeutil.now_ts(), user_id, action, transaction_id, batch_id, items)
+    _on_commit(conn, lambda: _buffer_log(conn, row))
+
+def _buffer_log(conn, row):
+    if log_buffer.add(row):
+        flush_logs(conn)
+
+def flush_logs(conn):
+    """Записывает накопленные строки журнала одним executemany. Возвращает их число.
+    Внутри unit_of_work не пишет: откат операции не должен терять чужие строки журнала."""
+    if getattr(conn, "uow_depth", 0):
+        return 0
+    rows = log_buffer.take()
+    if rows:
+        conn.executemany(
+            "INSERT INTO logs (ts, user_id, action, transaction_id, batch_id, items) VALUES (?, ?, ?, ?, ?, ?)",
+            rows
+        )
+        _commit(conn)
+    return len(rows)
+
+def flush_logs_if_due(conn):
+    if log_buffer.due():
+        return flush_logs(conn)
+    return 0
 
 def get_user_by_telegram_id(conn, telegram_id: int):
+    row = user_cache.get_by_telegram_id(telegram_id)
+    if row is not None:
+        return row
+    return load_user_by_telegram_id(conn, telegram_id)
+
+def load_user_by_telegram_id(conn, telegram_id: int):
+    """Читает пользователя из БД в обход кэша и кладёт результат в кэш."""
     cursor = conn.cursor()
     cursor.execute("SELECT * FROM users WHERE telegram_id=?", (telegram_id,))
-    return cursor.fetchone()  # (id, telegram_id, full_name, role, department, approved)
+    row = cursor.fetchone()  # (id, telegram_id, full_name, role, department, approved)
+    user_cache.put(row)
+    return row
 
 def create_user(conn, telegram_id, full_name, role, department, approved=0):
     cursor = conn.cursor()
@@ -79,17 +290,31 @@ def create_user(conn, telegram_id, full_name, role, department, approved=0):
         INSERT INTO users (telegram_id, full_name, role, department, approved)
         VALUES (?, ?, ?, ?, ?)
     """, (telegram_id, full_name, role, department, approved))
-    conn.commit()
+    _commit(conn)
+    row = (cursor.lastrowid, telegram_id, full_name, role, department, approved)
+    _on_commit(conn, lambda: user_cache.put(row))
 
 def approve_user(conn, user_id: int):
     cursor = conn.cursor()
     cursor.execute("UPDATE users SET approved=1 WHERE id=?", (user_id,))
-    conn.commit()
+    _commit(conn)
+    user_cache.invalidate(user_id=user_id)
 
 def set_user_role(conn, user_id: int, role: str):
     cursor = conn.cursor()
     cursor.execute("UPDATE users SET role=? WHERE id=?", (role, user_id))
-    conn.commit()
+    _commit(conn)
+    user_cache.invalidate(user_id=user_id)
+
+def get_admin_telegram_ids(conn):
+    cursor = conn.cursor()
+    cursor.execute("SELECT telegram_id FROM users WHERE role=? AND approved=1", (ROLE_ADMIN,))
+    return [row[0] for row in cursor.fetchall()]
+
+def get_department_telegram_ids(conn, department):
+    cursor = conn.cursor()
+    cursor.execute("SELECT telegram_id FROM users WHERE department=? AND approved=1", (department,))
+    return [row[0] for row in cursor.fetchall()]
 
 def get_all_pending_users(conn):
     cursor = conn.cursor()
@@ -97,28 +322,35 @@ def get_all_pending_users(conn):
     return cursor.fetchall()
 
 def get_user(conn, user_id: int):
+    row = user_cache.get_by_id(user_id)
+    if row is not None:
+        return row
+    return load_user(conn, user_id)
+
+def load_user(conn, user_id: int):
+    """Читает пользователя по внутреннему id в обход кэша и кладёт результат в кэш."""
     cursor = conn.cursor()
     cursor.execute("SELECT * FROM users WHERE id=?", (user_id,))
-    return cursor.fetchone()
+    row = cursor.fetchone()
+    user_cache.put(row)
+    return row
 
 def is_approved(conn, user_id: int):
-    cursor = conn.cursor()
-    cursor.execute("SELECT approved FROM users WHERE id=?", (user_id,))
-    row = cursor.fetchone()
-    if row and row[0] == 1:
+    row = get_user(conn, user_id)
+    if row and row[5] == 1:
         return True
     return False
 
 def get_role(conn, user_id: int):
-    cursor = conn.cursor()
-    cursor.execute("SELECT role FROM users WHERE id=?", (user_id,))
-    row = cursor.fetchone()
-    return row[0] if row else None
+    row = get_user(conn, user_id)
+    return row[3] if row else None
 
 def add_dish(conn, name: str, category: str):
+    global dishes_version
     cursor = conn.cursor()
     cursor.execute("INSERT INTO dishes (name, category) VALUES (?, ?)", (name, category))
-    conn.commit()
+    _commit(conn)
+    dishes_version += 1
 
 def get_all_dishes(conn):
     cursor = conn.cursor()
@@ -127,58 +359,399 @@ def get_all_dishes(conn):
 
 def create_transaction(conn, from_user_id, from_dep, to_dep, dish_id, qty, label_date, status):
     cursor = conn.cursor()
-    now_str = datetime.datetime.now().isoformat()
+    now = timeutil.now()
+    now_str = now.isoformat()
+    now_ts = timeutil.to_ts(now)
     accepted_at = None
+    accepted_ts = None
     if status in ["auto_done", "accepted"]:  # Если авто-завершение
         accepted_at = now_str
+        accepted_ts = now_ts
+
+    label_day = timeutil.label_day(label_date)
 
     cursor.execute("""
         INSERT INTO transactions 
-        (from_user_id, from_department, to_department, dish_id, quantity, label_date, created_at, accepted_at, status)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-    """, (from_user_id, from_dep, to_dep, dish_id, qty, label_date, now_str, accepted_at, status))
-    conn.commit()
-    return cursor.lastrowid
+        (from_user_id, from_department, to_department, dish_id, quantity, label_date, label_day,
+         created_at, accepted_at, status, created_ts, accepted_ts)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    """, (from_user_id, from_dep, to_dep, dish_id, qty, label_date, label_day,
+          now_str, accepted_at, status, now_ts, accepted_ts))
+    trans_id = cursor.lastrowid
+    _rollup_add(conn, timeutil.local_day(now_ts), from_dep, to_dep, dish_id, status, 1, qty)
+    _stock_apply(conn, _stock_moves(from_dep, to_dep, dish_id, label_day, qty, None, status))
+    _commit(conn)
+    return trans_id
+
+def create_transfer(conn, from_user_id, from_dep, to_dep, dish_id, qty, label_date, status):
+    """Создаёт передачу и запись журнала одной транзакцией БД. Возвращает id передачи."""
+    with unit_of_work(conn):
+        trans_id = create_transaction(conn, from_user_id, from_dep, to_dep, dish_id, qty, label_date, status)
+        log_action(conn, from_user_id, audit.TRANSFER_CREATED, transaction_id=trans_id)
+    return trans_id
+
+def create_batch(conn, from_user_id, from_dep, to_dep, items, status):
+    """Создаёт партию передач: items — [(dish_id, qty, label_date), ...].
+
+    Партия, все её позиции (executemany), агрегаты daily_rollup, остатки
+    и запись журнала фиксируются одним commit. Возвращает id партии.
+    """
+    now = timeutil.now()
+    now_str = now.isoformat()
+    now_ts = timeutil.to_ts(now)
+    accepted_at, accepted_ts = (now_str, now_ts) if status in ("auto_done", "accepted") else (None, None)
+    items = [(dish_id, qty, label_date, timeutil.label_day(label_date)) for dish_id, qty, label_date in items]
+    with unit_of_work(conn):
+        batch_id = conn.execute("""
+            INSERT INTO transfer_batches (from_user_id, from_department, to_department, items, created_at, created_ts)
+            VALUES (?, ?, ?, ?, ?, ?)
+        """, (from_user_id, from_dep, to_dep, len(items), now_str, now_ts)).lastrowid
+        conn.executemany("""
+            INSERT INTO transactions
+            (from_user_id, from_department, to_department, dish_id, quantity, label_date, label_day,
+             created_at, accepted_at, status, created_ts, accepted_ts, batch_id)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, [(from_user_id, from_dep, to_dep, dish_id, qty, label_date, label_day,
+               now_str, accepted_at, status, now_ts, accepted_ts, batch_id)
+              for dish_id, qty, label_date, label_day in items])
+        # Агрегаты — одна строка upsert на блюдо, а не на позицию
+        totals = {}
+        for dish_id, qty, _, _ in items:
+            count, total = totals.get(dish_id, (0, 0))
+            totals[dish_id] = (count + 1, total + (qty or 0))
+        day = timeutil.local_day(now_ts)
+        conn.executemany(_ROLLUP_UPSERT, [
+            (day, from_dep, to_dep, dish_id, status, count, total)
+            for dish_id, (count, total) in totals.items()
+        ])
+        _stock_apply(conn, [
+            move for dish_id, qty, _, label_day in items
+            for move in _stock_moves(from_dep, to_dep, dish_id, label_day, qty, None, status)
+        ])
+        log_action(conn, from_user_id, audit.BATCH_CREATED, batch_id=batch_id, items=len(items))
+    return batch_id
 
 def get_pending_transactions_for_department(conn, department):
+    """Ожидающие приёмки передачи цеха: (id, блюдо, кол-во, откуда, дата этикетки, id партии)."""
     cursor = conn.cursor()
     cursor.execute("""
-        SELECT t.id, d.name, t.quantity, t.from_department, t.label_date
+        SELECT t.id, d.name, t.quantity, t.from_department, t.label_date, t.batch_id
         FROM transactions t
         JOIN dishes d ON t.dish_id = d.id
         WHERE t.to_department=? AND t.status='pending'
+        ORDER BY t.id
     """, (department,))
     return cursor.fetchall()
 
 def accept_transaction(conn, trans_id: int):
-    cursor = conn.cursor()
-    now_str = datetime.datetime.now().isoformat()
-    cursor.execute("""
-        UPDATE transactions 
-        SET status='accepted', accepted_at=? 
-        WHERE id=?
-    """, (now_str, trans_id))
-    conn.commit()
+    now = timeutil.now()
+    _change_status(conn, trans_id, "accepted", ", accepted_at=?, accepted_ts=?",
+                   (now.isoformat(), timeutil.to_ts(now)))
+    _commit(conn)
 
 def reject_transaction(conn, trans_id: int):
+    _change_status(conn, trans_id, "rejected")
+    _commit(conn)
+
+def _change_status(conn, trans_id: int, status: str, extra_set="", extra_params=()):
+    """Меняет статус транзакции, переносит её из одной строки daily_rollup в другую
+    и поправляет остатки. Коммит — на вызывающей стороне."""
+    row = conn.execute("""
+        SELECT created_ts, from_department, to_department, dish_id, quantity, status, label_day
+        FROM transactions WHERE id=?
+    """, (trans_id,)).fetchone()
+    if row is None or row[5] == status:
+        return False
+    created_ts, from_dep, to_dep, dish_id, qty, old_status, label_day = row
+    conn.execute(f"UPDATE transactions SET status=?{extra_set} WHERE id=?",
+                 (status, *extra_params, trans_id))
+    day = timeutil.local_day(created_ts)
+    _rollup_add(conn, day, from_dep, to_dep, dish_id, old_status, -1, -(qty or 0))
+    _rollup_add(conn, day, from_dep, to_dep, dish_id, status, 1, qty)
+    _stock_apply(conn, _stock_moves(from_dep, to_dep, dish_id, label_day, qty, old_status, status))
+    return True
+
+# ---- Суточные агрегаты (daily_rollup) ----
+
+_ROLLUP_UPSERT = """
+    INSERT INTO daily_rollup (day, from_department, to_department, dish_id, status, count, quantity)
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT (day, from_department, to_department, dish_id, status)
+    DO UPDATE SET count = count + excluded.count, quantity = quantity + excluded.quantity
+"""
+
+def _rollup_add(conn, day, from_dep, to_dep, dish_id, status, count, qty):
+    if day is None:
+        return
+    conn.execute(_ROLLUP_UPSERT, (day, from_dep, to_dep, dish_id, status, count, qty or 0))
+
+def rebuild_rollup(conn, since_day=None):
+    """Пересчитывает daily_rollup из transactions начиная с since_day ('YYYY-MM-DD').
+
+    По умолчанию — с самого раннего дня, за который ещё есть исходные строки:
+    агрегаты за дни, уже удалённые очисткой, сохраняются. Возвращает число строк агрегатов.
+    """
+    with unit_of_work(conn):
+        if since_day is None:
+            row = conn.execute("SELECT MIN(created_ts) FROM transactions").fetchone()
+            if row[0] is None:
+                return 0
+            since_day = timeutil.local_day(row[0])
+        since_ts = timeutil.day_start_ts(datetime.date.fromisoformat(since_day))
+        conn.execute("DELETE FROM daily_rollup WHERE day >= ?", (since_day,))
+        cursor = conn.execute("""
+            INSERT INTO daily_rollup (day, from_department, to_department, dish_id, status, count, quantity)
+            SELECT local_day(created_ts), from_department, to_department, dish_id, status,
+                   COUNT(*), COALESCE(SUM(quantity), 0)
+            FROM transactions
+            WHERE created_ts >= ?
+            GROUP BY 1, 2, 3, 4, 5
+        """, (since_ts,))
+        return cursor.rowcount
+
+def get_rollup_summary(conn, start_day=None, end_day=None, top_dishes=15):
+    """То же, что get_report_summary, но по daily_rollup за дни [start_day, end_day).
+    Читает O(дней × маршрутов × блюд) строк и учитывает историю, удалённую очисткой."""
+    conditions, params = _range_clause(start_day, end_day, column="r.day")
+    where = ("WHERE " + " AND ".join(conditions)) if conditions else ""
     cursor = conn.cursor()
-    cursor.execute("UPDATE transactions SET status='rejected' WHERE id=?", (trans_id,))
-    conn.commit()
+    cursor.execute(f"""
+        SELECT r.status, SUM(r.count), SUM(r.quantity)
+        FROM daily_rollup r {where}
+        GROUP BY r.status
+        HAVING SUM(r.count) > 0
+        ORDER BY 2 DESC
+    """, params)
+    by_status = cursor.fetchall()
+    cursor.execute(f"""
+        SELECT r.from_department, r.to_department, SUM(r.count), SUM(r.quantity)
+        FROM daily_rollup r {where}
+        GROUP BY r.from_department, r.to_department
+        HAVING SUM(r.count) > 0
+        ORDER BY 3 DESC
+    """, params)
+    by_route = cursor.fetchall()
+    cursor.execute(f"""
+        SELECT d.name, SUM(r.count), SUM(r.quantity)
+        FROM daily_rollup r
+        JOIN dishes d ON r.dish_id = d.id
+        {where}
+        GROUP BY r.dish_id
+        HAVING SUM(r.count) > 0
+        ORDER BY 3 DESC
+        LIMIT ?
+    """, params + [top_dishes])
+    by_dish = cursor.fetchall()
+    cursor.execute(f"""
+        SELECT COUNT(*) FROM (
+            SELECT r.dish_id FROM daily_rollup r {where}
+            GROUP BY r.dish_id HAVING SUM(r.count) > 0
+        )
+    """, params)
+    dish_count = cursor.fetchone()[0]
+    return {"by_status": by_status, "by_route": by_route, "by_dish": by_dish, "dish_count": dish_count}
+
+# ---- Остатки по цехам (stock_balances) ----
+# Ключ — (цех, блюдо, label_day): нормализованная дата этикетки или '' без даты
+
+# Как передача в каждом статусе сказывается на остатках: (знак для отправителя, знак для получателя).
+# Отправленное списывается у отправителя сразу, получателю зачисляется при приёмке
+# (auto_done — сразу), отклонённое возвращается отправителю.
+STOCK_EFFECT = {"pending": (-1, 0), "accepted": (-1, 1), "auto_done": (-1, 1), "rejected": (0, 0)}
+
+_STOCK_UPSERT = """
+    INSERT INTO stock_balances (department, dish_id, label_day, quantity) VALUES (?, ?, ?, ?)
+    ON CONFLICT (department, dish_id, label_day) DO UPDATE SET quantity = quantity + excluded.quantity
+"""
+
+def _stock_moves(from_dep, to_dep, dish_id, label_day, qty, old_status, new_status):
+    """Строки _STOCK_UPSERT для перехода передачи из old_status (None — новая) в new_status."""
+    old = STOCK_EFFECT.get(old_status, (0, 0))
+    new = STOCK_EFFECT.get(new_status, (0, 0))
+    moves = []
+    for department, sign in ((from_dep, new[0] - old[0]), (to_dep, new[1] - old[1])):
+        if sign and qty:
+            moves.append((department, dish_id, label_day or "", sign * qty))
+    return moves
+
+def _stock_apply(conn, moves):
+    if moves:
+        conn.executemany(_STOCK_UPSERT, moves)
+
+def _stock_effects_sql(where="1"):
+    """SELECT (department, dish_id, label_day, quantity) — вклад строк transactions,
+    подходящих под where, в остатки по правилам STOCK_EFFECT. Параметры where — дважды."""
+    def sign(i):
+        cases = " ".join(f"WHEN '{status}' THEN {signs[i]}" for status, signs in STOCK_EFFECT.items())
+        return f"CASE status {cases} ELSE 0 END"
+    return f"""
+        SELECT from_department AS department, dish_id, COALESCE(label_day, '') AS label_day,
+               {sign(0)} * COALESCE(quantity, 0) AS quantity
+        FROM transactions WHERE {where}
+        UNION ALL
+        SELECT to_department, dish_id, COALESCE(label_day, ''), {sign(1)} * COALESCE(quantity, 0)
+        FROM transactions WHERE {where}
+    """
+
+# Ожидаемые остатки: вклад удалённой очисткой истории (stock_baseline) плюс оставшиеся transactions
+_STOCK_EXPECTED = f"""
+    SELECT department, dish_id, label_day, SUM(quantity) AS quantity FROM (
+        SELECT department, dish_id, label_day, quantity FROM stock_baseline
+        UNION ALL
+        {_stock_effects_sql()}
+    )
+    GROUP BY 1, 2, 3
+"""
+
+def check_stock(conn, limit=20):
+    """Сверяет stock_balances с пересчётом из transactions и stock_baseline.
+    Возвращает (число расхождений, первые limit строк (цех, блюдо, дата этикетки, в таблице, ожидается))."""
+    cursor = conn.execute(f"""
+        SELECT department, dish_id, label_day, SUM(stored), SUM(expected) FROM (
+            SELECT department, dish_id, label_day, quantity AS stored, 0 AS expected FROM stock_balances
+            UNION ALL
+            SELECT department, dish_id, label_day, 0, quantity FROM ({_STOCK_EXPECTED})
+        )
+        GROUP BY 1, 2, 3
+        HAVING ABS(SUM(stored) - SUM(expected)) > 1e-6
+        ORDER BY 1, 2, 3
+    """)
+    rows = cursor.fetchall()
+    return len(rows), rows[:limit]
+
+def rebuild_stock(conn):
+    """Пересчитывает stock_balances из transactions и stock_baseline. Возвращает число строк."""
+    with unit_of_work(conn):
+        conn.execute("DELETE FROM stock_balances")
+        cursor = conn.execute(
+            f"INSERT INTO stock_balances (department, dish_id, label_day, quantity) {_STOCK_EXPECTED}"
+        )
+        return cursor.rowcount
+
+def get_stock(conn, department):
+    """Остатки цеха: (блюдо, label_day или '', кол-во). Поиск по первичному ключу stock_balances."""
+    cursor = conn.execute("""
+        SELECT d.name, s.label_day, s.quantity
+        FROM stock_balances s
+        JOIN dishes d ON s.dish_id = d.id
+        WHERE s.department=? AND s.quantity > 1e-6
+        ORDER BY d.name, s.label_day
+    """, (department,))
+    return cursor.fetchall()
+
+def get_expiring_stock(conn, department, until_day: str):
+    """Остатки цеха с датой на этикетке не позже until_day ('YYYY-MM-DD'), в том числе просроченные:
+    (блюдо, label_day, кол-во). Диапазон по индексу (department, label_day)."""
+    cursor = conn.execute("""
+        SELECT d.name, s.label_day, s.quantity
+        FROM stock_balances s
+        JOIN dishes d ON s.dish_id = d.id
+        WHERE s.department=? AND s.label_day > '' AND s.label_day <= ? AND s.quantity > 1e-6
+        ORDER BY s.label_day, d.name
+    """, (department, until_day))
+    return cursor.fetchall()
+
+# Условие "ещё ожидает приёмки этим цехом" проверяется в том же UPDATE, что и меняет статус:
+# из двух одновременных нажатий выигрывает одно, второе не находит строк
+def _settle_pending(conn, accept: bool, where: str, params):
+    """Одним UPDATE переводит ожидающие передачи (status='pending' AND where) в accepted/rejected
+    и переносит их в daily_rollup и остатки. Коммит — на вызывающей стороне. Возвращает id изменённых строк."""
+    status = "accepted" if accept else "rejected"
+    extra_set, extra_params = "", ()
+    if accept:
+        now = timeutil.now()
+        extra_set, extra_params = ", accepted_at=?, accepted_ts=?", (now.isoformat(), timeutil.to_ts(now))
+    sql = f"UPDATE transactions SET status=?{extra_set} WHERE status='pending' AND {where}"
+    if sqlite3.sqlite_version_info >= (3, 35):
+        rows = conn.execute(
+            sql + " RETURNING id, created_ts, from_department, to_department, dish_id, quantity, label_day",
+            (status, *extra_params, *params)
+        ).fetchall()
+    else:
+        # SQLite без RETURNING: читаем те же строки перед UPDATE. Все записи идут через
+        # одно соединение в потоке БД, поэтому между SELECT и UPDATE никто не вклинится.
+        rows = conn.execute(f"""
+            SELECT id, created_ts, from_department, to_department, dish_id, quantity, label_day
+            FROM transactions WHERE status='pending' AND {where}
+        """, params).fetchall()
+        if rows:
+            conn.execute(sql, (status, *extra_params, *params))
+    moves = {}
+    stock = []
+    for _, created_ts, from_dep, to_dep, dish_id, qty, label_day in rows:
+        key = (timeutil.local_day(created_ts), from_dep, to_dep, dish_id)
+        count, total = moves.get(key, (0, 0))
+        moves[key] = (count + 1, total + (qty or 0))
+        stock += _stock_moves(from_dep, to_dep, dish_id, label_day, qty, "pending", status)
+    rollup = []
+    for (day, from_dep, to_dep, dish_id), (count, total) in moves.items():
+        if day is not None:
+            rollup.append((day, from_dep, to_dep, dish_id, "pending", -count, -total))
+            rollup.append((day, from_dep, to_dep, dish_id, status, count, total))
+    conn.executemany(_ROLLUP_UPSERT, rollup)
+    _stock_apply(conn, stock)
+    return [row[0] for row in rows]
+
+def _log_settled(conn, user_id, accept, trans_ids):
+    action = audit.TRANSFER_ACCEPTED if accept else audit.TRANSFER_REJECTED
+    for trans_id in trans_ids:
+        log_action(conn, user_id, action, transaction_id=trans_id)
+
+def settle_transaction(conn, trans_id: int, department, user_id: int, accept: bool):
+    """Принимает или отклоняет передачу, если она ещё 'pending' и адресована department.
+    Проверка и смена статуса — один UPDATE, вместе с журналом — один commit.
+    Возвращает True, если передачу обработал именно этот вызов.
+    """
+    with unit_of_work(conn):
+        settled = _settle_pending(conn, accept, "id=? AND to_department=?", (trans_id, department))
+        _log_settled(conn, user_id, accept, settled)
+    return bool(settled)
+
+def settle_pending(conn, department, user_id: int, accept: bool, trans_ids=None, max_id=None):
+    """Принимает или отклоняет сразу много ожидающих передач цеха одним UPDATE и одним commit:
+    выбранные trans_ids или все (trans_ids=None) с id не больше max_id — чтобы не задеть
+    передачи, пришедшие уже после того, как получатель открыл список. Возвращает их число."""
+    where, params = "to_department=?", [department]
+    if trans_ids is not None:
+        if not trans_ids:
+            return 0
+        where += f" AND id IN ({', '.join('?' for _ in trans_ids)})"
+        params += list(trans_ids)
+    if max_id is not None:
+        where += " AND id <= ?"
+        params.append(max_id)
+    with unit_of_work(conn):
+        settled = _settle_pending(conn, accept, where, params)
+        _log_settled(conn, user_id, accept, settled)
+    return len(settled)
+
+def settle_batch(conn, batch_id: int, department, user_id: int, accept: bool):
+    """Принимает или отклоняет все ещё ожидающие позиции партии, адресованной department,
+    одним UPDATE и одним commit. Возвращает число обработанных позиций (0 — нечего было менять)."""
+    with unit_of_work(conn):
+        settled = _settle_pending(conn, accept, "batch_id=? AND to_department=?", (batch_id, department))
+        if settled:
+            action = audit.BATCH_ACCEPTED if accept else audit.BATCH_REJECTED
+            log_action(conn, user_id, action, batch_id=batch_id, items=len(settled))
+    return len(settled)
 
 def get_transactions_by_date(conn, date_str=None):
     """Пример для получения транзакций за конкретную дату (YYYY-MM-DD).
+       Дата — локальная дата производства (config.TIMEZONE).
        Если date_str не задана, возвращает все.
     """
     cursor = conn.cursor()
     if date_str:
+        # Диапазон по числовой метке времени, чтобы работал индекс по created_ts
+        start_ts, end_ts = timeutil.day_bounds(datetime.date.fromisoformat(date_str))
         cursor.execute("""
             SELECT t.id, t.from_department, t.to_department, d.name, t.quantity, 
                    t.label_date, t.created_at, t.accepted_at, t.status
             FROM transactions t
             JOIN dishes d ON t.dish_id = d.id
-            WHERE substr(t.created_at, 1, 10)=?
+            WHERE t.created_ts >= ? AND t.created_ts < ?
             ORDER BY t.id DESC
-        """, (date_str,))
+        """, (start_ts, end_ts))
     else:
         cursor.execute("""
             SELECT t.id, t.from_department, t.to_department, d.name, t.quantity, 
@@ -189,30 +762,229 @@ def get_transactions_by_date(conn, date_str=None):
         """)
     return cursor.fetchall()
 
-def cleanup_old_data(conn):
-    """Пример очистки старых транзакций, если нужно.
-       Удаляем записи старше N дней (OLD_DATA_RETENTION_DAYS) из transactions и logs.
+def _range_clause(start_ts, end_ts, column="t.created_ts"):
+    """WHERE-условие полуинтервала [start_ts, end_ts) по метке времени; границы необязательны."""
+    conditions, params = [], []
+    if start_ts is not None:
+        conditions.append(f"{column} >= ?")
+        params.append(start_ts)
+    if end_ts is not None:
+        conditions.append(f"{column} < ?")
+        params.append(end_ts)
+    return conditions, params
+
+def get_report_summary(conn, start_ts=None, end_ts=None, top_dishes=15):
+    """Агрегаты по транзакциям за [start_ts, end_ts): по статусам, маршрутам и блюдам.
+    Считается в SQL, в Python попадают только сгруппированные строки.
     """
+    conditions, params = _range_clause(start_ts, end_ts)
+    where = ("WHERE " + " AND ".join(conditions)) if conditions else ""
     cursor = conn.cursor()
-    now = datetime.datetime.now()
-    delta = datetime.timedelta(days=OLD_DATA_RETENTION_DAYS)
-    cutoff_date = now - delta
+    cursor.execute(f"""
+        SELECT t.status, COUNT(*), SUM(t.quantity)
+        FROM transactions t {where}
+        GROUP BY t.status
+        ORDER BY 2 DESC
+    """, params)
+    by_status = cursor.fetchall()
+    cursor.execute(f"""
+        SELECT t.from_department, t.to_department, COUNT(*), SUM(t.quantity)
+        FROM transactions t {where}
+        GROUP BY t.from_department, t.to_department
+        ORDER BY 3 DESC
+    """, params)
+    by_route = cursor.fetchall()
+    cursor.execute(f"""
+        SELECT d.name, COUNT(*), SUM(t.quantity)
+        FROM transactions t
+        JOIN dishes d ON t.dish_id = d.id
+        {where}
+        GROUP BY t.dish_id
+        ORDER BY 3 DESC
+        LIMIT ?
+    """, params + [top_dishes])
+    by_dish = cursor.fetchall()
+    cursor.execute(f"SELECT COUNT(DISTINCT t.dish_id) FROM transactions t {where}", params)
+    dish_count = cursor.fetchone()[0]
+    return {"by_status": by_status, "by_route": by_route, "by_dish": by_dish, "dish_count": dish_count}
 
-    # Превратим cutoff_date в строку YYYY-MM-DD
-    cutoff_str = cutoff_date.isoformat()  # 2025-01-19T14:40:00....
-    # Обрежем до даты, если хотим сравнивать только по дате
-    cutoff_date_str = cutoff_str.split("T")[0]  # "2025-01-19"
+def get_transactions_page(conn, start_ts=None, end_ts=None, before_id=None, after_id=None, limit=20):
+    """Страница транзакций за [start_ts, end_ts) с keyset-пагинацией по id (новые сверху).
 
-    # Удаляем транзакции, у которых created_at < cutoff_date
-    cursor.execute("""
-        DELETE FROM transactions
-        WHERE substr(created_at, 1, 10) < ?
-    """, (cutoff_date_str,))
+    before_id — следующая страница (записи старше before_id),
+    after_id — предыдущая страница (записи новее after_id).
+    Возвращает (rows, has_older, has_newer); строки в том же формате,
+    что и get_transactions_by_date.
+    """
+    conditions, params = _range_clause(start_ts, end_ts)
+    order = "DESC"
+    if after_id is not None:
+        conditions.append("t.id > ?")
+        params.append(after_id)
+        order = "ASC"
+    elif before_id is not None:
+        conditions.append("t.id < ?")
+        params.append(before_id)
+    where = ("WHERE " + " AND ".join(conditions)) if conditions else ""
+    cursor = conn.cursor()
+    cursor.execute(f"""
+        SELECT t.id, t.from_department, t.to_department, d.name, t.quantity,
+               t.label_date, t.created_at, t.accepted_at, t.status
+        FROM transactions t
+        JOIN dishes d ON t.dish_id = d.id
+        {where}
+        ORDER BY t.id {order}
+        LIMIT ?
+    """, params + [limit + 1])
+    rows = cursor.fetchall()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    if after_id is not None:
+        rows.reverse()
+        return rows, True, has_more
+    return rows, has_more, before_id is not None
 
-    # Удаляем логи старые
-    cursor.execute("""
-        DELETE FROM logs
-        WHERE substr(timestamp, 1, 10) < ?
-    """, (cutoff_date_str,))
+def get_export_chunk(conn, start_ts=None, end_ts=None, department=None, after_id=0, limit=1000):
+    """Очередная пачка транзакций для выгрузки: id > after_id по возрастанию.
+    Короткий запрос на пачку не держит блокировку БД на всё время выгрузки."""
+    conditions, params = _range_clause(start_ts, end_ts)
+    conditions.append("t.id > ?")
+    params.append(after_id)
+    if department:
+        conditions.append("(t.from_department = ? OR t.to_department = ?)")
+        params += [department, department]
+    cursor = conn.cursor()
+    cursor.execute(f"""
+        SELECT t.id, t.created_at, t.from_department, t.to_department, d.name, d.category,
+               t.quantity, t.label_date, t.status, t.accepted_at, u.full_name
+        FROM transactions t
+        JOIN dishes d ON t.dish_id = d.id
+        LEFT JOIN users u ON t.from_user_id = u.id
+        WHERE {" AND ".join(conditions)}
+        ORDER BY t.id
+        LIMIT ?
+    """, params + [limit])
+    return cursor.fetchall()
 
-    conn.commit()
+# ---- Журнал действий ----
+
+def get_audit_page(conn, user_id=None, transaction_id=None, action=None, before=None, limit=20):
+    """Страница журнала (новые сверху) по одному фильтру: пользователю, передаче
+    (с действиями над её партией) или коду действия audit.*.
+
+    Keyset-пагинация по (ts, id): before — (ts, id) последней строки предыдущей
+    страницы. Каждый фильтр — диапазон по своему индексу, без просмотра журнала.
+    Строки журнала из буфера сюда не попадают — перед запросом нужен flush_logs.
+    Возвращает (rows, has_more); строка — (id, ts, user_id, full_name, action,
+    transaction_id, batch_id, items, note).
+    """
+    if user_id is not None:
+        condition, params = "l.user_id = ?", [user_id]
+    elif transaction_id is not None:
+        condition = "(l.transaction_id = ? OR l.batch_id = (SELECT batch_id FROM transactions WHERE id = ?))"
+        params = [transaction_id, transaction_id]
+    elif action is not None:
+        condition, params = "l.action = ?", [action]
+    else:
+        raise ValueError("Нужен фильтр: user_id, transaction_id или action")
+    if before is not None:
+        condition += " AND (l.ts, l.id) < (?, ?)"
+        params += list(before)
+    rows = conn.execute(f"""
+        SELECT l.id, l.ts, l.user_id, u.full_name, l.action, l.transaction_id, l.batch_id, l.items, l.note
+        FROM logs l
+        LEFT JOIN users u ON l.user_id = u.id
+        WHERE {condition}
+        ORDER BY l.ts DESC, l.id DESC
+        LIMIT ?
+    """, params + [limit + 1]).fetchall()
+    return rows[:limit], len(rows) > limit
+
+# ---- Очистка старых данных ----
+
+# Таблицы, которые чистятся по сроку хранения: таблица -> колонка с меткой времени
+RETENTION_TABLES = {"transactions": "created_ts", "transfer_batches": "created_ts", "logs": "ts"}
+
+def retention_cutoff_ts(days=OLD_DATA_RETENTION_DAYS):
+    """Начало локального дня производства days дней назад: всё, что раньше, считается устаревшим."""
+    return timeutil.day_start_ts(timeutil.today() - datetime.timedelta(days=days))
+
+def get_expired_id_range(conn, table: str, cutoff_ts: int):
+    """(минимальный id, максимальный id) строк таблицы старше cutoff_ts или (None, None)."""
+    ts_column = RETENTION_TABLES[table]
+    return conn.execute(
+        f"SELECT MIN(id), MAX(id) FROM {table} WHERE {ts_column} < ?", (cutoff_ts,)
+    ).fetchone()
+
+def delete_expired_batch(conn, table: str, cutoff_ts: int, from_id: int, to_id: int):
+    """Удаляет устаревшие строки с id в [from_id, to_id] и сразу коммитит,
+    чтобы блокировка записи держалась только на время одной пачки. Возвращает число строк.
+    Вклад удаляемых transactions в остатки переносится в stock_baseline в том же commit."""
+    ts_column = RETENTION_TABLES[table]
+    if table == "transactions":
+        where = "id BETWEEN ? AND ? AND created_ts < ?"
+        conn.execute(f"""
+            INSERT INTO stock_baseline (department, dish_id, label_day, quantity)
+            SELECT department, dish_id, label_day, SUM(quantity) FROM ({_stock_effects_sql(where)})
+            GROUP BY 1, 2, 3
+            ON CONFLICT (department, dish_id, label_day) DO UPDATE SET quantity = quantity + excluded.quantity
+        """, (from_id, to_id, cutoff_ts) * 2)
+    cursor = conn.execute(
+        f"DELETE FROM {table} WHERE id BETWEEN ? AND ? AND {ts_column} < ?",
+        (from_id, to_id, cutoff_ts)
+    )
+    _commit(conn)
+    return cursor.rowcount
+
+# Что копируется в архив: для транзакций добавляем названия, чтобы архив читался без основной БД
+ARCHIVE_SELECT = {
+    "transactions": """
+        SELECT t.*, d.name AS dish_name, d.category AS dish_category, u.full_name AS from_user_name
+        FROM transactions t
+        LEFT JOIN dishes d ON t.dish_id = d.id
+        LEFT JOIN users u ON t.from_user_id = u.id
+        WHERE t.id BETWEEN ? AND ? AND t.created_ts < ?
+    """,
+    "transfer_batches": """
+        SELECT * FROM transfer_batches WHERE id BETWEEN ? AND ? AND created_ts < ?
+    """,
+    "logs": """
+        SELECT * FROM logs WHERE id BETWEEN ? AND ? AND ts < ?
+    """,
+}
+
+def archive_expired_batch(conn, archive, table: str, cutoff_ts: int, from_id: int, to_id: int):
+    """Как delete_expired_batch, но сначала копирует строки в помесячный архив (archive.Archive).
+    Запись в архив идемпотентна, поэтому сбой между архивированием и удалением безопасен."""
+    cursor = conn.execute(ARCHIVE_SELECT[table], (from_id, to_id, cutoff_ts))
+    columns = [d[0] for d in cursor.description]
+    rows = cursor.fetchall()
+    if not rows:
+        return 0
+    archive.write(table, columns, rows)
+    return delete_expired_batch(conn, table, cutoff_ts, from_id, to_id)
+
+def compact_database(conn, max_pages=2000):
+    """Возвращает освободившиеся страницы файлу (auto_vacuum=INCREMENTAL)
+    и переносит WAL в основной файл, если включён режим WAL."""
+    if conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2:
+        conn.execute(f"PRAGMA incremental_vacuum({int(max_pages)})").fetchall()
+    if conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal":
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchall()
+
+def cleanup_old_data(conn, batch_size=1000):
+    """Удаляем записи старше N дней (OLD_DATA_RETENTION_DAYS) из таблиц RETENTION_TABLES.
+       Граница — начало локального дня производства N дней назад.
+       Удаление идёт пачками по диапазонам id с commit после каждой пачки;
+       в боте используется фоновая задача retention.RetentionJob, эта функция — для скриптов.
+    """
+    cutoff_ts = retention_cutoff_ts()
+    deleted = 0
+    for table in RETENTION_TABLES:
+        min_id, max_id = get_expired_id_range(conn, table, cutoff_ts)
+        if min_id is None:
+            continue
+        for from_id in range(min_id, max_id + 1, batch_size):
+            deleted += delete_expired_batch(conn, table, cutoff_ts, from_id, min(from_id + batch_size - 1, max_id))
+    compact_database(conn)
+    return deleted
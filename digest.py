@@ -0,0 +1,122 @@
+# digest.py
+import asyncio
+import logging
+
+import reports
+import timeutil
+from config import ADMIN_DIGEST_INTERVAL_MINUTES, ADMIN_DIGEST_URGENT_QUANTITY
+
+logger = logging.getLogger(__name__)
+
+
+def label_expired(label_date) -> bool:
+    """Дата на этикетке (ДД.ММ.ГГГГ) уже прошла — о такой передаче администраторам сообщаем сразу."""
+    if not label_date:
+        return False
+    try:
+        return timeutil.parse_label_date(label_date) < timeutil.today()
+    except ValueError:
+        return False
+
+class AdminDigest:
+    """Сводка администраторам о передачах без подтверждения (auto_done).
+
+    Вместо сообщения каждому администратору на каждую передачу события
+    копятся в памяти по маршруту и блюду и раз в interval_minutes уходят
+    одним сообщением на администратора. Срочные события отправляются сразу,
+    мимо сводки: передачи с уже прошедшей датой на этикетке (main передаёт
+    urgent=label_expired(...)) и, если задан urgent_quantity, позиции с
+    количеством от него.
+    Буфер сбрасывается и в close(); при аварийном завершении последние
+    события могут не попасть в сводку — как и буфер журнала.
+    """
+
+    def __init__(self, adb, notifier, interval_minutes=ADMIN_DIGEST_INTERVAL_MINUTES,
+                 urgent_quantity=ADMIN_DIGEST_URGENT_QUANTITY):
+        self.adb = adb
+        self.notifier = notifier
+        self.interval = interval_minutes * 60
+        self.urgent_quantity = urgent_quantity
+        self.routes = {}  # (из цеха, в цех) -> {блюдо: [число передач, кол-во]}
+        self.buffered = 0
+        self.since_ts = None
+        self.counters = {"events": 0, "urgent": 0, "digests": 0}
+        self._scheduler = None
+
+    def start(self):
+        if self._scheduler is None and self.interval > 0:
+            self._scheduler = asyncio.create_task(self._schedule())
+
+    async def close(self):
+        if self._scheduler is not None:
+            self._scheduler.cancel()
+            await asyncio.gather(self._scheduler, return_exceptions=True)
+            self._scheduler = None
+        await self.flush()
+
+    async def _schedule(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.flush()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Не удалось отправить сводку администраторам")
+
+    def is_urgent(self, items) -> bool:
+        return self.urgent_quantity > 0 and any((qty or 0) >= self.urgent_quantity for _, qty in items)
+
+    async def add(self, from_dep, to_dep, items, text, urgent=False):
+        """Передача или партия auto_done: items — [(название блюда, кол-во), ...].
+        text — отдельное сообщение на случай отправки сразу: срочное событие
+        или сводка выключена (interval_minutes=0)."""
+        self.counters["events"] += 1
+        if urgent or self.is_urgent(items):
+            self.counters["urgent"] += 1
+            await self._send_admins(f"[СРОЧНО] {text}")
+            return
+        if self.interval <= 0:
+            await self._send_admins(text)
+            return
+        if self.since_ts is None:
+            self.since_ts = timeutil.now_ts()
+        dishes = self.routes.setdefault((from_dep, to_dep), {})
+        for name, qty in items:
+            total = dishes.setdefault(name, [0, 0])
+            total[0] += 1
+            total[1] += qty or 0
+        self.buffered += len(items)
+
+    async def flush(self):
+        """Отправляет накопленную сводку всем администраторам. Возвращает число передач в ней."""
+        if not self.routes:
+            return 0
+        # Буфер забираем до await: события, пришедшие во время отправки, попадут в следующую сводку
+        routes, count, since_ts = self.routes, self.buffered, self.since_ts
+        self.routes, self.buffered, self.since_ts = {}, 0, None
+        try:
+            await self._send_admins(reports.render_admin_digest(routes, count, since_ts))
+        except BaseException:
+            # Сводка не ушла — события возвращаются в буфер до следующей попытки
+            self._merge(routes, count, since_ts)
+            raise
+        self.counters["digests"] += 1
+        return count
+
+    def _merge(self, routes, count, since_ts):
+        for route, dishes in routes.items():
+            buffered = self.routes.setdefault(route, {})
+            for name, (transfers, qty) in dishes.items():
+                total = buffered.setdefault(name, [0, 0])
+                total[0] += transfers
+                total[1] += qty
+        self.buffered += count
+        self.since_ts = since_ts if self.since_ts is None else min(self.since_ts, since_ts)
+
+    async def _send_admins(self, text):
+        for tg_id in await self.adb.get_admin_telegram_ids():
+            self.notifier.send(tg_id, text)
+
+    def stats(self):
+        return dict(self.counters, buffered=self.buffered)
@@ -0,0 +1,72 @@
+# expiry.py
+import asyncio
+import datetime
+import logging
+
+import reports
+import timeutil
+from config import EXPIRY_DEPARTMENTS, EXPIRY_WARN_DAYS, EXPIRY_CHECK_INTERVAL_HOURS
+
+logger = logging.getLogger(__name__)
+
+
+class ExpiryJob:
+    """Фоновая проверка сроков годности по дате на этикетке.
+
+    Раз в EXPIRY_CHECK_INTERVAL_HOURS для каждого цеха из EXPIRY_DEPARTMENTS
+    выбираются остатки с датой не позже чем через EXPIRY_WARN_DAYS дней —
+    один запрос-диапазон по индексу stock_balances (department, label_day).
+    Цеху уходит одно сообщение со всеми позициями, а не по сообщению на
+    позицию; если с прошлой проверки список не изменился, повторно не шлём.
+    """
+
+    def __init__(self, adb, notifier, departments=EXPIRY_DEPARTMENTS, warn_days=EXPIRY_WARN_DAYS,
+                 interval_hours=EXPIRY_CHECK_INTERVAL_HOURS):
+        self.adb = adb
+        self.notifier = notifier
+        self.departments = departments
+        self.warn_days = warn_days
+        self.interval = interval_hours * 3600
+        self.last_alerts = {}  # цех -> текст последнего отправленного предупреждения
+        self._scheduler = None
+
+    def start(self):
+        if self._scheduler is None and self.interval > 0:
+            self._scheduler = asyncio.create_task(self._schedule())
+
+    async def close(self):
+        if self._scheduler is not None:
+            self._scheduler.cancel()
+            await asyncio.gather(self._scheduler, return_exceptions=True)
+            self._scheduler = None
+
+    async def _schedule(self):
+        while True:
+            try:
+                await self.run()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Проверка сроков годности завершилась с ошибкой")
+            await asyncio.sleep(self.interval)
+
+    async def run(self):
+        """Проверяет все цеха; возвращает {цех: число позиций в отправленном предупреждении}."""
+        today = timeutil.today()
+        until_day = (today + datetime.timedelta(days=self.warn_days)).isoformat()
+        sent = {}
+        for department in self.departments:
+            rows = await self.adb.get_expiring_stock(department, until_day)
+            if not rows:
+                self.last_alerts.pop(department, None)
+                continue
+            text = reports.render_expiry_alert(department, rows, today)
+            if self.last_alerts.get(department) == text:
+                continue
+            self.last_alerts[department] = text
+            for tg_id in await self.adb.get_department_telegram_ids(department):
+                self.notifier.send(tg_id, text)
+            sent[department] = len(rows)
+        if sent:
+            logger.info("Предупреждения о сроках годности: %s", sent)
+        return sent
@@ -0,0 +1,72 @@
+# export.py
+import asyncio
+import csv
+import gzip
+import io
+import tempfile
+
+from config import EXPORT_CHUNK_SIZE, EXPORT_SPOOL_MAX_SIZE
+
+CSV_HEADER = [
+    "id", "создано", "откуда", "куда", "блюдо", "категория",
+    "количество", "дата на этикетке", "статус", "принято", "отправитель",
+]
+
+
+async def export_transactions_csv(adb, start_ts=None, end_ts=None, department=None,
+                                  chunk_size=EXPORT_CHUNK_SIZE, archive=None, cutoff_ts=None):
+    """Выгружает транзакции в CSV, сжатый gzip. Возвращает (файл, число строк).
+
+    Строки читаются из БД пачками по chunk_size (keyset по id), каждая пачка
+    сразу пишется в сжатый поток, поэтому память не зависит от объёма выгрузки.
+    Сжатие выполняется в пуле потоков, а не в event loop. Результат —
+    SpooledTemporaryFile: до EXPORT_SPOOL_MAX_SIZE байт в памяти, дальше на диске.
+    Файл открыт и перемотан в начало, закрыть его должен вызывающий.
+
+    Если период начинается раньше cutoff_ts (границы срока хранения),
+    сначала выгружаются строки из помесячных архивов archive.
+    """
+    loop = asyncio.get_running_loop()
+    spool = tempfile.SpooledTemporaryFile(max_size=EXPORT_SPOOL_MAX_SIZE)
+    gz = gzip.GzipFile(fileobj=spool, mode="wb")
+    # utf-8-sig и ";" — чтобы Excel с русской локалью сразу открыл файл правильно
+    text = io.TextIOWrapper(gz, encoding="utf-8-sig", newline="")
+    writer = csv.writer(text, delimiter=";")
+    try:
+        writer.writerow(CSV_HEADER)
+        total = 0
+        if archive is not None and (start_ts is None or cutoff_ts is None or start_ts < cutoff_ts):
+            for month in archive.months_between(start_ts, end_ts):
+                chunks = archive.iter_transactions(month, start_ts, end_ts, department, chunk_size)
+                while True:
+                    rows = await loop.run_in_executor(None, next, chunks, None)
+                    if rows is None:
+                        break
+                    await loop.run_in_executor(None, writer.writerows, rows)
+                    total += len(rows)
+        after_id = 0
+        while True:
+            rows = await adb.get_export_chunk(start_ts, end_ts, department, after_id, chunk_size)
+            if not rows:
+                break
+            await loop.run_in_executor(None, writer.writerows, rows)
+            total += len(rows)
+            after_id = rows[-1][0]
+        await loop.run_in_executor(None, _finish, text, gz)
+    except BaseException:
+        spool.close()
+        raise
+    spool.seek(0)
+    return spool, total
+
+
+def _finish(text, gz):
+    text.flush()
+    text.detach()
+    gz.close()
+
+def export_filename(start_day, end_day, department=None) -> str:
+    parts = ["transactions", start_day or "begin", end_day or "now"]
+    if department:
+        parts.append(department)
+    return "_".join(parts) + ".csv.gz"
@@ -0,0 +1,240 @@
+# fsm_storage.py
+import asyncio
+import copy
+import json
+import logging
+import sqlite3
+import time
+import typing
+from concurrent.futures import ThreadPoolExecutor
+
+from aiogram.dispatcher.storage import BaseStorage
+
+from config import FSM_TTL, FSM_FLUSH_INTERVAL
+
+logger = logging.getLogger(__name__)
+
+
+class SQLiteStorage(BaseStorage):
+    """Хранилище состояний FSM в SQLite вместо MemoryStorage.
+
+    Состояния переживают перезапуск бота. Чтение и запись идут в словарь
+    в памяти, а в БД изменения сбрасываются пачкой раз в FSM_FLUSH_INTERVAL
+    секунд (write-back): частые set_state/update_data одного диалога
+    превращаются в одну строку upsert. Диалоги, которые не трогали дольше
+    FSM_TTL секунд, считаются брошенными и удаляются.
+
+    Используется отдельный файл БД со своим потоком, чтобы запись состояний
+    не вставала в очередь к бизнес-транзакциям factory.db.
+    """
+
+    def __init__(self, path="fsm.db", ttl=FSM_TTL, flush_interval=FSM_FLUSH_INTERVAL):
+        self.path = path
+        self.ttl = ttl
+        self.flush_interval = flush_interval
+        self._records = {}  # (chat, user) -> {"state", "data", "bucket", "touched"}
+        self._dirty = set()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="fsm-storage")
+        self._flusher = None
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS fsm_states (
+                chat TEXT NOT NULL,
+                user TEXT NOT NULL,
+                state TEXT,
+                data TEXT,
+                bucket TEXT,
+                updated_ts REAL NOT NULL,
+                PRIMARY KEY (chat, user)
+            )
+        """)
+        self._conn.commit()
+        self._load()
+
+    def _load(self):
+        """Загружает незавершённые диалоги и удаляет просроченные."""
+        cutoff = time.time() - self.ttl
+        self._conn.execute("DELETE FROM fsm_states WHERE updated_ts < ?", (cutoff,))
+        self._conn.commit()
+        for chat, user, state, data, bucket, updated_ts in self._conn.execute("SELECT * FROM fsm_states"):
+            self._records[(chat, user)] = {
+                "state": state,
+                "data": json.loads(data) if data else {},
+                "bucket": json.loads(bucket) if bucket else {},
+                "touched": updated_ts,
+            }
+        logger.info("FSM: восстановлено диалогов: %s", len(self._records))
+
+    # ---- работа с записями в памяти ----
+
+    def _key(self, chat, user):
+        chat, user = self.check_address(chat=chat, user=user)
+        return str(chat), str(user)
+
+    def _get(self, chat, user):
+        key = self._key(chat, user)
+        record = self._records.get(key)
+        if record is not None and record["touched"] < time.time() - self.ttl:
+            self._drop(key)
+            record = None
+        return key, record
+
+    def _get_or_create(self, chat, user):
+        key, record = self._get(chat, user)
+        if record is None:
+            record = self._records[key] = {"state": None, "data": {}, "bucket": {}, "touched": 0}
+        return key, record
+
+    def _touch(self, key, record):
+        record["touched"] = time.time()
+        if record["state"] is None and not record["data"] and not record["bucket"]:
+            self._records.pop(key, None)
+        self._dirty.add(key)
+        self._ensure_flusher()
+
+    def _drop(self, key):
+        self._records.pop(key, None)
+        self._dirty.add(key)
+
+    # ---- BaseStorage ----
+
+    async def get_state(self, *,
+                        chat: typing.Union[str, int, None] = None,
+                        user: typing.Union[str, int, None] = None,
+                        default: typing.Optional[str] = None) -> typing.Optional[str]:
+        _, record = self._get(chat, user)
+        if record is None or record["state"] is None:
+            return self.resolve_state(default)
+        return record["state"]
+
+    async def get_data(self, *,
+                       chat: typing.Union[str, int, None] = None,
+                       user: typing.Union[str, int, None] = None,
+                       default: typing.Optional[typing.Dict] = None) -> typing.Dict:
+        _, record = self._get(chat, user)
+        if record is None:
+            return copy.deepcopy(default) if default else {}
+        return copy.deepcopy(record["data"])
+
+    async def set_state(self, *,
+                        chat: typing.Union[str, int, None] = None,
+                        user: typing.Union[str, int, None] = None,
+                        state: typing.Optional[typing.AnyStr] = None):
+        key, record = self._get_or_create(chat, user)
+        record["state"] = self.resolve_state(state)
+        self._touch(key, record)
+
+    async def set_data(self, *,
+                       chat: typing.Union[str, int, None] = None,
+                       user: typing.Union[str, int, None] = None,
+                       data: typing.Dict = None):
+        key, record = self._get_or_create(chat, user)
+        record["data"] = copy.deepcopy(data) if data else {}
+        self._touch(key, record)
+
+    async def update_data(self, *,
+                          chat: typing.Union[str, int, None] = None,
+                          user: typing.Union[str, int, None] = None,
+                          data: typing.Dict = None,
+                          **kwargs):
+        key, record = self._get_or_create(chat, user)
+        record["data"].update(data or {}, **kwargs)
+        self._touch(key, record)
+
+    def has_bucket(self):
+        return True
+
+    async def get_bucket(self, *,
+                         chat: typing.Union[str, int, None] = None,
+                         user: typing.Union[str, int, None] = None,
+                         default: typing.Optional[dict] = None) -> typing.Dict:
+        _, record = self._get(chat, user)
+        if record is None:
+            return copy.deepcopy(default) if default else {}
+        return copy.deepcopy(record["bucket"])
+
+    async def set_bucket(self, *,
+                         chat: typing.Union[str, int, None] = None,
+                         user: typing.Union[str, int, None] = None,
+                         bucket: typing.Dict = None):
+        key, record = self._get_or_create(chat, user)
+        record["bucket"] = copy.deepcopy(bucket) if bucket else {}
+        self._touch(key, record)
+
+    async def update_bucket(self, *,
+                            chat: typing.Union[str, int, None] = None,
+                            user: typing.Union[str, int, None] = None,
+                            bucket: typing.Dict = None,
+                            **kwargs):
+        key, record = self._get_or_create(chat, user)
+        record["bucket"].update(bucket or {}, **kwargs)
+        self._touch(key, record)
+
+    async def close(self):
+        if self._flusher is not None:
+            self._flusher.cancel()
+            self._flusher = None
+        await self.flush()
+
+    async def wait_closed(self):
+        if self._conn is not None:
+            await asyncio.get_running_loop().run_in_executor(self._executor, self._conn.close)
+            self._conn = None
+            self._executor.shutdown(wait=False)
+
+    # ---- сброс в БД ----
+
+    def _ensure_flusher(self):
+        if self._flusher is None:
+            self._flusher = asyncio.get_running_loop().create_task(self._flush_periodically())
+
+    async def _flush_periodically(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                self._expire()
+                await self.flush()
+            except Exception:
+                logger.exception("FSM: не удалось сохранить состояния")
+
+    def _expire(self):
+        cutoff = time.time() - self.ttl
+        for key in [k for k, r in self._records.items() if r["touched"] < cutoff]:
+            self._drop(key)
+
+    async def flush(self):
+        """Записывает изменённые диалоги одной транзакцией."""
+        if not self._dirty or self._conn is None:
+            return
+        dirty, self._dirty = self._dirty, set()
+        upserts, deletes = [], []
+        for key in dirty:
+            record = self._records.get(key)
+            if record is None:
+                deletes.append(key)
+            else:
+                upserts.append((
+                    key[0], key[1], record["state"],
+                    json.dumps(record["data"], ensure_ascii=False),
+                    json.dumps(record["bucket"], ensure_ascii=False),
+                    record["touched"],
+                ))
+        try:
+            await asyncio.get_running_loop().run_in_executor(self._executor, self._write, upserts, deletes)
+        except Exception:
+            # Вернём ключи, чтобы записать их при следующем сбросе
+            self._dirty |= dirty
+            raise
+
+    def _write(self, upserts, deletes):
+        with self._conn:
+            if deletes:
+                self._conn.executemany("DELETE FROM fsm_states WHERE chat=? AND user=?", deletes)
+            if upserts:
+                self._conn.executemany("""
+                    INSERT INTO fsm_states (chat, user, state, data, bucket, updated_ts)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                    ON CONFLICT (chat, user) DO UPDATE SET
+                        state=excluded.state, data=excluded.data,
+                        bucket=excluded.bucket, updated_ts=excluded.updated_ts
+                """, upserts)
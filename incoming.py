@@ -0,0 +1,91 @@
+# incoming.py
+from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup
+
+import callbacks
+from reports import truncate
+
+CHECKED = "✅"
+UNCHECKED = "☐"
+
+
+def _label_info(lbl_date):
+    return f" (дата: {lbl_date})" if lbl_date else ""
+
+def render(pending):
+    """Список ожидающих приёмки (строки get_pending_transactions_for_department) -> (текст, клавиатура).
+
+    Одиночные передачи — с кнопками на каждую, позиции партий — одним блоком
+    с общими кнопками партии. Внизу — "Принять все" и выбор нескольких.
+    """
+    if not pending:
+        return "Нет ожидающих приёмки товаров.", None
+    lines = ["<b>Ожидающие приёмки:</b>"]
+    markup = InlineKeyboardMarkup()
+    batches = {}
+    singles = 0
+    for (tid, dish_name, qty, from_dep, lbl_date, batch_id) in pending:
+        if batch_id is not None:
+            batches.setdefault(batch_id, (from_dep, []))[1].append(f"  {dish_name} x {qty}{_label_info(lbl_date)}")
+            continue
+        singles += 1
+        lines.append(f"#{tid} | {dish_name} x {qty} | из {from_dep}{_label_info(lbl_date)}")
+        markup.row(
+            InlineKeyboardButton(f"Принять #{tid}", callback_data=callbacks.encode(callbacks.ACCEPT, tid)),
+            InlineKeyboardButton(f"Отклонить #{tid}", callback_data=callbacks.encode(callbacks.REJECT, tid)),
+        )
+    for batch_id, (from_dep, items) in batches.items():
+        lines.append(f"Партия П{batch_id} из {from_dep}, позиций: {len(items)}")
+        lines += items
+        markup.row(
+            InlineKeyboardButton(f"Принять П{batch_id}", callback_data=callbacks.encode(callbacks.BATCH_ACCEPT, batch_id)),
+            InlineKeyboardButton(f"Отклонить П{batch_id}", callback_data=callbacks.encode(callbacks.BATCH_REJECT, batch_id)),
+        )
+    if len(pending) > 1:
+        # max_id: "все" — это те, что получатель видит сейчас, а не пришедшие после
+        max_id = max(row[0] for row in pending)
+        markup.add(InlineKeyboardButton(
+            f"Принять все ({len(pending)})", callback_data=callbacks.encode(callbacks.ACCEPT_ALL, max_id)
+        ))
+    if singles > 1:
+        markup.add(InlineKeyboardButton("Выбрать несколько", callback_data=callbacks.encode(callbacks.SELECT_MODE)))
+    return truncate("\n".join(lines)), markup
+
+
+# Режим выбора: отметки хранятся прямо в кнопках сообщения (✅/☐ в тексте),
+# поэтому для выбора не нужно ни состояние FSM, ни запросы к БД
+
+def selection_markup(pending):
+    markup = InlineKeyboardMarkup()
+    for (tid, dish_name, qty, from_dep, lbl_date, batch_id) in pending:
+        if batch_id is None:
+            markup.add(InlineKeyboardButton(
+                f"{UNCHECKED} #{tid} {dish_name} x {qty}", callback_data=callbacks.encode(callbacks.TOGGLE, tid)
+            ))
+    markup.row(
+        InlineKeyboardButton("Принять выбранные", callback_data=callbacks.encode(callbacks.ACCEPT_SELECTED)),
+        InlineKeyboardButton("Отклонить выбранные", callback_data=callbacks.encode(callbacks.REJECT_SELECTED)),
+    )
+    markup.add(InlineKeyboardButton("« Назад", callback_data=callbacks.encode(callbacks.MENU_INCOMING)))
+    return markup
+
+def _toggle_buttons(markup):
+    for row in markup.inline_keyboard:
+        for button in row:
+            decoded = callbacks.decode(button.callback_data)
+            if decoded and decoded[0] == callbacks.TOGGLE and decoded[1]:
+                yield button, decoded[1][0]
+
+def toggle(markup, trans_id: str):
+    """Переключает отметку передачи trans_id в клавиатуре сообщения (на месте)."""
+    for button, tid in _toggle_buttons(markup):
+        if tid == trans_id:
+            if button.text.startswith(CHECKED):
+                button.text = UNCHECKED + button.text[len(CHECKED):]
+            else:
+                button.text = CHECKED + button.text[len(UNCHECKED):]
+    return markup
+
+def selected_ids(markup):
+    if markup is None:
+        return []
+    return [int(tid) for button, tid in _toggle_buttons(markup) if button.text.startswith(CHECKED) and tid.isdigit()]
@@ -0,0 +1,289 @@
+# loadtest.py
+"""Нагрузочный прогон бота без сети.
+
+Синтетические пользователи проходят регистрацию, /menu, полную передачу
+товара (TransferFSM), приёмку/отклонение и отчёты. Апдейты подаются в
+настоящий Dispatcher из main.py через dp.process_update. Бот подменён
+заглушкой, которая только записывает исходящие запросы к Telegram.
+База данных, состояния FSM и архивы создаются во временном каталоге;
+с --db-backend memory --fsm-storage memory прогон вообще не пишет на диск.
+
+Запуск:
+    python loadtest.py --users 2000 --concurrency 500 --transfers 3
+
+В конце печатается пропускная способность и p50/p95/p99 задержки по шагам
+сценария (хендлерам) и по функциям БД.
+"""
+import argparse
+import asyncio
+import itertools
+import os
+import random
+import sys
+import tempfile
+import time
+from collections import defaultdict
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return 0.0
+    k = min(len(sorted_values) - 1, max(0, int(round(p / 100.0 * (len(sorted_values) - 1)))))
+    return sorted_values[k]
+
+
+class Stats:
+    """Замеры задержек (в секундах) по именам."""
+
+    def __init__(self):
+        self.samples = defaultdict(list)
+        self.errors = defaultdict(int)
+
+    def add(self, name, seconds):
+        self.samples[name].append(seconds)
+
+    def report(self, title):
+        lines = [title, f"{'имя':<40} {'n':>8} {'p50 мс':>9} {'p95 мс':>9} {'p99 мс':>9} {'ошибок':>7}"]
+        for name in sorted(self.samples, key=lambda n: -sum(self.samples[n])):
+            values = sorted(self.samples[name])
+            lines.append(
+                f"{name:<40} {len(values):>8} {percentile(values, 50) * 1000:>9.2f} "
+                f"{percentile(values, 95) * 1000:>9.2f} {percentile(values, 99) * 1000:>9.2f} "
+                f"{self.errors.get(name, 0):>7}"
+            )
+        return "\n".join(lines)
+
+
+class FakeTelegram:
+    """Заглушка вместо Bot.request: запоминает вызовы и возвращает правдоподобные ответы."""
+
+    def __init__(self):
+        self.calls = defaultdict(int)
+        self._message_ids = itertools.count(1)
+
+    async def request(self, method, data=None, files=None, **kwargs):
+        self.calls[method] += 1
+        if method in ("sendMessage", "editMessageText", "sendDocument"):
+            chat_id = (data or {}).get("chat_id") or 1
+            return {
+                "message_id": next(self._message_ids),
+                "date": int(time.time()),
+                "chat": {"id": int(chat_id), "type": "private"},
+                "text": (data or {}).get("text", ""),
+            }
+        return True
+
+
+class Harness:
+    def __init__(self, main, args):
+        self.main = main
+        self.args = args
+        self.handler_stats = Stats()
+        self.db_stats = Stats()
+        self.update_ids = itertools.count(1)
+        self.message_ids = itertools.count(1)
+        self.updates = 0
+
+    # ---- апдейты ----
+
+    def _user(self, tg_id):
+        return {"id": tg_id, "is_bot": False, "first_name": f"user{tg_id}"}
+
+    def message(self, tg_id, text):
+        msg = {
+            "message_id": next(self.message_ids),
+            "date": int(time.time()),
+            "chat": {"id": tg_id, "type": "private"},
+            "from": self._user(tg_id),
+            "text": text,
+        }
+        if text.startswith("/"):
+            msg["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+        return {"update_id": next(self.update_ids), "message": msg}
+
+    def callback(self, tg_id, data):
+        return {
+            "update_id": next(self.update_ids),
+            "callback_query": {
+                "id": str(next(self.update_ids)),
+                "from": self._user(tg_id),
+                "chat_instance": "1",
+                "data": data,
+                "message": {
+                    "message_id": next(self.message_ids),
+                    "date": int(time.time()),
+                    "chat": {"id": tg_id, "type": "private"},
+                    "from": {"id": 1, "is_bot": True, "first_name": "bot"},
+                    "text": "...",
+                },
+            },
+        }
+
+    async def send(self, step, raw_update):
+        from aiogram import types
+        update = types.Update(**raw_update)
+        started = time.perf_counter()
+        try:
+            # Отдельная задача на апдейт, как при polling: свой контекст для кэша состояния FSM
+            await asyncio.create_task(self.main.dp.process_update(update))
+        except Exception:
+            self.handler_stats.errors[step] += 1
+        self.handler_stats.add(step, time.perf_counter() - started)
+        self.updates += 1
+
+    # ---- замеры БД ----
+
+    def instrument_db(self):
+        # Поток записи и пул чтения (adb.reader, если он есть) замеряются раздельно
+        adb = self.main.adb
+        stats = self.db_stats
+        targets = [(adb, "")] + ([(adb.reader, " (чтение)")] if adb.reader is not adb else [])
+        for target, suffix in targets:
+            target.run = self._timed(target.run, suffix, stats)
+
+    @staticmethod
+    def _timed(original_run, suffix, stats):
+        async def timed_run(func, *args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return await original_run(func, *args, **kwargs)
+            finally:
+                stats.add(getattr(func, "__name__", "run") + suffix, time.perf_counter() - started)
+        return timed_run
+
+    # ---- сценарии ----
+
+    async def setup(self):
+        main = self.main
+        await self.send("/start (админ)", self.message(self.args.admin_id, "/start"))
+        for i in range(self.args.dishes):
+            await main.adb.add_dish(f"Блюдо {i}", f"Категория {i % 5}")
+
+    async def register(self, tg_id, department):
+        cb = self.main.callbacks
+        await self.send("/start", self.message(tg_id, "/start"))
+        await self.send("ввод ФИО", self.message(tg_id, f"Сотрудник {tg_id}"))
+        await self.send("выбор роли", self.callback(tg_id, cb.encode(cb.ROLE, "w")))
+        await self.send("выбор цеха", self.callback(tg_id, cb.encode(cb.DEPARTMENT, cb.department_index(department))))
+        user = await self.main.adb.get_user_by_telegram_id(tg_id)
+        if user:
+            await self.send("админ: подтверждение", self.callback(self.args.admin_id, cb.encode(cb.ADMIN_APPROVE, user[0])))
+
+    async def transfer(self, tg_id, to_dep, need_label):
+        main, cb = self.main, self.main.callbacks
+        await self.send("/menu", self.message(tg_id, "/menu"))
+        await self.send("меню: передать", self.callback(tg_id, cb.encode(cb.MENU_TRANSFER)))
+        await self.send("выбор цеха-получателя", self.callback(tg_id, cb.encode(cb.TO_DEPARTMENT, cb.department_index(to_dep))))
+        await main.catalog.ensure_loaded(main.adb)
+        cat_idx = random.randrange(len(main.catalog.categories))
+        await self.send("каталог: страница", self.callback(tg_id, cb.encode(cb.DISH_PAGE, main.catalog.version, cat_idx, 0)))
+        dish_id = random.choice(main.catalog.categories[cat_idx][1])[0]
+        await self.send("выбор блюда", self.callback(tg_id, cb.encode(cb.DISH, dish_id)))
+        await self.send("ввод количества", self.message(tg_id, str(random.randint(1, 50))))
+        if need_label:
+            await self.send("ввод даты этикетки", self.message(tg_id, "20.01.2030"))
+
+    async def receive(self, tg_id, department):
+        cb = self.main.callbacks
+        await self.send("меню: входящие", self.callback(tg_id, cb.encode(cb.MENU_INCOMING)))
+        pending = await self.main.adb.get_pending_transactions_for_department(department)
+        for row in pending[:3]:
+            action = cb.ACCEPT if random.random() < 0.9 else cb.REJECT
+            await self.send("приёмка/отклонение", self.callback(tg_id, cb.encode(action, row[0])))
+
+    async def reports(self, tg_id):
+        cb = self.main.callbacks
+        await self.send("отчёт: сводка", self.callback(tg_id, cb.encode(cb.REPORT, "today")))
+        await self.send("отчёт: страница", self.callback(tg_id, cb.encode(cb.REPORT_DETAIL, "today", "o", 0)))
+
+    async def user_session(self, tg_id, semaphore):
+        # Маршруты: с подтверждением получателя и автоматические (с датой этикетки)
+        routes = [
+            ("Пекарня", "Склад", False), ("Кухня", "Упаковка", False),
+            ("Упаковка", "Холодильник", True), ("Холодильник", "Покупатель", True),
+        ]
+        from_dep, to_dep, need_label = routes[tg_id % len(routes)]
+        async with semaphore:
+            await self.register(tg_id, from_dep)
+            for _ in range(self.args.transfers):
+                await self.transfer(tg_id, to_dep, need_label)
+            await self.receive(tg_id, from_dep)
+
+    async def run(self):
+        self.instrument_db()
+        await self.setup()
+        # Руководитель для отчётов
+        leader_id = self.args.admin_id + 1
+        await self.register(leader_id, "Склад")
+        await self.main.adb.set_user_role((await self.main.adb.get_user_by_telegram_id(leader_id))[0], "leader")
+
+        semaphore = asyncio.Semaphore(self.args.concurrency)
+        first_id = self.args.admin_id + 100
+        started = time.perf_counter()
+        await asyncio.gather(*[
+            self.user_session(first_id + i, semaphore) for i in range(self.args.users)
+        ])
+        for _ in range(self.args.reports):
+            await self.reports(leader_id)
+        elapsed = time.perf_counter() - started
+        return elapsed
+
+
+async def amain(args):
+    tmp = tempfile.mkdtemp(prefix="factory-loadtest-")
+    os.environ.update({
+        "DB_BACKEND": args.db_backend,
+        "DB_PATH": os.path.join(tmp, "factory.db"),
+        "FSM_STORAGE": args.fsm_storage,
+        "FSM_DB_PATH": os.path.join(tmp, "fsm.db"),
+        "ARCHIVE_DIR": os.path.join(tmp, "archive"),
+        "RETENTION_INTERVAL_HOURS": "0",
+        "EXPIRY_CHECK_INTERVAL_HOURS": "0",
+        "SUPER_ADMIN_TG_ID": str(args.admin_id),
+    })
+    import logging
+    logging.disable(logging.WARNING)
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import main
+    from aiogram import Bot, Dispatcher
+
+    fake = FakeTelegram()
+    main.bot.request = fake.request
+    Bot.set_current(main.bot)
+    Dispatcher.set_current(main.dp)
+    await main.on_startup(main.dp)
+
+    harness = Harness(main, args)
+    try:
+        elapsed = await harness.run()
+    finally:
+        await main.on_shutdown(main.dp)
+        await main.dp.storage.close()
+        await main.dp.storage.wait_closed()
+
+    print(f"Пользователей: {args.users}, параллельно: {args.concurrency}, передач на пользователя: {args.transfers}")
+    print(f"Апдейтов: {harness.updates} за {elapsed:.2f} с — {harness.updates / elapsed:.0f} апдейтов/с")
+    print(f"Запросов к Telegram: {dict(fake.calls)}")
+    print()
+    print(harness.handler_stats.report("Задержка обработки апдейта по шагам:"))
+    print()
+    print(harness.db_stats.report("Задержка запросов к БД (с ожиданием в очереди):"))
+    print(f"\nВременные файлы: {tmp}")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Нагрузочный прогон бота без сети")
+    parser.add_argument("--users", type=int, default=500, help="число синтетических пользователей")
+    parser.add_argument("--concurrency", type=int, default=200, help="сколько пользователей активны одновременно")
+    parser.add_argument("--transfers", type=int, default=3, help="передач на пользователя")
+    parser.add_argument("--dishes", type=int, default=300, help="размер каталога блюд")
+    parser.add_argument("--reports", type=int, default=20, help="сколько раз руководитель открывает отчёт")
+    parser.add_argument("--fsm-storage", default="sqlite", choices=["sqlite", "memory"])
+    parser.add_argument("--db-backend", default="sqlite", choices=["sqlite", "memory"],
+                        help="хранилище данных (memory — без диска, см. backends.py)")
+    parser.add_argument("--admin-id", type=int, default=1000)
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    asyncio.run(amain(parse_args()))
@@ -1,26 +1,75 @@
 # main.py
 import logging
 import datetime
+import html
+from aiohttp import web
 from aiogram import Bot, Dispatcher, types
 from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup, ReplyKeyboardRemove
 from aiogram.contrib.fsm_storage.memory import MemoryStorage
 from aiogram.dispatcher import FSMContext
-from aiogram.dispatcher.filters import Text
 from aiogram.utils import executor
+from aiogram.utils.exceptions import MessageNotModified
 
 from config import (
-    BOT_TOKEN, SUPER_ADMIN_TG_ID, DEPARTMENTS, 
+    BOT_TOKEN, SUPER_ADMIN_TG_ID, DEPARTMENTS, DB_BACKEND, DB_PATH, REPORT_PAGE_SIZE,
+    FSM_STORAGE, FSM_DB_PATH, RUN_MODE, SKIP_UPDATES, ARCHIVE_ENABLED, ARCHIVE_DIR,
+    WEBHOOK_URL, WEBHOOK_PATH, WEBHOOK_SECRET, WEBAPP_HOST, WEBAPP_PORT, METRICS_HOST, METRICS_PORT,
     ROLE_ADMIN, ROLE_LEADER, ROLE_WORKER
 )
-from states import RegistrationFSM, TransferFSM
+from states import RegistrationFSM, TransferFSM, AdminFSM
+import backends
+import audit
+import bulk
+import callbacks
 import database as db
+import export
+import incoming
+import metrics
+import reports
+import timeutil
+from archive import Archive, get_transactions_page
+from async_db import AsyncDatabase
+from catalog import DishCatalog
+from digest import AdminDigest, label_expired
+from expiry import ExpiryJob
+from fsm_storage import SQLiteStorage
+from notifier import Notifier
+from retention import RetentionJob
+from webhook import WebhookServer
 
 logging.basicConfig(level=logging.INFO)
 
 # ИНИЦИАЛИЗАЦИЯ БОТА И БАЗЫ
 bot = Bot(token=BOT_TOKEN, parse_mode="HTML")
-dp = Dispatcher(bot, storage=MemoryStorage())
-conn = db.init_db("factory.db")
+# Состояния диалогов хранятся в SQLite, чтобы переживать перезапуск (см. fsm_storage.py)
+storage = SQLiteStorage(FSM_DB_PATH) if FSM_STORAGE == "sqlite" else MemoryStorage()
+dp = Dispatcher(bot, storage=storage)
+# Хранилище данных выбирается в config.DB_BACKEND (см. backends.py)
+backend, conn = backends.open_backend(DB_BACKEND, DB_PATH)
+# Все запросы к БД из хендлеров идут через отдельный поток (см. async_db.py)
+adb = AsyncDatabase(conn, backend)
+# Каталог блюд с готовыми клавиатурами для шага выбора блюда
+catalog = DishCatalog()
+# Уведомления другим пользователям отправляются в фоне (см. notifier.py)
+notifier = Notifier(bot)
+# Устаревшие данные переносятся в помесячные архивы (см. archive.py) и фоново очищаются (retention.py)
+archive = Archive(ARCHIVE_DIR) if ARCHIVE_ENABLED else None
+retention = RetentionJob(adb, archive)
+# Предупреждения цехам о подходящих к сроку остатках по дате на этикетке (expiry.py)
+expiry = ExpiryJob(adb, notifier)
+# Передачи без подтверждения — администраторам одной сводкой за интервал (digest.py)
+digest = AdminDigest(adb, notifier)
+# Задержки хендлеров и запросов к БД, счётчики ошибок (см. metrics.py): /stats и GET /metrics
+dp.middleware.setup(metrics.MetricsMiddleware())
+metrics.metrics.add_collector("db", adb.stats)
+if hasattr(backend, "user_cache"):
+    metrics.metrics.add_collector("user_cache", backend.user_cache.stats)
+metrics.metrics.add_collector("notifier", notifier.stats)
+metrics.metrics.add_collector("admin_digest", digest.stats)
+metrics_runner = None
+# Все inline-кнопки разбираются одним хендлером по таблице маршрутов (см. callbacks.py)
+router = callbacks.CallbackRouter()
+router.register(dp)
 
 # ---- ХЕЛПЕРЫ РОЛЕЙ ----
 
@@ -30,33 +79,16 @@ def user_is_admin_or_leader(user_role: str) -> bool:
 def user_is_admin(user_role: str) -> bool:
     return user_role == ROLE_ADMIN
 
-# ---- МИДДЛВЭР: ПРОВЕРКА "ПОДТВЕРЖДЁН ЛИ ПОЛЬЗОВАТЕЛЬ" ----
-@dp.message_handler()
-async def check_approved(message: types.Message):
-    """
-    Этот хендлер будет проверять, не является ли команда
-    системной (уже отловленной другими хендлерами).
-    Если пользователь не подтверждён и пытается что-то писать —
-    отправляем уведомление. 
-    """
-    # Если команда /start, /admin, /menu и т.п. — их отлавливают другие хендлеры
-    # Но если это что-то "левое", проверим статус подтверждения
-    user = db.get_user_by_telegram_id(conn, message.from_user.id)
-    if not user:
-        return  # Пусть идёт регистрация
-    if user[5] == 0:  # approved=0
-        await message.answer("Ваш аккаунт ещё не подтверждён администратором. Ожидайте.")
-    else:
-        # Просто игнорируем, если нет подходящего хендлера
-        pass
-
+# Маршруты, по которым товар передаётся без подтверждения получателя (auto_done)
+# и с обязательной датой на этикетке
+AUTO_ROUTES = [("Упаковка", "Холодильник"), ("Холодильник", "Покупатель")]
 
 # --- START: РЕГИСТРАЦИЯ ---
 
 @dp.message_handler(commands=["start"], state="*")
 async def cmd_start(message: types.Message, state: FSMContext):
     await state.finish()
-    user = db.get_user_by_telegram_id(conn, message.from_user.id)
+    user = await adb.get_user_by_telegram_id(message.from_user.id)
 
     # Если SUPER_ADMIN_TG_ID задали, и этот человек впервые запускает бота —
     # делаем его админом сразу, без подтверждения
@@ -64,7 +96,7 @@ async def cmd_start(message: types.Message, state: FSMContext):
         try:
             if int(SUPER_ADMIN_TG_ID) == message.from_user.id:
                 # Создаём запись пользователя как админа
-                db.create_user(conn, message.from_user.id, "SuperAdmin", ROLE_ADMIN, "АдминОтдел", approved=1)
+                await adb.create_user(message.from_user.id, "SuperAdmin", ROLE_ADMIN, "АдминОтдел", approved=1)
                 await message.answer("Вы являетесь супер-админом. Учётная запись создана и подтверждена.")
                 return
         except:
@@ -94,38 +126,42 @@ async def reg_full_name(message: types.Message, state: FSMContext):
     await state.update_data(full_name=message.text)
     # Выбираем роль
     buttons = [
-        InlineKeyboardButton("Работник", callback_data="role_worker"),
-        InlineKeyboardButton("Руководитель", callback_data="role_leader")
+        InlineKeyboardButton("Работник", callback_data=callbacks.encode(callbacks.ROLE, "w")),
+        InlineKeyboardButton("Руководитель", callback_data=callbacks.encode(callbacks.ROLE, "l"))
     ]
     markup = InlineKeyboardMarkup().add(*buttons)
     await message.answer("Выберите вашу роль:", reply_markup=markup)
     await RegistrationFSM.waiting_for_role.set()
 
-@dp.callback_query_handler(Text(startswith="role_"), state=RegistrationFSM.waiting_for_role)
-async def reg_role(callback_query: types.CallbackQuery, state: FSMContext):
-    if callback_query.data not in ["role_worker", "role_leader"]:
+@router.route(callbacks.ROLE, state=RegistrationFSM.waiting_for_role)
+async def reg_role(callback_query: types.CallbackQuery, state: FSMContext, code):
+    if code not in ("w", "l"):
         await callback_query.answer("Некорректный выбор.")
         return
-    role = ROLE_WORKER if callback_query.data == "role_worker" else ROLE_LEADER
+    role = ROLE_WORKER if code == "w" else ROLE_LEADER
     await state.update_data(role=role)
 
     # Спрашиваем цех
     markup = InlineKeyboardMarkup(row_width=2)
-    for dep in DEPARTMENTS:
-        markup.add(InlineKeyboardButton(dep, callback_data=f"dep_{dep}"))
+    for idx, dep in enumerate(DEPARTMENTS):
+        markup.add(InlineKeyboardButton(dep, callback_data=callbacks.encode(callbacks.DEPARTMENT, idx)))
 
     await callback_query.message.edit_text("Выберите ваш отдел:", reply_markup=markup)
     await RegistrationFSM.waiting_for_department.set()
 
-@dp.callback_query_handler(Text(startswith="dep_"), state=RegistrationFSM.waiting_for_department)
-async def reg_department(callback_query: types.CallbackQuery, state: FSMContext):
-    department = callback_query.data.split("_", 1)[1]
+@router.route(callbacks.DEPARTMENT, state=RegistrationFSM.waiting_for_department)
+async def reg_department(callback_query: types.CallbackQuery, state: FSMContext, dep_idx):
+    try:
+        department = callbacks.department_name(dep_idx)
+    except ValueError:
+        await callback_query.answer("Некорректный выбор.")
+        return
     data = await state.get_data()
     full_name = data.get("full_name")
     role = data.get("role")
 
     try:
-        db.create_user(conn, callback_query.from_user.id, full_name, role, department, approved=0)
+        await adb.create_user(callback_query.from_user.id, full_name, role, department, approved=0)
         await callback_query.message.edit_text(
             "Спасибо за регистрацию!\n"
             "Пожалуйста, дождитесь подтверждения вашего аккаунта администратором."
@@ -140,7 +176,7 @@ async def reg_department(callback_query: types.CallbackQuery, state: FSMContext)
 
 @dp.message_handler(commands=["admin"])
 async def cmd_admin(message: types.Message):
-    user = db.get_user_by_telegram_id(conn, message.from_user.id)
+    user = await adb.get_user_by_telegram_id(message.from_user.id)
     if not user:
         return
     # (id, tg_id, full_name, role, department, approved)
@@ -151,66 +187,168 @@ async def cmd_admin(message: types.Message):
 
     # Меню администратора
     markup = InlineKeyboardMarkup()
-    markup.add(InlineKeyboardButton("Список неподтверждённых", callback_data="admin_list_pending"))
-    markup.add(InlineKeyboardButton("Добавить блюдо", callback_data="admin_add_dish"))
-    markup.add(InlineKeyboardButton("Очистка старых данных", callback_data="admin_cleanup"))
+    markup.add(InlineKeyboardButton("Список неподтверждённых", callback_data=callbacks.encode(callbacks.ADMIN_PENDING)))
+    markup.add(InlineKeyboardButton("Добавить блюдо", callback_data=callbacks.encode(callbacks.ADMIN_ADD_DISH)))
+    markup.add(InlineKeyboardButton("Очистка старых данных", callback_data=callbacks.encode(callbacks.ADMIN_CLEANUP)))
+    markup.add(InlineKeyboardButton("Пересчитать сводки", callback_data=callbacks.encode(callbacks.ADMIN_ROLLUP)))
+    markup.add(InlineKeyboardButton("Сверить остатки", callback_data=callbacks.encode(callbacks.ADMIN_STOCK_CHECK)))
     await message.answer("Панель администратора:", reply_markup=markup)
 
-@dp.callback_query_handler(Text(startswith="admin_"))
-async def admin_callbacks(callback_query: types.CallbackQuery):
-    user = db.get_user_by_telegram_id(conn, callback_query.from_user.id)
+@dp.message_handler(commands=["stats"])
+async def cmd_stats(message: types.Message):
+    user = await adb.get_user_by_telegram_id(message.from_user.id)
+    if not user or user[3] != ROLE_ADMIN:
+        await message.answer("Вы не администратор.")
+        return
+    await message.answer(reports.truncate(metrics.metrics.render_text()))
+
+@dp.message_handler(commands=["audit"])
+async def cmd_audit(message: types.Message):
+    user = await adb.get_user_by_telegram_id(message.from_user.id)
+    if not user or user[3] != ROLE_ADMIN:
+        await message.answer("Вы не администратор.")
+        return
+    try:
+        kind, value = audit.parse_query(message.get_args())
+    except ValueError:
+        await message.answer(audit.USAGE)
+        return
+    text, markup = await _audit_page(kind, value, None)
+    await message.answer(text, reply_markup=markup)
+
+async def _audit_page(kind, value, before):
+    # Буфер журнала сбрасывается на потоке записи, сама страница читается из пула чтения
+    await adb.flush_logs()
+    rows, has_more = await adb.reader.get_audit_page(**audit.query_filter(kind, value), before=before,
+                                                     limit=REPORT_PAGE_SIZE)
+    return reports.render_audit(kind, value, rows), reports.audit_markup(kind, value, rows, has_more)
+
+async def _require_admin(callback_query: types.CallbackQuery) -> bool:
+    user = await adb.get_user_by_telegram_id(callback_query.from_user.id)
     if not user or user[3] != ROLE_ADMIN:
         await callback_query.answer("Нет прав администратора.")
+        return False
+    return True
+
+@router.route(callbacks.AUDIT_PAGE)
+async def audit_page(callback_query: types.CallbackQuery, state: FSMContext, kind, value, ts, log_id):
+    # Следующая страница истории: курсор (ts, id) последней показанной записи — в callback_data
+    try:
+        value, before = int(value), (int(ts), int(log_id))
+        audit.query_filter(kind, value)
+    except ValueError:
+        await callback_query.answer("Некорректная страница истории.")
+        return
+    if not await _require_admin(callback_query):
         return
+    text, markup = await _audit_page(kind, value, before)
+    try:
+        await callback_query.message.edit_text(text, reply_markup=markup)
+    except MessageNotModified:
+        pass
+    await callback_query.answer()
 
-    data = callback_query.data
-    if data == "admin_list_pending":
-        rows = db.get_all_pending_users(conn)
-        if not rows:
-            await callback_query.message.edit_text("Нет неподтверждённых пользователей.")
-        else:
-            lines = []
-            markup = InlineKeyboardMarkup()
-            for (uid, fname, r, dep) in rows:
-                lines.append(f"{uid} — {fname} ({r}, {dep})")
-                markup.add(InlineKeyboardButton(f"Подтвердить {uid}", callback_data=f"admin_approve_{uid}"))
-            await callback_query.message.edit_text("\n".join(lines), reply_markup=markup)
-
-    elif data.startswith("admin_approve_"):
-        uid_str = data.split("_")[-1]
-        try:
-            uid = int(uid_str)
-            db.approve_user(conn, uid)
-            await callback_query.answer("Пользователь подтверждён!", show_alert=True)
-            await callback_query.message.delete()
-        except:
-            await callback_query.answer("Ошибка ID.")
+@router.route(callbacks.ADMIN_PENDING)
+async def admin_list_pending(callback_query: types.CallbackQuery, state: FSMContext):
+    if not await _require_admin(callback_query):
+        return
+    rows = await adb.get_all_pending_users()
+    if not rows:
+        await callback_query.message.edit_text("Нет неподтверждённых пользователей.")
+    else:
+        lines = []
+        markup = InlineKeyboardMarkup()
+        for (uid, fname, r, dep) in rows:
+            lines.append(f"{uid} — {fname} ({r}, {dep})")
+            markup.add(InlineKeyboardButton(
+                f"Подтвердить {uid}", callback_data=callbacks.encode(callbacks.ADMIN_APPROVE, uid)
+            ))
+        await callback_query.message.edit_text("\n".join(lines), reply_markup=markup)
+
+@router.route(callbacks.ADMIN_APPROVE)
+async def admin_approve(callback_query: types.CallbackQuery, state: FSMContext, uid_str):
+    if not await _require_admin(callback_query):
+        return
+    try:
+        uid = int(uid_str)
+        await adb.approve_user(uid)
+        await callback_query.answer("Пользователь подтверждён!", show_alert=True)
+        await callback_query.message.delete()
+    except:
+        await callback_query.answer("Ошибка ID.")
 
-    elif data == "admin_add_dish":
-        await callback_query.message.edit_text("Введите новое блюдо в формате: <b>Название, Категория</b>")
+@router.route(callbacks.ADMIN_ADD_DISH)
+async def admin_add_dish(callback_query: types.CallbackQuery, state: FSMContext):
+    if not await _require_admin(callback_query):
+        return
+    await callback_query.message.edit_text("Введите новое блюдо в формате: <b>Название, Категория</b>")
+    await AdminFSM.waiting_for_dish.set()
 
-        @dp.message_handler(content_types=types.ContentTypes.TEXT, state="*")
-        async def add_dish_handler(msg: types.Message):
-            if "," not in msg.text:
-                await msg.answer("Неверный формат. Нужно: Название, Категория.")
-                return
-            name, category = msg.text.split(",", 1)
-            name, category = name.strip(), category.strip()
-            db.add_dish(conn, name, category)
-            # Удаляем этот хендлер (чтобы не срабатывал каждый раз). 
-            # В реальном проекте лучше FSM, но для примера — так.
-            dp.message_handlers.unregister(add_dish_handler)
-            await msg.answer(f"Блюдо '{name}' добавлено с категорией '{category}'.")
-
-    elif data == "admin_cleanup":
-        db.cleanup_old_data(conn)
-        await callback_query.message.edit_text("Очистка старых данных выполнена.")
+@dp.message_handler(state=AdminFSM.waiting_for_dish, content_types=types.ContentTypes.TEXT)
+async def add_dish(message: types.Message, state: FSMContext):
+    if "," not in message.text:
+        await message.answer("Неверный формат. Нужно: Название, Категория.")
+        return
+    name, category = message.text.split(",", 1)
+    name, category = name.strip(), category.strip()
+    await adb.add_dish(name, category)
+    await state.finish()
+    await message.answer(f"Блюдо '{name}' добавлено с категорией '{category}'.")
+
+@router.route(callbacks.ADMIN_CLEANUP)
+async def admin_cleanup(callback_query: types.CallbackQuery, state: FSMContext):
+    await _show_cleanup(callback_query, start=True)
+
+@router.route(callbacks.ADMIN_CLEANUP_STATUS)
+async def admin_cleanup_status(callback_query: types.CallbackQuery, state: FSMContext):
+    await _show_cleanup(callback_query, start=False)
+
+async def _show_cleanup(callback_query: types.CallbackQuery, start: bool):
+    # Очистка идёт в фоне пачками; кнопка только запускает её или показывает прогресс
+    if not await _require_admin(callback_query):
+        return
+    if start and retention.trigger():
+        text = "Очистка старых данных запущена в фоне."
+    else:
+        text = retention.describe()
+    markup = InlineKeyboardMarkup()
+    markup.add(InlineKeyboardButton("Обновить статус", callback_data=callbacks.encode(callbacks.ADMIN_CLEANUP_STATUS)))
+    try:
+        await callback_query.message.edit_text(text, reply_markup=markup)
+    except MessageNotModified:
+        pass
+    await callback_query.answer()
+
+@router.route(callbacks.ADMIN_ROLLUP)
+async def admin_rebuild_rollup(callback_query: types.CallbackQuery, state: FSMContext):
+    if not await _require_admin(callback_query):
+        return
+    count = await adb.rebuild_rollup()
+    await callback_query.message.edit_text(f"Сводки пересчитаны, строк агрегатов: {count}.")
+
+@router.route(callbacks.ADMIN_STOCK_CHECK)
+async def admin_check_stock(callback_query: types.CallbackQuery, state: FSMContext):
+    if not await _require_admin(callback_query):
+        return
+    mismatches, rows = await adb.check_stock()
+    markup = None
+    if mismatches:
+        markup = InlineKeyboardMarkup()
+        markup.add(InlineKeyboardButton("Пересобрать остатки", callback_data=callbacks.encode(callbacks.ADMIN_STOCK_REBUILD)))
+    await callback_query.message.edit_text(reports.render_stock_check(mismatches, rows), reply_markup=markup)
+
+@router.route(callbacks.ADMIN_STOCK_REBUILD)
+async def admin_rebuild_stock(callback_query: types.CallbackQuery, state: FSMContext):
+    if not await _require_admin(callback_query):
+        return
+    count = await adb.rebuild_stock()
+    await callback_query.message.edit_text(f"Остатки пересобраны из истории передач, строк: {count}.")
 
 # --- /menu ---
 
 @dp.message_handler(commands=["menu"])
 async def cmd_menu(message: types.Message):
-    user = db.get_user_by_telegram_id(conn, message.from_user.id)
+    user = await adb.get_user_by_telegram_id(message.from_user.id)
     if not user:
         return
     role = user[3]
@@ -221,91 +359,196 @@ async def cmd_menu(message: types.Message):
 
     # Главное меню
     markup = InlineKeyboardMarkup()
-    markup.add(InlineKeyboardButton("Передать товар", callback_data="menu_transfer"))
+    markup.add(InlineKeyboardButton("Передать товар", callback_data=callbacks.encode(callbacks.MENU_TRANSFER)))
+    markup.add(InlineKeyboardButton("Передать списком", callback_data=callbacks.encode(callbacks.MENU_BULK)))
     if role in [ROLE_LEADER, ROLE_ADMIN]:
-        markup.add(InlineKeyboardButton("Отчёты", callback_data="menu_reports"))
-    markup.add(InlineKeyboardButton("Мои входящие", callback_data="menu_incoming"))
+        markup.add(InlineKeyboardButton("Отчёты", callback_data=callbacks.encode(callbacks.MENU_REPORTS)))
+    markup.add(InlineKeyboardButton("Мои входящие", callback_data=callbacks.encode(callbacks.MENU_INCOMING)))
+    markup.add(InlineKeyboardButton("Остатки цеха", callback_data=callbacks.encode(callbacks.MENU_STOCK)))
     await message.answer("Выберите действие:", reply_markup=markup)
 
 # --- Обработка кнопок меню ---
-@dp.callback_query_handler(Text(startswith="menu_"))
-async def menu_callbacks(callback_query: types.CallbackQuery, state: FSMContext):
-    data = callback_query.data
-    user = db.get_user_by_telegram_id(conn, callback_query.from_user.id)
+
+async def _approved_user(callback_query: types.CallbackQuery):
+    user = await adb.get_user_by_telegram_id(callback_query.from_user.id)
     if not user:
         await callback_query.answer("Нет пользователя.")
+        return None
+    if user[5] == 0:
+        await callback_query.answer("Аккаунт не подтверждён.")
+        return None
+    return user
+
+@router.route(callbacks.MENU_TRANSFER)
+async def menu_transfer(callback_query: types.CallbackQuery, state: FSMContext):
+    await _start_transfer(callback_query, state, bulk=False)
+
+@router.route(callbacks.MENU_BULK)
+async def menu_bulk(callback_query: types.CallbackQuery, state: FSMContext):
+    # Передача списком: все позиции одной партией (transfer_batches)
+    await _start_transfer(callback_query, state, bulk=True)
+
+async def _start_transfer(callback_query: types.CallbackQuery, state: FSMContext, bulk: bool):
+    if not await _approved_user(callback_query):
         return
-    role = user[3]
-    user_id = user[0]
-    department = user[4]
-    approved = user[5]
+    # Начинаем FSM передачи
+    await callback_query.answer()
+    await state.set_data({"bulk": bulk})
+    buttons = []
+    for idx, dep in enumerate(DEPARTMENTS):
+        buttons.append(InlineKeyboardButton(dep, callback_data=callbacks.encode(callbacks.TO_DEPARTMENT, idx)))
+    markup = InlineKeyboardMarkup(row_width=2)
+    markup.add(*buttons)
+    await callback_query.message.edit_text("Выберите цех (или покупателя) для передачи:", reply_markup=markup)
+    await TransferFSM.waiting_for_to_department.set()
 
-    if approved == 0:
-        await callback_query.answer("Аккаунт не подтверждён.")
+@router.route(callbacks.MENU_REPORTS)
+async def menu_reports(callback_query: types.CallbackQuery, state: FSMContext):
+    user = await _approved_user(callback_query)
+    if not user:
         return
+    if not user_is_admin_or_leader(user[3]):
+        await callback_query.answer("Нет прав для отчётов.")
+        return
+    await callback_query.message.edit_text("Выберите отчёт:", reply_markup=reports.reports_menu_markup())
 
-    if data == "menu_transfer":
-        # Начинаем FSM передачи
-        await callback_query.answer()
-        buttons = []
-        for dep in DEPARTMENTS:
-            buttons.append(InlineKeyboardButton(dep, callback_data=f"to_dep_{dep}"))
-        markup = InlineKeyboardMarkup(row_width=2)
-        markup.add(*buttons)
-        await callback_query.message.edit_text("Выберите цех (или покупателя) для передачи:", reply_markup=markup)
-        await TransferFSM.waiting_for_to_department.set()
-
-    elif data == "menu_reports":
-        # Меню отчётов
-        if not user_is_admin_or_leader(role):
-            await callback_query.answer("Нет прав для отчётов.")
-            return
-        markup = InlineKeyboardMarkup()
-        markup.add(InlineKeyboardButton("Отчёт за сегодня", callback_data="report_today"))
-        markup.add(InlineKeyboardButton("Отчёт за всё время", callback_data="report_all"))
-        await callback_query.message.edit_text("Выберите отчёт:", reply_markup=markup)
-
-    elif data == "menu_incoming":
-        # Показать входящие транзакции
-        pending = db.get_pending_transactions_for_department(conn, department)
-        if not pending:
-            await callback_query.message.edit_text("Нет ожидающих приёмки товаров.")
-        else:
-            lines = ["<b>Ожидающие приёмки:</b>"]
-            markup = InlineKeyboardMarkup()
-            for (tid, dish_name, qty, from_dep, lbl_date) in pending:
-                label_info = f" (дата: {lbl_date})" if lbl_date else ""
-                lines.append(f"#{tid} | {dish_name} x {qty} | из {from_dep}{label_info}")
-                btn_a = InlineKeyboardButton(f"Принять #{tid}", callback_data=f"accept_{tid}")
-                btn_r = InlineKeyboardButton(f"Отклонить #{tid}", callback_data=f"reject_{tid}")
-                markup.row(btn_a, btn_r)
-            await callback_query.message.edit_text("\n".join(lines), reply_markup=markup)
+@router.route(callbacks.MENU_INCOMING)
+async def menu_incoming(callback_query: types.CallbackQuery, state: FSMContext):
+    user = await _approved_user(callback_query)
+    if not user:
+        return
+    await _show_incoming(callback_query, user[4])
+
+@router.route(callbacks.MENU_STOCK)
+async def menu_stock(callback_query: types.CallbackQuery, state: FSMContext):
+    # Остатки ведутся при каждой смене статуса передачи, здесь — только чтение по ключу цеха
+    user = await _approved_user(callback_query)
+    if not user:
+        return
+    rows = await adb.reader.get_stock(user[4])
+    await callback_query.message.edit_text(reports.render_stock(user[4], rows))
+    await callback_query.answer()
+
+async def _show_incoming(callback_query: types.CallbackQuery, department):
+    # Показать входящие транзакции; позиции партий — одним блоком с общими кнопками
+    # Чтение через пул (adb.reader): список не ждёт в очереди за записью передач
+    pending = await adb.reader.get_pending_transactions_for_department(department)
+    text, markup = incoming.render(pending)
+    try:
+        await callback_query.message.edit_text(text, reply_markup=markup)
+    except MessageNotModified:
+        pass
+
+@router.route(callbacks.SELECT_MODE)
+async def incoming_select(callback_query: types.CallbackQuery, state: FSMContext):
+    user = await _approved_user(callback_query)
+    if not user:
+        return
+    pending = await adb.reader.get_pending_transactions_for_department(user[4])
+    await callback_query.message.edit_text(
+        "Отметьте передачи и нажмите «Принять выбранные» или «Отклонить выбранные».",
+        reply_markup=incoming.selection_markup(pending)
+    )
+    await callback_query.answer()
+
+@router.route(callbacks.TOGGLE)
+async def incoming_toggle(callback_query: types.CallbackQuery, state: FSMContext, trans_id_str):
+    # Отметка меняется только в клавиатуре сообщения, без обращения к БД
+    markup = callback_query.message.reply_markup
+    if markup is not None:
+        await callback_query.message.edit_reply_markup(incoming.toggle(markup, trans_id_str))
+    await callback_query.answer()
+
+@router.route(callbacks.ACCEPT_SELECTED)
+async def incoming_accept_selected(callback_query: types.CallbackQuery, state: FSMContext):
+    await _settle_many(callback_query, accept=True, trans_ids=incoming.selected_ids(callback_query.message.reply_markup))
+
+@router.route(callbacks.REJECT_SELECTED)
+async def incoming_reject_selected(callback_query: types.CallbackQuery, state: FSMContext):
+    await _settle_many(callback_query, accept=False, trans_ids=incoming.selected_ids(callback_query.message.reply_markup))
+
+@router.route(callbacks.ACCEPT_ALL)
+async def incoming_accept_all(callback_query: types.CallbackQuery, state: FSMContext, max_id_str):
+    if not max_id_str.isdigit():
+        await callback_query.answer("Некорректная кнопка.")
+        return
+    await _settle_many(callback_query, accept=True, max_id=int(max_id_str))
+
+async def _settle_many(callback_query: types.CallbackQuery, accept: bool, trans_ids=None, max_id=None):
+    user = await _approved_user(callback_query)
+    if not user:
+        return
+    if trans_ids is not None and not trans_ids:
+        await callback_query.answer("Ничего не выбрано.")
+        return
+    # Все выбранные передачи — одним UPDATE и одним commit
+    count = await adb.settle_pending(user[4], user[0], accept, trans_ids=trans_ids, max_id=max_id)
+    verb = "Принято" if accept else "Отклонено"
+    await callback_query.answer(f"{verb}: {count}.", show_alert=True)
+    await _show_incoming(callback_query, user[4])
 
 # --- FSM ПЕРЕДАЧА ---
 
-@dp.callback_query_handler(Text(startswith="to_dep_"), state=TransferFSM.waiting_for_to_department)
-async def select_to_department(callback_query: types.CallbackQuery, state: FSMContext):
-    to_dep = callback_query.data.split("_", 1)[1]
+@router.route(callbacks.TO_DEPARTMENT, state=TransferFSM.waiting_for_to_department)
+async def select_to_department(callback_query: types.CallbackQuery, state: FSMContext, dep_idx):
+    try:
+        to_dep = callbacks.department_name(dep_idx)
+    except ValueError:
+        await callback_query.answer("Некорректный выбор.")
+        return
     await callback_query.answer()
 
     await state.update_data(to_department=to_dep)
-    dishes = db.get_all_dishes(conn)
-    if not dishes:
+    # Каталог берётся из памяти; в БД идём, только если блюда менялись
+    await catalog.ensure_loaded(adb)
+    if catalog.empty:
         await callback_query.message.edit_text("Нет доступных блюд. Добавьте блюдо через админа.")
         await state.finish()
         return
-    markup = InlineKeyboardMarkup(row_width=2)
-    for (dish_id, name, cat) in dishes:
-        markup.add(InlineKeyboardButton(f"{name} ({cat})", callback_data=f"dish_{dish_id}"))
-    await callback_query.message.edit_text("Выберите блюдо:", reply_markup=markup)
+    if (await state.get_data()).get("bulk"):
+        await callback_query.message.edit_text(f"Передача в {to_dep} списком.\n" + bulk.FORMAT_HINT)
+        await TransferFSM.waiting_for_bulk_lines.set()
+        return
+    await callback_query.message.edit_text("Выберите блюдо:", reply_markup=catalog.first_markup())
 
     await TransferFSM.waiting_for_dish.set()
 
-@dp.callback_query_handler(Text(startswith="dish_"), state=TransferFSM.waiting_for_dish)
-async def select_dish(callback_query: types.CallbackQuery, state: FSMContext):
-    dish_id_str = callback_query.data.split("_")[1]
+@router.route(callbacks.CATEGORIES, state=TransferFSM.waiting_for_dish)
+async def browse_categories(callback_query: types.CallbackQuery, state: FSMContext, version, page):
     await callback_query.answer()
-    await state.update_data(dish_id=dish_id_str)
+    await catalog.ensure_loaded(adb)
+    if not catalog.is_current(version):
+        await _show_catalog(callback_query, "Список блюд обновился. Выберите блюдо:", catalog.first_markup())
+    elif page.isdigit():
+        await _show_catalog(callback_query, "Выберите категорию:", catalog.category_page(int(page)))
+
+@router.route(callbacks.DISH_PAGE, state=TransferFSM.waiting_for_dish)
+async def browse_dishes(callback_query: types.CallbackQuery, state: FSMContext, version, cat_idx, page):
+    await callback_query.answer()
+    await catalog.ensure_loaded(adb)
+    if not catalog.is_current(version):
+        await _show_catalog(callback_query, "Список блюд обновился. Выберите блюдо:", catalog.first_markup())
+    elif cat_idx.isdigit() and page.isdigit():
+        text = f"Категория: {catalog.category_name(int(cat_idx))}\nВыберите блюдо:"
+        await _show_catalog(callback_query, text, catalog.dish_page(int(cat_idx), int(page)))
+
+async def _show_catalog(callback_query: types.CallbackQuery, text, markup):
+    if markup is None:
+        return
+    try:
+        await callback_query.message.edit_text(text, reply_markup=markup)
+    except MessageNotModified:
+        pass
+
+@router.route(callbacks.DISH, state=TransferFSM.waiting_for_dish)
+async def select_dish(callback_query: types.CallbackQuery, state: FSMContext, dish_id_str):
+    await catalog.ensure_loaded(adb)
+    dish_id = int(dish_id_str) if dish_id_str.isdigit() else None
+    if dish_id not in catalog.names:
+        await callback_query.answer("Блюдо не найдено. Выберите блюдо из списка заново.")
+        return
+    await callback_query.answer()
+    await state.update_data(dish_id=dish_id)
     await callback_query.message.edit_text("Введите количество (число):")
     await TransferFSM.waiting_for_quantity.set()
 
@@ -319,7 +562,7 @@ async def set_quantity(message: types.Message, state: FSMContext):
 
     await state.update_data(quantity=qty)
 
-    user = db.get_user_by_telegram_id(conn, message.from_user.id)
+    user = await adb.get_user_by_telegram_id(message.from_user.id)
     from_dep = user[4]
     data = await state.get_data()
     to_dep = data["to_department"]
@@ -338,11 +581,16 @@ async def set_quantity(message: types.Message, state: FSMContext):
 
 @dp.message_handler(state=TransferFSM.waiting_for_label_date)
 async def set_label_date(message: types.Message, state: FSMContext):
-    label_date = message.text.strip()
-    await finalize_transfer(message, state, label_date)
+    try:
+        day = timeutil.parse_label_date(message.text)
+    except ValueError:
+        # Остаёмся в том же шаге: по дате считаются остатки и сроки годности
+        await message.answer("Не похоже на дату. Введите дату на этикетке в виде ДД.ММ.ГГГГ (например, 20.01.2025):")
+        return
+    await finalize_transfer(message, state, timeutil.format_label_date(day))
 
 async def finalize_transfer(message: types.Message, state: FSMContext, label_date):
-    user = db.get_user_by_telegram_id(conn, message.from_user.id)
+    user = await adb.get_user_by_telegram_id(message.from_user.id)
     if not user:
         await message.answer("Ошибка пользователя.")
         await state.finish()
@@ -351,18 +599,17 @@ async def finalize_transfer(message: types.Message, state: FSMContext, label_dat
     from_dep = user[4]
     data = await state.get_data()
     to_dep = data["to_department"]
-    dish_id = data["dish_id"]
+    # Состояния FSM, сохранённые до проверки в select_dish, хранят id блюда строкой
+    dish_id = int(data["dish_id"])
     qty = data["quantity"]
 
     # Определяем статус (pending / auto_done)
-    auto_departments = [("Упаковка", "Холодильник"), ("Холодильник", "Покупатель")]
-    if (from_dep, to_dep) in auto_departments:
+    if (from_dep, to_dep) in AUTO_ROUTES:
         status = "auto_done"
     else:
         status = "pending"
 
-    trans_id = db.create_transaction(conn, user_id, from_dep, to_dep, dish_id, qty, label_date, status)
-    db.log_action(conn, user_id, f"Create transaction #{trans_id}")
+    trans_id = await adb.create_transfer(user_id, from_dep, to_dep, dish_id, qty, label_date, status)
 
     # Уведомляем отправителя
     if status == "auto_done":
@@ -370,15 +617,14 @@ async def finalize_transfer(message: types.Message, state: FSMContext, label_dat
             f"Товар передан без подтверждения (auto_done).\n"
             f"Цех: {to_dep}, Кол-во: {qty}, label={label_date}"
         )
-        # Уведомим админов
-        cursor = conn.cursor()
-        cursor.execute("SELECT telegram_id FROM users WHERE role='admin' AND approved=1")
-        admins = cursor.fetchall()
-        for (adm_tg,) in admins:
-            await bot.send_message(
-                adm_tg,
-                f"[AUTO] {from_dep} -> {to_dep}, кол-во={qty}, label={label_date}, trans_id={trans_id}"
-            )
+        # Администраторам — в сводку; с прошедшей датой на этикетке — сразу
+        await catalog.ensure_loaded(adb)
+        dish_name = catalog.names.get(dish_id, (f"блюдо #{dish_id}",))[0]
+        await digest.add(
+            from_dep, to_dep, [(dish_name, qty)],
+            f"[AUTO] {from_dep} -> {to_dep}, {html.escape(dish_name)}, кол-во={qty}, label={label_date}, trans_id={trans_id}",
+            urgent=label_expired(label_date)
+        )
     else:
         await message.answer(
             f"Транзакция #{trans_id} создана. Ожидаем приёмку.\n"
@@ -386,37 +632,74 @@ async def finalize_transfer(message: types.Message, state: FSMContext, label_dat
         )
         # Уведомить получателей (если не Холодильник/Покупатель)
         if to_dep not in ["Холодильник", "Покупатель"]:
-            cursor = conn.cursor()
-            cursor.execute("""
-                SELECT telegram_id FROM users
-                WHERE department=? AND approved=1
-            """, (to_dep,))
-            rows = cursor.fetchall()
-            for (tg_id,) in rows:
-                try:
-                    await bot.send_message(
-                        tg_id,
-                        f"Вам поступил товар из {from_dep} (trans_id={trans_id}). "
-                        "Подтвердите приёмку через /menu -> 'Мои входящие'."
-                    )
-                except:
-                    pass
+            rows = await adb.get_department_telegram_ids(to_dep)
+            for tg_id in rows:
+                notifier.send(
+                    tg_id,
+                    f"Вам поступил товар из {from_dep} (trans_id={trans_id}). "
+                    "Подтвердите приёмку через /menu -> 'Мои входящие'."
+                )
 
     await state.finish()
 
+@dp.message_handler(state=TransferFSM.waiting_for_bulk_lines, content_types=types.ContentTypes.TEXT)
+async def set_bulk_lines(message: types.Message, state: FSMContext):
+    user = await adb.get_user_by_telegram_id(message.from_user.id)
+    if not user:
+        await message.answer("Ошибка пользователя.")
+        await state.finish()
+        return
+    user_id, from_dep = user[0], user[4]
+    to_dep = (await state.get_data())["to_department"]
+    auto = (from_dep, to_dep) in AUTO_ROUTES
+
+    await catalog.ensure_loaded(adb)
+    items, errors = bulk.parse_lines(message.text, catalog, need_label=auto)
+    if errors:
+        # Остаёмся в том же шаге: список можно исправить и отправить заново
+        await message.answer(reports.truncate("Список не принят:\n" + "\n".join(errors)))
+        return
+
+    status = "auto_done" if auto else "pending"
+    # Все позиции — одной партией: один commit и одно уведомление каждому получателю
+    batch_id = await adb.create_batch(user_id, from_dep, to_dep, items, status)
+    total_qty = sum(qty for _, qty, _ in items)
+    summary = f"{from_dep} -> {to_dep}, позиций: {len(items)}, общее кол-во: {total_qty:g}"
+    if auto:
+        await message.answer(f"Партия П{batch_id} передана без подтверждения (auto_done).\n{summary}")
+        await digest.add(
+            from_dep, to_dep, [(catalog.names.get(dish_id, (f"блюдо #{dish_id}",))[0], qty) for dish_id, qty, _ in items],
+            f"[AUTO] Партия П{batch_id}: {summary}",
+            urgent=any(label_expired(label_date) for _, _, label_date in items)
+        )
+    else:
+        await message.answer(f"Партия П{batch_id} создана. Ожидаем приёмку.\n{summary}")
+        if to_dep not in ["Холодильник", "Покупатель"]:
+            for tg_id in await adb.get_department_telegram_ids(to_dep):
+                notifier.send(
+                    tg_id,
+                    f"Вам поступила партия П{batch_id} из {from_dep}, позиций: {len(items)}. "
+                    "Подтвердите приёмку через /menu -> 'Мои входящие'."
+                )
+    await state.finish()
+
 # --- Принятие / Отклонение транзакций ---
 
-@dp.callback_query_handler(Text(startswith=("accept_", "reject_")))
-async def handle_accept_reject(callback_query: types.CallbackQuery):
-    user = db.get_user_by_telegram_id(conn, callback_query.from_user.id)
+@router.route(callbacks.ACCEPT)
+async def handle_accept(callback_query: types.CallbackQuery, state: FSMContext, trans_id_str):
+    await _settle(callback_query, trans_id_str, accept=True)
+
+@router.route(callbacks.REJECT)
+async def handle_reject(callback_query: types.CallbackQuery, state: FSMContext, trans_id_str):
+    await _settle(callback_query, trans_id_str, accept=False)
+
+async def _settle(callback_query: types.CallbackQuery, trans_id_str, accept: bool):
+    user = await adb.get_user_by_telegram_id(callback_query.from_user.id)
     if not user:
         await callback_query.answer("Ошибка пользователя.")
         return
     user_id = user[0]
     department = user[4]
-    data = callback_query.data.split("_", 1)
-    action = data[0]  # "accept" или "reject"
-    trans_id_str = data[1]
 
     try:
         trans_id = int(trans_id_str)
@@ -424,59 +707,235 @@ async def handle_accept_reject(callback_query: types.CallbackQuery):
         await callback_query.answer("Некорректный ID транзакции.")
         return
 
-    # Проверим, действительно ли эта транзакция 'pending' и принадлежит department
-    cursor = conn.cursor()
-    cursor.execute("""
-        SELECT id FROM transactions
-        WHERE id=? AND to_department=? AND status='pending'
-    """, (trans_id, department))
-    row = cursor.fetchone()
-    if not row:
+    # Проверка "ещё pending и адресована нам" и смена статуса — один условный UPDATE;
+    # при одновременном нажатии двумя сотрудниками цеха выигрывает только один
+    if not await adb.settle_transaction(trans_id, department, user_id, accept):
         await callback_query.answer("Транзакция не найдена или уже не в статусе 'pending'.")
         return
 
-    if action == "accept":
-        db.accept_transaction(conn, trans_id)
-        db.log_action(conn, user_id, f"Accepted transaction #{trans_id}")
+    if accept:
         await callback_query.answer("Товар принят!", show_alert=True)
-        await callback_query.message.delete()
     else:
-        db.reject_transaction(conn, trans_id)
-        db.log_action(conn, user_id, f"Rejected transaction #{trans_id}")
         await callback_query.answer("Транзакция отклонена!", show_alert=True)
-        await callback_query.message.delete()
+    await callback_query.message.delete()
+
+@router.route(callbacks.BATCH_ACCEPT)
+async def handle_batch_accept(callback_query: types.CallbackQuery, state: FSMContext, batch_id_str):
+    await _settle_batch(callback_query, batch_id_str, accept=True)
+
+@router.route(callbacks.BATCH_REJECT)
+async def handle_batch_reject(callback_query: types.CallbackQuery, state: FSMContext, batch_id_str):
+    await _settle_batch(callback_query, batch_id_str, accept=False)
+
+async def _settle_batch(callback_query: types.CallbackQuery, batch_id_str, accept: bool):
+    user = await adb.get_user_by_telegram_id(callback_query.from_user.id)
+    if not user:
+        await callback_query.answer("Ошибка пользователя.")
+        return
+    try:
+        batch_id = int(batch_id_str)
+    except ValueError:
+        await callback_query.answer("Некорректный номер партии.")
+        return
+    count = await adb.settle_batch(batch_id, user[4], user[0], accept)
+    if not count:
+        await callback_query.answer("Партия не найдена или уже обработана.")
+        return
+    verb = "принята" if accept else "отклонена"
+    await callback_query.answer(f"Партия П{batch_id} {verb}, позиций: {count}.", show_alert=True)
+    await callback_query.message.delete()
 
 # --- REPORTS ---
 
-@dp.callback_query_handler(Text(startswith="report_"))
-async def handle_reports(callback_query: types.CallbackQuery):
-    data = callback_query.data
-    report_type = data.split("_", 1)[1]  # "today" or "all"
-    now = datetime.datetime.now()
-    if report_type == "today":
-        date_str = now.date().isoformat()
-        rows = db.get_transactions_by_date(conn, date_str)
-        if not rows:
-            await callback_query.message.edit_text("Сегодня транзакций не было.")
-        else:
-            lines = [f"<b>Отчёт за {date_str}:</b>"]
-            for (tid, fdep, tdep, dname, qty, lbl, created, accepted, st) in rows:
-                lines.append(f"#{tid} | {fdep} -> {tdep} | {dname} x {qty} | {st}")
-            await callback_query.message.edit_text("\n".join(lines))
-    elif report_type == "all":
-        rows = db.get_transactions_by_date(conn, None)
-        if not rows:
-            await callback_query.message.edit_text("Транзакций нет.")
-        else:
-            lines = ["<b>Все транзакции:</b>"]
-            for (tid, fdep, tdep, dname, qty, lbl, created, accepted, st) in rows:
-                lines.append(f"#{tid} | {fdep} -> {tdep} | {dname} x {qty} | {st}")
-            await callback_query.message.edit_text("\n".join(lines))
+async def _can_view_reports(callback_query: types.CallbackQuery) -> bool:
+    user = await adb.get_user_by_telegram_id(callback_query.from_user.id)
+    if not user or user[5] == 0 or not user_is_admin_or_leader(user[3]):
+        await callback_query.answer("Нет прав для отчётов.")
+        return False
+    return True
+
+@router.route(callbacks.REPORT)
+async def handle_reports(callback_query: types.CallbackQuery, state: FSMContext, report_type):
+    # Сводка за период читается из суточных агрегатов daily_rollup,
+    # размер ответа и стоимость запроса не зависят от объёма истории.
+    # report_type: "today", "week", "month" или "all"
+    if report_type not in reports.PERIODS:
+        await callback_query.answer("Неизвестный отчёт.")
+        return
+    if not await _can_view_reports(callback_query):
+        return
+    start_day, end_day = reports.period_days(report_type)
+    summary = await adb.reader.get_rollup_summary(start_day, end_day)
+    await callback_query.message.edit_text(
+        reports.render_summary(report_type, summary),
+        reply_markup=reports.summary_markup(report_type)
+    )
+    await callback_query.answer()
 
+@router.route(callbacks.REPORT_DETAIL)
+async def handle_report_details(callback_query: types.CallbackQuery, state: FSMContext, period, direction, cursor):
+    # Подробный список по страницам; курсор (id границы страницы) хранится в callback_data
+    try:
+        before_id, after_id = reports.parse_detail_cursor(period, direction, cursor)
+    except ValueError:
+        await callback_query.answer("Некорректная страница отчёта.")
+        return
+    if not await _can_view_reports(callback_query):
+        return
+    start_ts, end_ts = reports.period_range(period)
+    rows, has_older, has_newer = await get_transactions_page(
+        adb.reader, archive, start_ts, end_ts, before_id=before_id, after_id=after_id,
+        limit=REPORT_PAGE_SIZE, cutoff_ts=db.retention_cutoff_ts()
+    )
+    try:
+        await callback_query.message.edit_text(
+            reports.render_detail(period, rows),
+            reply_markup=reports.detail_markup(period, rows, has_older, has_newer)
+        )
+    except MessageNotModified:
+        pass
     await callback_query.answer()
 
+# --- ВЫГРУЗКА CSV ---
+
+async def send_export(chat_id, start_day=None, end_day=None, department=None):
+    """Выгружает транзакции за дни [start_day, end_day] (включительно) и отправляет файлом."""
+    start_ts = timeutil.day_start_ts(datetime.date.fromisoformat(start_day)) if start_day else None
+    end_ts = timeutil.day_bounds(datetime.date.fromisoformat(end_day))[1] if end_day else None
+    fileobj, total = await export.export_transactions_csv(
+        adb.reader, start_ts, end_ts, department, archive=archive, cutoff_ts=db.retention_cutoff_ts()
+    )
+    try:
+        if total == 0:
+            await bot.send_message(chat_id, "За выбранный период транзакций нет.")
+            return
+        await bot.send_document(
+            chat_id,
+            types.InputFile(fileobj, filename=export.export_filename(start_day, end_day, department)),
+            caption=f"Транзакций: {total}"
+        )
+    finally:
+        fileobj.close()
+
+@dp.message_handler(commands=["export"])
+async def cmd_export(message: types.Message):
+    """/export [с YYYY-MM-DD] [по YYYY-MM-DD] [Цех] — по умолчанию последние 30 дней."""
+    user = await adb.get_user_by_telegram_id(message.from_user.id)
+    if not user or user[5] == 0 or not user_is_admin_or_leader(user[3]):
+        await message.answer("Нет прав для выгрузки.")
+        return
+    args = message.get_args().split()
+    try:
+        today = timeutil.today()
+        start = datetime.date.fromisoformat(args[0]) if len(args) > 0 else today - datetime.timedelta(days=29)
+        end = datetime.date.fromisoformat(args[1]) if len(args) > 1 else today
+    except ValueError:
+        await message.answer("Формат: /export 2025-01-01 2025-01-31 [Цех]")
+        return
+    department = args[2] if len(args) > 2 else None
+    if department and department not in DEPARTMENTS:
+        await message.answer("Неизвестный цех. Доступны: " + ", ".join(DEPARTMENTS))
+        return
+    await message.answer("Готовлю выгрузку…")
+    await send_export(message.chat.id, start.isoformat(), end.isoformat(), department)
+
+@router.route(callbacks.REPORT_EXPORT)
+async def handle_report_export(callback_query: types.CallbackQuery, state: FSMContext, period):
+    if period not in reports.PERIODS:
+        await callback_query.answer("Неизвестный отчёт.")
+        return
+    if not await _can_view_reports(callback_query):
+        return
+    await callback_query.answer("Готовлю выгрузку…")
+    start_day, end_day = reports.period_days(period)
+    if end_day:
+        end_day = (datetime.date.fromisoformat(end_day) - datetime.timedelta(days=1)).isoformat()
+    await send_export(callback_query.message.chat.id, start_day, end_day)
+
+# ---- ПРОВЕРКА "ПОДТВЕРЖДЁН ЛИ ПОЛЬЗОВАТЕЛЬ" ----
+# Хендлер без фильтров ловит всё подряд, а aiogram вызывает первый подходящий
+# хендлер по порядку регистрации, поэтому он регистрируется последним —
+# иначе он перехватывал бы /start, /menu и остальные команды.
+@dp.message_handler()
+async def check_approved(message: types.Message):
+    """
+    Этот хендлер будет проверять, не является ли команда
+    системной (уже отловленной другими хендлерами).
+    Если пользователь не подтверждён и пытается что-то писать —
+    отправляем уведомление. 
+    """
+    # Если команда /start, /admin, /menu и т.п. — их отлавливают другие хендлеры
+    # Но если это что-то "левое", проверим статус подтверждения
+    user = await adb.get_user_by_telegram_id(message.from_user.id)
+    if not user:
+        return  # Пусть идёт регистрация
+    if user[5] == 0:  # approved=0
+        await message.answer("Ваш аккаунт ещё не подтверждён администратором. Ожидайте.")
+    else:
+        # Просто игнорируем, если нет подходящего хендлера
+        pass
+
+
 # --- Запуск ---
 
+async def on_startup(dispatcher: Dispatcher):
+    global metrics_runner
+    adb.start()
+    notifier.start()
+    retention.start()
+    expiry.start()
+    digest.start()
+    if METRICS_PORT:
+        metrics_runner = await metrics.start_server(METRICS_HOST, METRICS_PORT)
+
+async def on_shutdown(dispatcher: Dispatcher):
+    global metrics_runner
+    if metrics_runner is not None:
+        await metrics_runner.cleanup()
+        metrics_runner = None
+    await retention.close()
+    await expiry.close()
+    # Остаток сводки уходит до остановки очереди уведомлений
+    await digest.close()
+    await notifier.close()
+    await adb.close()
+
+def make_webhook_app():
+    """aiohttp-приложение для режима webhook (можно запускать и тестировать отдельно)."""
+    server = WebhookServer(dp, WEBHOOK_PATH, WEBHOOK_SECRET)
+    app = server.make_app()
+    app["webhook_server"] = server
+    app.router.add_get("/metrics", metrics.metrics.handle_metrics)
+    metrics.metrics.add_collector("webhook", server.stats)
+
+    async def app_startup(app):
+        Bot.set_current(bot)
+        Dispatcher.set_current(dp)
+        await on_startup(dp)
+        await server.start()
+        if WEBHOOK_URL:
+            await bot.set_webhook(
+                WEBHOOK_URL.rstrip("/") + WEBHOOK_PATH,
+                secret_token=WEBHOOK_SECRET or None,
+                drop_pending_updates=SKIP_UPDATES
+            )
+
+    async def app_shutdown(app):
+        # Webhook в Telegram не удаляем: апдейты, пришедшие во время перезапуска,
+        # Telegram доставит новому процессу
+        await server.drain()
+        await on_shutdown(dp)
+        await dp.storage.close()
+        await dp.storage.wait_closed()
+        await (await bot.get_session()).close()
+
+    app.on_startup.append(app_startup)
+    app.on_shutdown.append(app_shutdown)
+    return app
+
 if __name__ == "__main__":
-    logging.info("Starting bot...")
-    executor.start_polling(dp, skip_updates=True)
+    logging.info("Starting bot (%s)...", RUN_MODE)
+    if RUN_MODE == "webhook":
+        web.run_app(make_webhook_app(), host=WEBAPP_HOST, port=WEBAPP_PORT)
+    else:
+        executor.start_polling(dp, skip_updates=SKIP_UPDATES, on_startup=on_startup, on_shutdown=on_shutdown)
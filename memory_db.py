@@ -0,0 +1,498 @@
+# memory_db.py
+"""Хранилище в памяти с тем же набором функций, что и database.py (DB_BACKEND=memory).
+
+Таблицы — словари по id, для запросов хендлеров заведены индексы
+(пользователи по telegram_id и цеху, ожидающие передачи по цеху-получателю,
+позиции партий, остатки по цеху), поэтому они не перебирают все строки.
+Отчёты и очистка просматривают транзакции целиком — для тестов и
+нагрузочных прогонов этого достаточно. Данные живут до остановки процесса.
+
+Функции вызываются из одного потока БД (async_db.AsyncDatabase),
+поэтому блокировок нет. Отката нет: функции проверяют всё до первого
+изменения, а unit_of_work оставлен только для совместимости интерфейса.
+"""
+import datetime
+from contextlib import contextmanager
+
+import audit
+import timeutil
+from config import ROLE_ADMIN
+from database import STOCK_EFFECT, RETENTION_TABLES
+
+# Версия справочника блюд для catalog.DishCatalog, как database.dishes_version
+dishes_version = 0
+
+# Колонки строк таблиц — в том же порядке, что и в SQLite (для архива и SELECT *)
+TRANSACTION_COLUMNS = (
+    "id", "from_user_id", "from_department", "to_department", "dish_id", "quantity", "label_date",
+    "created_at", "accepted_at", "status", "created_ts", "accepted_ts", "batch_id", "label_day",
+)
+BATCH_COLUMNS = ("id", "from_user_id", "from_department", "to_department", "items", "created_at", "created_ts")
+LOG_COLUMNS = ("id", "ts", "user_id", "action", "transaction_id", "batch_id", "items", "note")
+
+
+class MemoryStore:
+    """"Соединение" хранилища в памяти: таблицы и индексы."""
+
+    def __init__(self):
+        self.users = {}          # id -> [id, telegram_id, full_name, role, department, approved]
+        self.users_by_tg = {}    # telegram_id -> id
+        self.users_by_department = {}  # цех -> {id, ...}
+        self.dishes = {}         # id -> (id, name, category)
+        self.transactions = {}   # id -> dict с ключами TRANSACTION_COLUMNS
+        self.pending = {}        # цех-получатель -> {id ожидающих передач: None} (в порядке id)
+        self.batch_items = {}    # batch_id -> [id транзакций]
+        self.batches = {}        # id -> dict с ключами BATCH_COLUMNS
+        self.logs = {}           # id -> dict с ключами LOG_COLUMNS
+        self.rollup = {}         # (day, from, to, dish_id, status) -> [count, quantity]
+        self.stock = {}          # цех -> {(dish_id, label_day): quantity}
+        self.stock_baseline = {}  # (цех, dish_id, label_day) -> quantity
+        self.ids = {"users": 0, "dishes": 0, "transactions": 0, "transfer_batches": 0, "logs": 0}
+
+    def next_id(self, table):
+        self.ids[table] += 1
+        return self.ids[table]
+
+    def table(self, name):
+        return {"transactions": self.transactions, "transfer_batches": self.batches, "logs": self.logs}[name]
+
+
+def init_db(db_path=None):
+    """Новое пустое хранилище; db_path не используется."""
+    global dishes_version
+    dishes_version += 1
+    return MemoryStore()
+
+@contextmanager
+def unit_of_work(conn):
+    yield conn
+
+
+# ---- Журнал ----
+
+def log_action(conn, user_id: int, action: int, transaction_id=None, batch_id=None, items=None):
+    log_id = conn.next_id("logs")
+    conn.logs[log_id] = {"id": log_id, "ts": timeutil.now_ts(), "user_id": user_id, "action": action,
+                         "transaction_id": transaction_id, "batch_id": batch_id, "items": items, "note": None}
+
+def flush_logs(conn):
+    return 0
+
+def flush_logs_if_due(conn):
+    return 0
+
+
+# ---- Пользователи ----
+
+def _user_row(conn, user_id):
+    row = conn.users.get(user_id)
+    return tuple(row) if row is not None else None
+
+def get_user_by_telegram_id(conn, telegram_id: int):
+    return _user_row(conn, conn.users_by_tg.get(telegram_id))
+
+load_user_by_telegram_id = get_user_by_telegram_id
+
+def get_user(conn, user_id: int):
+    return _user_row(conn, user_id)
+
+load_user = get_user
+
+def create_user(conn, telegram_id, full_name, role, department, approved=0):
+    if telegram_id in conn.users_by_tg:
+        raise ValueError(f"Пользователь с telegram_id={telegram_id} уже есть")
+    user_id = conn.next_id("users")
+    conn.users[user_id] = [user_id, telegram_id, full_name, role, department, approved]
+    conn.users_by_tg[telegram_id] = user_id
+    conn.users_by_department.setdefault(department, set()).add(user_id)
+
+def approve_user(conn, user_id: int):
+    if user_id in conn.users:
+        conn.users[user_id][5] = 1
+
+def set_user_role(conn, user_id: int, role: str):
+    if user_id in conn.users:
+        conn.users[user_id][3] = role
+
+def get_admin_telegram_ids(conn):
+    return [row[1] for row in conn.users.values() if row[3] == ROLE_ADMIN and row[5] == 1]
+
+def get_department_telegram_ids(conn, department):
+    users = conn.users
+    return [users[uid][1] for uid in sorted(conn.users_by_department.get(department, ())) if users[uid][5] == 1]
+
+def get_all_pending_users(conn):
+    return [(row[0], row[2], row[3], row[4]) for row in conn.users.values() if row[5] == 0]
+
+def is_approved(conn, user_id: int):
+    row = conn.users.get(user_id)
+    return bool(row and row[5] == 1)
+
+def get_role(conn, user_id: int):
+    row = conn.users.get(user_id)
+    return row[3] if row else None
+
+
+# ---- Блюда ----
+
+def add_dish(conn, name: str, category: str):
+    global dishes_version
+    dish_id = conn.next_id("dishes")
+    conn.dishes[dish_id] = (dish_id, name, category)
+    dishes_version += 1
+
+def get_all_dishes(conn):
+    return list(conn.dishes.values())
+
+def _dish_name(conn, dish_id):
+    dish = conn.dishes.get(dish_id)
+    return dish[1] if dish else None
+
+
+# ---- Передачи ----
+
+def _insert_transaction(conn, from_user_id, from_dep, to_dep, dish_id, qty, label_date, status, now, batch_id=None):
+    now_str, now_ts = now.isoformat(), timeutil.to_ts(now)
+    done = status in ("auto_done", "accepted")
+    trans_id = conn.next_id("transactions")
+    t = {
+        "id": trans_id, "from_user_id": from_user_id, "from_department": from_dep, "to_department": to_dep,
+        "dish_id": int(dish_id), "quantity": qty, "label_date": label_date,
+        "created_at": now_str, "accepted_at": now_str if done else None, "status": status,
+        "created_ts": now_ts, "accepted_ts": now_ts if done else None, "batch_id": batch_id,
+        "label_day": timeutil.label_day(label_date),
+    }
+    conn.transactions[trans_id] = t
+    if status == "pending":
+        conn.pending.setdefault(to_dep, {})[trans_id] = None
+    if batch_id is not None:
+        conn.batch_items.setdefault(batch_id, []).append(trans_id)
+    _rollup_add(conn, t, status, 1)
+    _stock_move(conn, t, None, status)
+    return trans_id
+
+def create_transaction(conn, from_user_id, from_dep, to_dep, dish_id, qty, label_date, status):
+    return _insert_transaction(conn, from_user_id, from_dep, to_dep, dish_id, qty, label_date, status, timeutil.now())
+
+def create_transfer(conn, from_user_id, from_dep, to_dep, dish_id, qty, label_date, status):
+    trans_id = create_transaction(conn, from_user_id, from_dep, to_dep, dish_id, qty, label_date, status)
+    log_action(conn, from_user_id, audit.TRANSFER_CREATED, transaction_id=trans_id)
+    return trans_id
+
+def create_batch(conn, from_user_id, from_dep, to_dep, items, status):
+    now = timeutil.now()
+    batch_id = conn.next_id("transfer_batches")
+    conn.batches[batch_id] = {
+        "id": batch_id, "from_user_id": from_user_id, "from_department": from_dep, "to_department": to_dep,
+        "items": len(items), "created_at": now.isoformat(), "created_ts": timeutil.to_ts(now),
+    }
+    for dish_id, qty, label_date in items:
+        _insert_transaction(conn, from_user_id, from_dep, to_dep, dish_id, qty, label_date, status, now, batch_id)
+    log_action(conn, from_user_id, audit.BATCH_CREATED, batch_id=batch_id, items=len(items))
+    return batch_id
+
+def get_pending_transactions_for_department(conn, department):
+    rows = []
+    for trans_id in conn.pending.get(department, ()):
+        t = conn.transactions[trans_id]
+        rows.append((trans_id, _dish_name(conn, t["dish_id"]), t["quantity"], t["from_department"],
+                     t["label_date"], t["batch_id"]))
+    return rows
+
+def _set_status(conn, t, status):
+    old_status = t["status"]
+    if old_status == status:
+        return False
+    if old_status == "pending":
+        conn.pending.get(t["to_department"], {}).pop(t["id"], None)
+    elif status == "pending":
+        conn.pending.setdefault(t["to_department"], {})[t["id"]] = None
+    if status == "accepted":
+        now = timeutil.now()
+        t["accepted_at"], t["accepted_ts"] = now.isoformat(), timeutil.to_ts(now)
+    t["status"] = status
+    _rollup_add(conn, t, old_status, -1)
+    _rollup_add(conn, t, status, 1)
+    _stock_move(conn, t, old_status, status)
+    return True
+
+def accept_transaction(conn, trans_id: int):
+    t = conn.transactions.get(int(trans_id))
+    if t is not None:
+        _set_status(conn, t, "accepted")
+
+def reject_transaction(conn, trans_id: int):
+    t = conn.transactions.get(int(trans_id))
+    if t is not None:
+        _set_status(conn, t, "rejected")
+
+def _settle(conn, ids, accept, user_id=None):
+    status = "accepted" if accept else "rejected"
+    settled = []
+    for trans_id in ids:
+        if _set_status(conn, conn.transactions[trans_id], status):
+            settled.append(trans_id)
+    if user_id is not None:
+        action = audit.TRANSFER_ACCEPTED if accept else audit.TRANSFER_REJECTED
+        for trans_id in settled:
+            log_action(conn, user_id, action, transaction_id=trans_id)
+    return settled
+
+def settle_transaction(conn, trans_id: int, department, user_id: int, accept: bool):
+    trans_id = int(trans_id)
+    if trans_id not in conn.pending.get(department, ()):
+        return False
+    return bool(_settle(conn, [trans_id], accept, user_id))
+
+def settle_pending(conn, department, user_id: int, accept: bool, trans_ids=None, max_id=None):
+    pending = conn.pending.get(department, {})
+    if trans_ids is not None:
+        ids = [int(tid) for tid in trans_ids if int(tid) in pending]
+    else:
+        ids = list(pending)
+    if max_id is not None:
+        ids = [tid for tid in ids if tid <= int(max_id)]
+    return len(_settle(conn, ids, accept, user_id))
+
+def settle_batch(conn, batch_id: int, department, user_id: int, accept: bool):
+    pending = conn.pending.get(department, {})
+    ids = [tid for tid in conn.batch_items.get(int(batch_id), ()) if tid in pending]
+    settled = _settle(conn, ids, accept)
+    if settled:
+        action = audit.BATCH_ACCEPTED if accept else audit.BATCH_REJECTED
+        log_action(conn, user_id, action, batch_id=int(batch_id), items=len(settled))
+    return len(settled)
+
+
+# ---- Суточные агрегаты ----
+
+def _rollup_add(conn, t, status, sign):
+    day = timeutil.local_day(t["created_ts"])
+    if day is None:
+        return
+    key = (day, t["from_department"], t["to_department"], t["dish_id"], status)
+    entry = conn.rollup.setdefault(key, [0, 0])
+    entry[0] += sign
+    entry[1] += sign * (t["quantity"] or 0)
+
+def rebuild_rollup(conn, since_day=None):
+    if since_day is None:
+        if not conn.transactions:
+            return 0
+        since_day = timeutil.local_day(min(t["created_ts"] for t in conn.transactions.values()))
+    conn.rollup = {key: value for key, value in conn.rollup.items() if key[0] < since_day}
+    since_ts = timeutil.day_start_ts(datetime.date.fromisoformat(since_day))
+    before = len(conn.rollup)
+    for t in conn.transactions.values():
+        if t["created_ts"] >= since_ts:
+            _rollup_add(conn, t, t["status"], 1)
+    return len(conn.rollup) - before
+
+def _summary(groups, top_dishes):
+    """groups — {"by_status"|"by_route"|"by_dish": {ключ: [count, qty]}} -> формат get_report_summary."""
+    def rows(group):
+        return [(*(key if isinstance(key, tuple) else (key,)), count, qty)
+                for key, (count, qty) in group.items() if count > 0]
+    by_status = sorted(rows(groups["by_status"]), key=lambda r: -r[-2])
+    by_route = sorted(rows(groups["by_route"]), key=lambda r: -r[-2])
+    dishes = sorted(rows(groups["by_dish"]), key=lambda r: -(r[-1] or 0))
+    return {"by_status": by_status, "by_route": by_route, "by_dish": dishes[:top_dishes], "dish_count": len(dishes)}
+
+def _add_group(groups, status, route, dish, count, qty):
+    for name, key in (("by_status", status), ("by_route", route), ("by_dish", dish)):
+        entry = groups[name].setdefault(key, [0, 0])
+        entry[0] += count
+        entry[1] += qty or 0
+
+def get_rollup_summary(conn, start_day=None, end_day=None, top_dishes=15):
+    groups = {"by_status": {}, "by_route": {}, "by_dish": {}}
+    for (day, from_dep, to_dep, dish_id, status), (count, qty) in conn.rollup.items():
+        if (start_day is None or day >= start_day) and (end_day is None or day < end_day):
+            _add_group(groups, status, (from_dep, to_dep), _dish_name(conn, dish_id), count, qty)
+    return _summary(groups, top_dishes)
+
+def _in_range(t, start_ts, end_ts):
+    ts = t["created_ts"]
+    return (start_ts is None or ts >= start_ts) and (end_ts is None or ts < end_ts)
+
+def get_report_summary(conn, start_ts=None, end_ts=None, top_dishes=15):
+    groups = {"by_status": {}, "by_route": {}, "by_dish": {}}
+    for t in conn.transactions.values():
+        if _in_range(t, start_ts, end_ts):
+            _add_group(groups, t["status"], (t["from_department"], t["to_department"]),
+                       _dish_name(conn, t["dish_id"]), 1, t["quantity"])
+    return _summary(groups, top_dishes)
+
+
+# ---- Списки транзакций ----
+
+def _report_row(conn, t):
+    return (t["id"], t["from_department"], t["to_department"], _dish_name(conn, t["dish_id"]), t["quantity"],
+            t["label_date"], t["created_at"], t["accepted_at"], t["status"])
+
+def get_transactions_by_date(conn, date_str=None):
+    start_ts = end_ts = None
+    if date_str:
+        start_ts, end_ts = timeutil.day_bounds(datetime.date.fromisoformat(date_str))
+    return [_report_row(conn, t) for t in reversed(conn.transactions.values()) if _in_range(t, start_ts, end_ts)]
+
+def get_transactions_page(conn, start_ts=None, end_ts=None, before_id=None, after_id=None, limit=20):
+    if after_id is not None:
+        candidates = (t for t in conn.transactions.values() if t["id"] > after_id)
+    else:
+        candidates = (t for t in reversed(conn.transactions.values()) if before_id is None or t["id"] < before_id)
+    rows = []
+    for t in candidates:
+        if _in_range(t, start_ts, end_ts):
+            rows.append(_report_row(conn, t))
+            if len(rows) > limit:
+                break
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    if after_id is not None:
+        rows.reverse()
+        return rows, True, has_more
+    return rows, has_more, before_id is not None
+
+def get_export_chunk(conn, start_ts=None, end_ts=None, department=None, after_id=0, limit=1000):
+    rows = []
+    for t in conn.transactions.values():
+        if t["id"] <= after_id or not _in_range(t, start_ts, end_ts):
+            continue
+        if department and department not in (t["from_department"], t["to_department"]):
+            continue
+        dish = conn.dishes.get(t["dish_id"])
+        user = conn.users.get(t["from_user_id"])
+        rows.append((t["id"], t["created_at"], t["from_department"], t["to_department"],
+                     dish[1] if dish else None, dish[2] if dish else None, t["quantity"], t["label_date"],
+                     t["status"], t["accepted_at"], user[2] if user else None))
+        if len(rows) >= limit:
+            break
+    return rows
+
+
+# ---- Журнал действий ----
+
+def get_audit_page(conn, user_id=None, transaction_id=None, action=None, before=None, limit=20):
+    if user_id is not None:
+        match = lambda row: row["user_id"] == user_id
+    elif transaction_id is not None:
+        t = conn.transactions.get(transaction_id)
+        batch_id = t["batch_id"] if t is not None else None
+        match = lambda row: row["transaction_id"] == transaction_id or (
+            batch_id is not None and row["batch_id"] == batch_id)
+    elif action is not None:
+        match = lambda row: row["action"] == action
+    else:
+        raise ValueError("Нужен фильтр: user_id, transaction_id или action")
+    found = sorted(
+        (row for row in conn.logs.values() if match(row) and (before is None or (row["ts"], row["id"]) < tuple(before))),
+        key=lambda row: (row["ts"], row["id"]), reverse=True
+    )[:limit + 1]
+    rows = []
+    for row in found[:limit]:
+        user = conn.users.get(row["user_id"])
+        rows.append((row["id"], row["ts"], row["user_id"], user[2] if user else None, row["action"],
+                     row["transaction_id"], row["batch_id"], row["items"], row["note"]))
+    return rows, len(found) > limit
+
+
+# ---- Остатки ----
+
+def _effects(t):
+    """[(цех, dish_id, label_day), кол-во] — вклад передачи в остатки по database.STOCK_EFFECT."""
+    sender, receiver = STOCK_EFFECT.get(t["status"], (0, 0))
+    qty = t["quantity"] or 0
+    label = t["label_day"] or ""
+    return [((t["from_department"], t["dish_id"], label), sender * qty),
+            ((t["to_department"], t["dish_id"], label), receiver * qty)]
+
+def _stock_move(conn, t, old_status, new_status):
+    old = STOCK_EFFECT.get(old_status, (0, 0))
+    new = STOCK_EFFECT.get(new_status, (0, 0))
+    qty = t["quantity"] or 0
+    label = t["label_day"] or ""
+    for department, sign in ((t["from_department"], new[0] - old[0]), (t["to_department"], new[1] - old[1])):
+        if sign and qty:
+            balances = conn.stock.setdefault(department, {})
+            key = (t["dish_id"], label)
+            balances[key] = balances.get(key, 0) + sign * qty
+
+def _expected_stock(conn):
+    expected = dict(conn.stock_baseline)
+    for t in conn.transactions.values():
+        for key, qty in _effects(t):
+            expected[key] = expected.get(key, 0) + qty
+    return expected
+
+def check_stock(conn, limit=20):
+    stored = {(dep, dish_id, label): qty
+              for dep, balances in conn.stock.items() for (dish_id, label), qty in balances.items()}
+    expected = _expected_stock(conn)
+    rows = [(*key, stored.get(key, 0), expected.get(key, 0)) for key in sorted(set(stored) | set(expected))
+            if abs(stored.get(key, 0) - expected.get(key, 0)) > 1e-6]
+    return len(rows), rows[:limit]
+
+def rebuild_stock(conn):
+    conn.stock = {}
+    expected = _expected_stock(conn)
+    for (dep, dish_id, label), qty in expected.items():
+        conn.stock.setdefault(dep, {})[(dish_id, label)] = qty
+    return len(expected)
+
+def get_stock(conn, department):
+    rows = [(_dish_name(conn, dish_id), label, qty)
+            for (dish_id, label), qty in conn.stock.get(department, {}).items() if qty > 1e-6]
+    return sorted(rows, key=lambda r: (r[0] or "", r[1]))
+
+def get_expiring_stock(conn, department, until_day: str):
+    rows = [(_dish_name(conn, dish_id), label, qty)
+            for (dish_id, label), qty in conn.stock.get(department, {}).items()
+            if label and label <= until_day and qty > 1e-6]
+    return sorted(rows, key=lambda r: (r[1], r[0] or ""))
+
+
+# ---- Очистка старых данных ----
+
+def _expired(conn, table, cutoff_ts, from_id=None, to_id=None):
+    ts_column = RETENTION_TABLES[table]
+    return [row for row in conn.table(table).values()
+            if row[ts_column] is not None and row[ts_column] < cutoff_ts
+            and (from_id is None or from_id <= row["id"] <= to_id)]
+
+def get_expired_id_range(conn, table: str, cutoff_ts: int):
+    ids = [row["id"] for row in _expired(conn, table, cutoff_ts)]
+    return (min(ids), max(ids)) if ids else (None, None)
+
+def delete_expired_batch(conn, table: str, cutoff_ts: int, from_id: int, to_id: int):
+    rows = _expired(conn, table, cutoff_ts, from_id, to_id)
+    for row in rows:
+        del conn.table(table)[row["id"]]
+        if table == "transactions":
+            for key, qty in _effects(row):
+                conn.stock_baseline[key] = conn.stock_baseline.get(key, 0) + qty
+            conn.pending.get(row["to_department"], {}).pop(row["id"], None)
+            if row["batch_id"] is not None:
+                conn.batch_items.get(row["batch_id"], []).remove(row["id"])
+    return len(rows)
+
+def archive_expired_batch(conn, archive, table: str, cutoff_ts: int, from_id: int, to_id: int):
+    rows = _expired(conn, table, cutoff_ts, from_id, to_id)
+    if not rows:
+        return 0
+    if table == "transactions":
+        columns = list(TRANSACTION_COLUMNS) + ["dish_name", "dish_category", "from_user_name"]
+        values = []
+        for t in rows:
+            dish = conn.dishes.get(t["dish_id"])
+            user = conn.users.get(t["from_user_id"])
+            values.append(tuple(t[c] for c in TRANSACTION_COLUMNS) + (
+                dish[1] if dish else None, dish[2] if dish else None, user[2] if user else None))
+    else:
+        columns = list(BATCH_COLUMNS if table == "transfer_batches" else LOG_COLUMNS)
+        values = [tuple(row[c] for c in columns) for row in rows]
+    archive.write(table, columns, values)
+    return delete_expired_batch(conn, table, cutoff_ts, from_id, to_id)
+
+def compact_database(conn, max_pages=2000):
+    pass
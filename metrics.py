@@ -0,0 +1,268 @@
+# metrics.py
+import bisect
+import contextvars
+import threading
+import time
+
+from aiohttp import web
+from aiogram import types
+from aiogram.dispatcher.handler import current_handler
+from aiogram.dispatcher.middlewares import BaseMiddleware
+
+# Границы корзин гистограмм задержек, секунды
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+
+class Histogram:
+    """Гистограмма с фиксированными корзинами, как histogram в Prometheus."""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # последняя корзина — +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q):
+        """Оценка квантиля по корзинам (верхняя граница корзины)."""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            seen += n
+            if seen >= rank:
+                return self.buckets[i] if i < len(self.buckets) else float("inf")
+        return float("inf")
+
+
+class RateMeter:
+    """Число событий за последние window секунд (кольцо посекундных счётчиков)."""
+
+    def __init__(self, window=60):
+        self.window = window
+        self.slots = [0] * window
+        self.seconds = [0] * window
+
+    def mark(self, now=None):
+        second = int(now if now is not None else time.time())
+        i = second % self.window
+        if self.seconds[i] != second:
+            self.seconds[i] = second
+            self.slots[i] = 0
+        self.slots[i] += 1
+
+    def per_second(self, now=None):
+        second = int(now if now is not None else time.time())
+        total = sum(n for n, s in zip(self.slots, self.seconds) if second - s < self.window)
+        return total / self.window
+
+
+class Registry:
+    """Счётчики и гистограммы процесса.
+
+    Пишут в реестр и event loop, и поток БД, поэтому изменения идут под
+    одной блокировкой — это дешевле, чем время самих хендлеров и запросов.
+    Метрики других компонентов (кэш, уведомления, webhook) подключаются
+    через add_collector и читаются только при выдаче.
+    """
+
+    def __init__(self):
+        self.started = time.time()
+        self.counters = {}    # (name, labels) -> число
+        self.histograms = {}  # (name, labels) -> Histogram
+        self.updates = RateMeter()
+        self._collectors = {}
+        self._lock = threading.Lock()
+
+    def inc(self, name, labels=(), value=1):
+        key = (name, labels)
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, value, labels=()):
+        key = (name, labels)
+        with self._lock:
+            hist = self.histograms.get(key)
+            if hist is None:
+                hist = self.histograms[key] = Histogram()
+            hist.observe(value)
+
+    def mark_update(self, kind):
+        with self._lock:
+            self.updates.mark()
+        self.inc("bot_updates_total", (("type", kind),))
+
+    def add_collector(self, name, func):
+        """func() -> dict значений, выдаются как gauge {name}_{ключ}."""
+        self._collectors[name] = func
+
+    def collected(self):
+        result = {}
+        for name, func in self._collectors.items():
+            try:
+                values = func()
+            except Exception:
+                continue
+            for key, value in values.items():
+                if isinstance(value, (bool, int, float)):
+                    result[f"{name}_{key}"] = float(value)
+        return result
+
+    def snapshot(self):
+        """Копия счётчиков и гистограмм, чтобы выдавать их без блокировки."""
+        with self._lock:
+            counters = dict(self.counters)
+            histograms = {}
+            for key, h in self.histograms.items():
+                copy = Histogram(h.buckets)
+                copy.counts, copy.sum, copy.count = list(h.counts), h.sum, h.count
+                histograms[key] = copy
+            rate = self.updates.per_second()
+        return counters, histograms, rate
+
+    # ---- выдача ----
+
+    def render_prometheus(self):
+        counters, histograms, rate = self.snapshot()
+        lines = []
+        typed = set()
+
+        def declare(name, kind):
+            if name not in typed:
+                typed.add(name)
+                lines.append(f"# TYPE {name} {kind}")
+
+        for (name, labels), value in sorted(counters.items()):
+            declare(name, "counter")
+            lines.append(f"{name}{_labels(labels)} {value}")
+        for (name, labels), hist in sorted(histograms.items()):
+            declare(name, "histogram")
+            seen = 0
+            for bound, n in zip(hist.buckets + (float("inf"),), hist.counts):
+                seen += n
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(f"{name}_bucket{_labels(labels + (('le', le),))} {seen}")
+            lines.append(f"{name}_sum{_labels(labels)} {hist.sum}")
+            lines.append(f"{name}_count{_labels(labels)} {hist.count}")
+        gauges = dict(self.collected(), bot_updates_per_second=rate,
+                      process_uptime_seconds=time.time() - self.started)
+        for name, value in sorted(gauges.items()):
+            declare(name, "gauge")
+            lines.append(f"{name} {value}")
+        return "\n".join(lines) + "\n"
+
+    def render_text(self, top=10):
+        """Короткая сводка для команды /stats."""
+        counters, histograms, rate = self.snapshot()
+        uptime = time.time() - self.started
+        updates = sum(v for (n, _), v in counters.items() if n == "bot_updates_total")
+        errors = sum(v for (n, _), v in counters.items() if n == "bot_handler_errors_total")
+        lines = [
+            f"<b>Статистика</b> (работает {uptime / 3600:.1f} ч)",
+            f"Апдейтов: {updates:.0f}, сейчас {rate:.2f}/с, ошибок: {errors:.0f}",
+            f"Commit в БД: {counters.get(('db_commits_total', ()), 0):.0f}",
+        ]
+        for title, metric in (("Хендлеры", "bot_handler_seconds"), ("Запросы к БД", "db_query_seconds")):
+            rows = sorted(
+                ((dict(labels).get("handler") or dict(labels).get("query"), h)
+                 for (name, labels), h in histograms.items() if name == metric),
+                key=lambda item: -item[1].sum
+            )[:top]
+            if not rows:
+                continue
+            lines.append(f"\n<b>{title}</b> (n, ср., p95, мс):")
+            for label, h in rows:
+                lines.append(f"{label}: {h.count}, {h.sum / h.count * 1000:.1f}, ≤{h.quantile(0.95) * 1000:g}")
+        collected = self.collected()
+        if collected:
+            lines.append("")
+            lines += [f"{name}: {value:g}" for name, value in sorted(collected.items())]
+        return "\n".join(lines)
+
+    async def handle_metrics(self, request: web.Request):
+        return web.Response(text=self.render_prometheus(), content_type="text/plain", charset="utf-8")
+
+
+def _labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in labels) + "}"
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+metrics = Registry()
+
+# Хендлер, который сейчас обрабатывает апдейт (для счётчика ошибок)
+_handler_name = contextvars.ContextVar("metrics_handler", default=None)
+
+
+def set_handler(name):
+    """Уточняет имя хендлера текущего апдейта (например, маршрут из таблицы callbacks)."""
+    _handler_name.set(name)
+
+
+class MetricsMiddleware(BaseMiddleware):
+    """Время обработки апдейтов по хендлерам, число ошибок и поток апдейтов.
+
+    Время хендлера считается от прохождения фильтров до выхода из него,
+    имя берётся из функции хендлера. Апдейты, не попавшие ни в один
+    хендлер, учитываются как "unhandled".
+    """
+
+    def __init__(self, registry=metrics):
+        super().__init__()
+        self.registry = registry
+
+    async def on_pre_process_update(self, update: types.Update, data: dict):
+        _handler_name.set(None)
+        data["_metrics_started"] = time.perf_counter()
+
+    async def on_post_process_update(self, update: types.Update, results, data: dict):
+        kind = next((name for name in ("message", "callback_query") if getattr(update, name)), "other")
+        self.registry.mark_update(kind)
+        self.registry.observe("bot_update_seconds", time.perf_counter() - data["_metrics_started"])
+        if _handler_name.get() is None:
+            self.registry.inc("bot_unhandled_updates_total")
+
+    async def _start(self, data):
+        handler = current_handler.get()
+        set_handler(getattr(handler, "__name__", "unknown"))
+        data["_metrics_handler_started"] = time.perf_counter()
+
+    async def _finish(self, data):
+        started = data.pop("_metrics_handler_started", None)
+        if started is not None:
+            self.registry.observe("bot_handler_seconds", time.perf_counter() - started,
+                                  (("handler", _handler_name.get()),))
+
+    async def on_process_message(self, message, data):
+        await self._start(data)
+
+    async def on_post_process_message(self, message, results, data):
+        await self._finish(data)
+
+    async def on_process_callback_query(self, callback_query, data):
+        await self._start(data)
+
+    async def on_post_process_callback_query(self, callback_query, results, data):
+        await self._finish(data)
+
+    async def on_pre_process_error(self, update, error, data):
+        self.registry.inc("bot_handler_errors_total", (("handler", _handler_name.get() or "unknown"),))
+
+
+async def start_server(host, port, registry=metrics):
+    """Отдельный HTTP-сервер с /metrics (для режима polling)."""
+    app = web.Application()
+    app.router.add_get("/metrics", registry.handle_metrics)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
@@ -0,0 +1,284 @@
+# migrations.py
+import logging
+
+import audit
+from timeutil import parse_iso_ts
+
+logger = logging.getLogger(__name__)
+
+BACKFILL_BATCH = 1000
+
+
+def _parse_ts(value):
+    """parse_iso_ts для старых данных: неразборчивая строка -> None, а не ошибка миграции."""
+    try:
+        return parse_iso_ts(value)
+    except (TypeError, ValueError):
+        logger.warning("Неразборчивая метка времени %r оставлена пустой", value)
+        return None
+
+def _backfill_ts(table, columns):
+    """Шаг миграции: заполняет числовые *_ts колонки из ISO-строк пачками по id."""
+    src_cols = ", ".join(src for src, _ in columns)
+    set_clause = ", ".join(f"{dst}=?" for _, dst in columns)
+
+    def step(conn):
+        last_id = 0
+        while True:
+            rows = conn.execute(
+                f"SELECT id, {src_cols} FROM {table} WHERE id > ? ORDER BY id LIMIT ?",
+                (last_id, BACKFILL_BATCH)
+            ).fetchall()
+            if not rows:
+                break
+            conn.executemany(
+                f"UPDATE {table} SET {set_clause} WHERE id=?",
+                [tuple(_parse_ts(v) for v in row[1:]) + (row[0],) for row in rows]
+            )
+            last_id = rows[-1][0]
+    return step
+
+def _legacy_ts(ts, timestamp):
+    if ts is not None:
+        return ts
+    return _parse_ts(timestamp) or 0
+
+def _structured_logs(conn):
+    """Шаг миграции 8: переносит строки logs в logs_v8, разбирая текст действия (audit.parse_legacy)."""
+    last_id = 0
+    while True:
+        rows = conn.execute(
+            "SELECT id, user_id, action, timestamp, ts FROM logs WHERE id > ? ORDER BY id LIMIT ?",
+            (last_id, BACKFILL_BATCH)
+        ).fetchall()
+        if not rows:
+            break
+        conn.executemany(
+            "INSERT INTO logs_v8 (id, ts, user_id, action, transaction_id, batch_id, items, note)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            [(log_id, _legacy_ts(ts, timestamp), user_id)
+             + audit.parse_legacy(action)
+             for log_id, user_id, action, timestamp, ts in rows]
+        )
+        last_id = rows[-1][0]
+
+
+# Версионированные миграции схемы.
+# Текущая версия хранится в PRAGMA user_version файла БД.
+# Каждая миграция — (версия, описание, шаги); шаг — это SQL-строка
+# или функция fn(conn) для переносов данных, которые нельзя выразить одним запросом.
+# Миграции только добавляются в конец списка, уже выпущенные не меняются.
+MIGRATIONS = [
+    (1, "Индексы transactions для входящих и отчётов по дате", [
+        """
+        CREATE INDEX IF NOT EXISTS idx_transactions_to_dep_status
+        ON transactions (to_department, status)
+        """,
+        """
+        CREATE INDEX IF NOT EXISTS idx_transactions_created_at
+        ON transactions (created_at)
+        """,
+    ]),
+    (2, "Индексы users для поиска получателей уведомлений", [
+        """
+        CREATE INDEX IF NOT EXISTS idx_users_department_approved
+        ON users (department, approved)
+        """,
+        """
+        CREATE INDEX IF NOT EXISTS idx_users_role_approved
+        ON users (role, approved)
+        """,
+    ]),
+    (3, "Числовые метки времени (секунды Unix) в transactions и logs", [
+        "ALTER TABLE transactions ADD COLUMN created_ts INTEGER",
+        "ALTER TABLE transactions ADD COLUMN accepted_ts INTEGER",
+        "ALTER TABLE logs ADD COLUMN ts INTEGER",
+        _backfill_ts("transactions", [("created_at", "created_ts"), ("accepted_at", "accepted_ts")]),
+        _backfill_ts("logs", [("timestamp", "ts")]),
+        "DROP INDEX IF EXISTS idx_transactions_created_at",
+        "CREATE INDEX IF NOT EXISTS idx_transactions_created_ts ON transactions (created_ts)",
+        "CREATE INDEX IF NOT EXISTS idx_logs_ts ON logs (ts)",
+    ]),
+    (4, "Суточные агрегаты передач daily_rollup", [
+        """
+        CREATE TABLE IF NOT EXISTS daily_rollup (
+            day TEXT NOT NULL,             -- локальная дата производства 'YYYY-MM-DD'
+            from_department TEXT NOT NULL,
+            to_department TEXT NOT NULL,
+            dish_id INTEGER NOT NULL,
+            status TEXT NOT NULL,
+            count INTEGER NOT NULL DEFAULT 0,
+            quantity REAL NOT NULL DEFAULT 0,
+            PRIMARY KEY (day, from_department, to_department, dish_id, status)
+        ) WITHOUT ROWID
+        """,
+        # local_day() регистрируется в database.init_db
+        """
+        INSERT INTO daily_rollup (day, from_department, to_department, dish_id, status, count, quantity)
+        SELECT local_day(created_ts), from_department, to_department, dish_id, status,
+               COUNT(*), COALESCE(SUM(quantity), 0)
+        FROM transactions
+        WHERE created_ts IS NOT NULL
+        GROUP BY 1, 2, 3, 4, 5
+        """,
+    ]),
+    (5, "Партии передач transfer_batches и transactions.batch_id", [
+        """
+        CREATE TABLE IF NOT EXISTS transfer_batches (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            from_user_id INTEGER,
+            from_department TEXT,
+            to_department TEXT,
+            items INTEGER NOT NULL,        -- число позиций (строк transactions) в партии
+            created_at TEXT,
+            created_ts INTEGER,
+            FOREIGN KEY (from_user_id) REFERENCES users (id)
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_transfer_batches_created_ts ON transfer_batches (created_ts)",
+        "ALTER TABLE transactions ADD COLUMN batch_id INTEGER REFERENCES transfer_batches (id)",
+        "CREATE INDEX IF NOT EXISTS idx_transactions_batch ON transactions (batch_id) WHERE batch_id IS NOT NULL",
+    ]),
+    (6, "Остатки по цехам stock_balances и база для удалённой истории stock_baseline", [
+        """
+        CREATE TABLE IF NOT EXISTS stock_balances (
+            department TEXT NOT NULL,
+            dish_id INTEGER NOT NULL,
+            label_date TEXT NOT NULL DEFAULT '',   -- '' — без даты на этикетке
+            quantity REAL NOT NULL DEFAULT 0,
+            PRIMARY KEY (department, dish_id, label_date)
+        ) WITHOUT ROWID
+        """,
+        # Вклад в остатки транзакций, уже удалённых очисткой (см. database.delete_expired_batch)
+        """
+        CREATE TABLE IF NOT EXISTS stock_baseline (
+            department TEXT NOT NULL,
+            dish_id INTEGER NOT NULL,
+            label_date TEXT NOT NULL DEFAULT '',
+            quantity REAL NOT NULL DEFAULT 0,
+            PRIMARY KEY (department, dish_id, label_date)
+        ) WITHOUT ROWID
+        """,
+        # Начальные остатки по существующим transactions (правила — database.STOCK_EFFECT):
+        # отправленное списано у отправителя, кроме отклонённого; принятое зачислено получателю
+        """
+        INSERT INTO stock_balances (department, dish_id, label_date, quantity)
+        SELECT department, dish_id, label_date, SUM(quantity) FROM (
+            SELECT from_department AS department, dish_id, COALESCE(label_date, '') AS label_date,
+                   -COALESCE(quantity, 0) AS quantity
+            FROM transactions WHERE status IN ('pending', 'accepted', 'auto_done')
+            UNION ALL
+            SELECT to_department, dish_id, COALESCE(label_date, ''), COALESCE(quantity, 0)
+            FROM transactions WHERE status IN ('accepted', 'auto_done')
+        )
+        GROUP BY 1, 2, 3
+        """,
+    ]),
+    (7, "Дата этикетки как дата: transactions.label_day, остатки и сроки по ней", [
+        "ALTER TABLE transactions ADD COLUMN label_day TEXT",
+        # parse_label_day() регистрируется в database.init_db; неразборчивые даты остаются NULL
+        "UPDATE transactions SET label_day = parse_label_day(label_date) WHERE label_date IS NOT NULL",
+        """
+        CREATE INDEX IF NOT EXISTS idx_transactions_label_day
+        ON transactions (to_department, label_day) WHERE label_day IS NOT NULL
+        """,
+        # Остатки — по нормализованной дате: '20.01.25' и '20.01.2025' — одна строка
+        "ALTER TABLE stock_baseline RENAME TO stock_baseline_v6",
+        """
+        CREATE TABLE stock_baseline (
+            department TEXT NOT NULL,
+            dish_id INTEGER NOT NULL,
+            label_day TEXT NOT NULL DEFAULT '',
+            quantity REAL NOT NULL DEFAULT 0,
+            PRIMARY KEY (department, dish_id, label_day)
+        ) WITHOUT ROWID
+        """,
+        """
+        INSERT INTO stock_baseline (department, dish_id, label_day, quantity)
+        SELECT department, dish_id, COALESCE(parse_label_day(label_date), ''), SUM(quantity)
+        FROM stock_baseline_v6
+        GROUP BY 1, 2, 3
+        """,
+        "DROP TABLE stock_baseline_v6",
+        "DROP TABLE stock_balances",
+        """
+        CREATE TABLE stock_balances (
+            department TEXT NOT NULL,
+            dish_id INTEGER NOT NULL,
+            label_day TEXT NOT NULL DEFAULT '',    -- 'YYYY-MM-DD' или '' — без даты
+            quantity REAL NOT NULL DEFAULT 0,
+            PRIMARY KEY (department, dish_id, label_day)
+        ) WITHOUT ROWID
+        """,
+        """
+        INSERT INTO stock_balances (department, dish_id, label_day, quantity)
+        SELECT department, dish_id, label_day, SUM(quantity) FROM (
+            SELECT department, dish_id, label_day, quantity FROM stock_baseline
+            UNION ALL
+            SELECT from_department, dish_id, COALESCE(label_day, ''), -COALESCE(quantity, 0)
+            FROM transactions WHERE status IN ('pending', 'accepted', 'auto_done')
+            UNION ALL
+            SELECT to_department, dish_id, COALESCE(label_day, ''), COALESCE(quantity, 0)
+            FROM transactions WHERE status IN ('accepted', 'auto_done')
+        )
+        GROUP BY 1, 2, 3
+        """,
+        # Поиск подходящих к сроку остатков цеха — диапазон по дате
+        "CREATE INDEX IF NOT EXISTS idx_stock_balances_label_day ON stock_balances (department, label_day)",
+    ]),
+    (8, "Структурированный журнал: коды действий audit.*, ссылки на передачу и партию", [
+        """
+        CREATE TABLE logs_v8 (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            ts INTEGER NOT NULL,                    -- секунды Unix
+            user_id INTEGER REFERENCES users (id),
+            action INTEGER NOT NULL,                -- код audit.*
+            transaction_id INTEGER REFERENCES transactions (id),
+            batch_id INTEGER REFERENCES transfer_batches (id),
+            items INTEGER,                          -- число позиций для действий с партией
+            note TEXT                               -- только у старых строк, которые не удалось разобрать
+        )
+        """,
+        _structured_logs,
+        "DROP TABLE logs",
+        "ALTER TABLE logs_v8 RENAME TO logs",
+        # История пользователя и действия — диапазон по времени внутри индекса
+        "CREATE INDEX idx_logs_user_ts ON logs (user_id, ts)",
+        "CREATE INDEX idx_logs_action_ts ON logs (action, ts)",
+        "CREATE INDEX idx_logs_transaction ON logs (transaction_id) WHERE transaction_id IS NOT NULL",
+        "CREATE INDEX idx_logs_batch ON logs (batch_id) WHERE batch_id IS NOT NULL",
+        # Срез по времени для retention
+        "CREATE INDEX idx_logs_ts ON logs (ts)",
+    ]),
+]
+
+
+def get_schema_version(conn) -> int:
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate(conn):
+    """Применяет по порядку все миграции новее текущей версии схемы.
+
+    Каждая миграция выполняется в своей транзакции вместе с обновлением
+    user_version, поэтому при ошибке файл остаётся на предыдущей версии.
+    """
+    current = get_schema_version(conn)
+    for version, description, steps in MIGRATIONS:
+        if version <= current:
+            continue
+        logger.info("Применяю миграцию %s: %s", version, description)
+        conn.execute("BEGIN")
+        try:
+            for step in steps:
+                if callable(step):
+                    step(conn)
+                else:
+                    conn.execute(step)
+            conn.execute(f"PRAGMA user_version = {int(version)}")
+        except Exception:
+            conn.rollback()
+            raise
+        conn.commit()
+        current = version
+    return current
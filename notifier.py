@@ -0,0 +1,161 @@
+# notifier.py
+import asyncio
+import logging
+import time
+
+from aiogram.utils.exceptions import (
+    BotBlocked, CantInitiateConversation, ChatNotFound, NetworkError, RetryAfter,
+    TelegramAPIError, UserDeactivated
+)
+
+from config import (
+    NOTIFY_WORKERS, NOTIFY_QUEUE_SIZE, NOTIFY_GLOBAL_RATE, NOTIFY_PER_CHAT_RATE,
+    NOTIFY_MAX_RETRIES
+)
+
+logger = logging.getLogger(__name__)
+
+# Ошибки, при которых повторять отправку бессмысленно
+PERMANENT_ERRORS = (BotBlocked, ChatNotFound, UserDeactivated, CantInitiateConversation)
+
+
+class TokenBucket:
+    """Ведро токенов: не больше rate событий в секунду с пиками до capacity."""
+
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def _delay(self) -> float:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    async def acquire(self):
+        delay = self._delay()
+        while delay > 0:
+            await asyncio.sleep(delay)
+            delay = self._delay()
+
+    def idle(self) -> bool:
+        """Ведро полное — его можно выбросить и создать заново при следующем сообщении."""
+        now = time.monotonic()
+        return self.tokens + (now - self.updated) * self.rate >= self.capacity
+
+
+class Notifier:
+    """Фоновая очередь уведомлений.
+
+    Хендлер вызывает send() и сразу отвечает пользователю, а сообщения
+    отправляют несколько воркеров с общим ограничением скорости и
+    ограничением на каждый чат (лимиты Telegram: ~30 сообщений/сек всего,
+    ~1 сообщение/сек в один чат). RetryAfter соблюдается, сетевые ошибки
+    повторяются с экспоненциальной задержкой, остальные отказы API не повторяются.
+    """
+
+    def __init__(self, bot, workers=NOTIFY_WORKERS, queue_size=NOTIFY_QUEUE_SIZE,
+                 global_rate=NOTIFY_GLOBAL_RATE, per_chat_rate=NOTIFY_PER_CHAT_RATE,
+                 max_retries=NOTIFY_MAX_RETRIES):
+        self.bot = bot
+        self.workers = workers
+        self.queue_size = queue_size
+        self.per_chat_rate = per_chat_rate
+        self.max_retries = max_retries
+        self.global_bucket = TokenBucket(global_rate)
+        self.chat_buckets = {}
+        self.counters = {"queued": 0, "delivered": 0, "failed": 0, "retried": 0, "dropped": 0}
+        self._queue = None
+        self._tasks = []
+
+    def start(self):
+        if self._tasks:
+            return
+        self._queue = asyncio.Queue(self.queue_size)
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def close(self, timeout: float = 10.0):
+        """Даёт очереди догрузиться (не дольше timeout секунд) и останавливает воркеров."""
+        if not self._tasks:
+            return
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning("Notifier: не отправлено %s уведомлений при остановке", self._queue.qsize())
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def send(self, chat_id, text: str, **kwargs) -> bool:
+        """Ставит сообщение в очередь. Не ждёт отправки; False, если очередь переполнена."""
+        if not self._tasks:
+            self.start()
+        try:
+            self._queue.put_nowait((chat_id, text, kwargs))
+        except asyncio.QueueFull:
+            self.counters["dropped"] += 1
+            logger.warning("Notifier: очередь переполнена, уведомление для %s отброшено", chat_id)
+            return False
+        self.counters["queued"] += 1
+        return True
+
+    def stats(self):
+        return dict(self.counters, pending=self._queue.qsize() if self._queue else 0)
+
+    async def _worker(self):
+        while True:
+            chat_id, text, kwargs = await self._queue.get()
+            try:
+                await self._deliver(chat_id, text, kwargs)
+            except Exception:
+                self.counters["failed"] += 1
+                logger.exception("Notifier: ошибка отправки в %s", chat_id)
+            finally:
+                self._queue.task_done()
+
+    def _chat_bucket(self, chat_id):
+        bucket = self.chat_buckets.get(chat_id)
+        if bucket is None:
+            if len(self.chat_buckets) > 10000:
+                self.chat_buckets = {k: b for k, b in self.chat_buckets.items() if not b.idle()}
+            bucket = self.chat_buckets[chat_id] = TokenBucket(self.per_chat_rate, 1)
+        return bucket
+
+    async def _deliver(self, chat_id, text, kwargs):
+        attempt = 0
+        while True:
+            await self._chat_bucket(chat_id).acquire()
+            await self.global_bucket.acquire()
+            try:
+                await self.bot.send_message(chat_id, text, **kwargs)
+            except RetryAfter as e:
+                # Флуд-контроль: ждём столько, сколько попросил Telegram
+                self.counters["retried"] += 1
+                await asyncio.sleep(e.timeout)
+                continue
+            except PERMANENT_ERRORS as e:
+                self.counters["failed"] += 1
+                logger.info("Notifier: %s недоступен: %s", chat_id, e)
+                return
+            except (NetworkError, asyncio.TimeoutError, OSError) as e:
+                attempt += 1
+                if attempt > self.max_retries:
+                    self.counters["failed"] += 1
+                    logger.warning("Notifier: не удалось отправить в %s: %s", chat_id, e)
+                    return
+                self.counters["retried"] += 1
+                await asyncio.sleep(min(30.0, 0.5 * 2 ** attempt))
+                continue
+            except TelegramAPIError as e:
+                # BadRequest и прочие отказы API: повтор вернёт ту же ошибку
+                self.counters["failed"] += 1
+                logger.warning("Notifier: Telegram отклонил сообщение в %s: %s", chat_id, e)
+                return
+            self.counters["delivered"] += 1
+            return
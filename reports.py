@@ -0,0 +1,206 @@
+# reports.py
+import datetime
+import html
+
+from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup
+
+import audit
+import callbacks
+import timeutil
+
+# Лимит длины текста сообщения Telegram
+MESSAGE_LIMIT = 4096
+
+# Период отчёта -> (название, число дней назад, включая сегодня; None — вся история)
+PERIODS = {
+    "today": ("Сегодня", 1),
+    "week": ("7 дней", 7),
+    "month": ("30 дней", 30),
+    "all": ("Всё время", None),
+}
+
+STATUS_NAMES = {
+    "pending": "ожидает",
+    "accepted": "принято",
+    "rejected": "отклонено",
+    "auto_done": "авто",
+}
+
+
+def period_range(period: str):
+    """Период -> (start_ts, end_ts) в секундах Unix; None вместо границы — без ограничения."""
+    days = PERIODS[period][1]
+    if days is None:
+        return None, None
+    today = timeutil.today()
+    start = timeutil.day_start_ts(today - datetime.timedelta(days=days - 1))
+    end = timeutil.day_start_ts(today + datetime.timedelta(days=1))
+    return start, end
+
+def period_days(period: str):
+    """Период -> (start_day, end_day) как 'YYYY-MM-DD', end_day не включается; None — без ограничения."""
+    days = PERIODS[period][1]
+    if days is None:
+        return None, None
+    today = timeutil.today()
+    start = today - datetime.timedelta(days=days - 1)
+    end = today + datetime.timedelta(days=1)
+    return start.isoformat(), end.isoformat()
+
+def period_title(period: str) -> str:
+    if period == "today":
+        return f"за {timeutil.today().isoformat()}"
+    days = PERIODS[period][1]
+    if days is None:
+        return "за всё время"
+    return f"за {days} дн."
+
+def reports_menu_markup():
+    markup = InlineKeyboardMarkup()
+    for period, (name, _) in PERIODS.items():
+        markup.add(InlineKeyboardButton(f"Отчёт: {name}", callback_data=callbacks.encode(callbacks.REPORT, period)))
+    return markup
+
+
+def _fmt_qty(qty):
+    qty = qty or 0
+    return f"{qty:g}"
+
+def truncate(text: str, limit: int = MESSAGE_LIMIT) -> str:
+    if len(text) <= limit:
+        return text
+    text = text[:limit - 2]
+    # Не оставляем половину HTML-сущности (&amp; и т.п.) из html.escape
+    amp = text.rfind("&")
+    if amp > text.rfind(";"):
+        text = text[:amp]
+    return text + "\n…"
+
+def render_summary(period: str, summary) -> str:
+    lines = [f"<b>Сводка {period_title(period)}</b>"]
+    if not summary["by_status"]:
+        lines.append("Транзакций нет.")
+        return "\n".join(lines)
+
+    total_count = sum(row[1] for row in summary["by_status"])
+    lines.append(f"Всего транзакций: {total_count}")
+    lines.append("")
+    lines.append("<b>По статусам:</b>")
+    for status, count, qty in summary["by_status"]:
+        lines.append(f"{STATUS_NAMES.get(status, status)}: {count} шт., кол-во {_fmt_qty(qty)}")
+    lines.append("")
+    lines.append("<b>По маршрутам:</b>")
+    for from_dep, to_dep, count, qty in summary["by_route"]:
+        lines.append(f"{html.escape(from_dep or '')} -> {html.escape(to_dep or '')}: {count} шт., кол-во {_fmt_qty(qty)}")
+    lines.append("")
+    lines.append("<b>По блюдам:</b>")
+    for name, count, qty in summary["by_dish"]:
+        lines.append(f"{html.escape(name or '')}: {count} шт., кол-во {_fmt_qty(qty)}")
+    rest = summary["dish_count"] - len(summary["by_dish"])
+    if rest > 0:
+        lines.append(f"…и ещё {rest} блюд")
+    return truncate("\n".join(lines))
+
+def summary_markup(period: str):
+    markup = InlineKeyboardMarkup()
+    markup.add(InlineKeyboardButton("Подробно", callback_data=callbacks.encode(callbacks.REPORT_DETAIL, period, "o", 0)))
+    markup.add(InlineKeyboardButton("Выгрузить CSV", callback_data=callbacks.encode(callbacks.REPORT_EXPORT, period)))
+    markup.add(InlineKeyboardButton("« К отчётам", callback_data=callbacks.encode(callbacks.MENU_REPORTS)))
+    return markup
+
+
+# Курсор страницы в callback_data: callbacks.REPORT_DETAIL <period> <направление> <id>
+#   o — записи старше id (id=0 — первая страница), n — записи новее id
+def parse_detail_cursor(period: str, direction: str, cursor: str):
+    if period not in PERIODS or direction not in ("o", "n"):
+        raise ValueError(period)
+    cursor = int(cursor)
+    before_id = cursor if direction == "o" and cursor > 0 else None
+    after_id = cursor if direction == "n" else None
+    return before_id, after_id
+
+def render_stock(department, rows) -> str:
+    """Остатки цеха (строки database.get_stock)."""
+    lines = [f"<b>Остатки: {html.escape(department)}</b>"]
+    if not rows:
+        lines.append("Остатков нет.")
+    for name, label_day, qty in rows:
+        label = f" (дата: {timeutil.format_label_date(label_day)})" if label_day else ""
+        lines.append(f"{html.escape(name or '')}{label}: {_fmt_qty(qty)}")
+    return truncate("\n".join(lines))
+
+def render_stock_check(mismatches, rows) -> str:
+    """Результат database.check_stock."""
+    if not mismatches:
+        return "Остатки сходятся с историей передач."
+    lines = [f"<b>Расхождений в остатках: {mismatches}</b>"]
+    for department, dish_id, label_day, stored, expected in rows:
+        label = f" ({timeutil.format_label_date(label_day)})" if label_day else ""
+        lines.append(f"{html.escape(department)}, блюдо #{dish_id}{label}: {_fmt_qty(stored)} вместо {_fmt_qty(expected)}")
+    return truncate("\n".join(lines))
+
+def render_expiry_alert(department, rows, today) -> str:
+    """Одно сообщение цеху о подходящих к сроку и просроченных остатках (строки database.get_expiring_stock)."""
+    today = today.isoformat()
+    expired = [row for row in rows if row[1] < today]
+    expiring = [row for row in rows if row[1] >= today]
+    lines = [f"<b>Сроки годности: {html.escape(department)}</b>"]
+    for title, group in (("Просрочено", expired), ("Истекает срок", expiring)):
+        if group:
+            lines.append(f"\n<b>{title}:</b>")
+            lines += [f"{html.escape(name or '')} — до {timeutil.format_label_date(day)}: {_fmt_qty(qty)}"
+                      for name, day, qty in group]
+    return truncate("\n".join(lines))
+
+def render_admin_digest(routes, count, since_ts) -> str:
+    """Сводка auto_done для администраторов (digest.AdminDigest): маршрут -> блюда с итогами."""
+    lines = [f"<b>[AUTO] Передачи без подтверждения с {timeutil.format_ts(since_ts)}: {count}</b>"]
+    for (from_dep, to_dep), dishes in sorted(routes.items()):
+        lines.append(f"\n<b>{html.escape(from_dep)} -> {html.escape(to_dep)}</b>")
+        for name, (transfers, qty) in sorted(dishes.items()):
+            lines.append(f"{html.escape(name)}: {_fmt_qty(qty)}" + (f" (передач: {transfers})" if transfers > 1 else ""))
+    return truncate("\n".join(lines))
+
+def render_detail(period: str, rows) -> str:
+    lines = [f"<b>Транзакции {period_title(period)}:</b>"]
+    if not rows:
+        lines.append("Транзакций нет.")
+    for (tid, fdep, tdep, dname, qty, lbl, created, accepted, st) in rows:
+        lines.append(f"#{tid} | {html.escape(fdep or '')} -> {html.escape(tdep or '')} | {html.escape(dname or '')} x {_fmt_qty(qty)} | {st}")
+    return truncate("\n".join(lines))
+
+def detail_markup(period: str, rows, has_older: bool, has_newer: bool):
+    markup = InlineKeyboardMarkup()
+    nav = []
+    if rows and has_newer:
+        nav.append(InlineKeyboardButton("◀ Новее", callback_data=callbacks.encode(callbacks.REPORT_DETAIL, period, "n", rows[0][0])))
+    if rows and has_older:
+        nav.append(InlineKeyboardButton("Старше ▶", callback_data=callbacks.encode(callbacks.REPORT_DETAIL, period, "o", rows[-1][0])))
+    if nav:
+        markup.row(*nav)
+    markup.add(InlineKeyboardButton("« Сводка", callback_data=callbacks.encode(callbacks.REPORT, period)))
+    return markup
+
+def render_audit(kind: str, value: int, rows) -> str:
+    """История действий (строки database.get_audit_page) по запросу audit.parse_query."""
+    if kind == "u":
+        title = f"пользователь {value}"
+    elif kind == "t":
+        title = f"передача #{value}"
+    else:
+        title = audit.TITLES.get(value, str(value))
+    lines = [f"<b>История: {title}</b>"]
+    if not rows:
+        lines.append("Записей нет.")
+    for (log_id, ts, user_id, full_name, action, trans_id, batch_id, items, note) in rows:
+        who = f"{full_name} ({user_id})" if full_name else f"пользователь {user_id}"
+        lines.append(f"{timeutil.format_ts(ts)} | {html.escape(who)} | {html.escape(audit.describe(action, trans_id, batch_id, items, note))}")
+    return truncate("\n".join(lines))
+
+def audit_markup(kind: str, value: int, rows, has_more: bool):
+    if not (rows and has_more):
+        return None
+    log_id, ts = rows[-1][0], rows[-1][1]
+    markup = InlineKeyboardMarkup()
+    markup.add(InlineKeyboardButton("Старше ▶", callback_data=callbacks.encode(callbacks.AUDIT_PAGE, kind, value, ts, log_id)))
+    return markup
@@ -0,0 +1,128 @@
+# retention.py
+import asyncio
+import logging
+import time
+
+import database as db
+from config import (
+    OLD_DATA_RETENTION_DAYS, RETENTION_BATCH_SIZE, RETENTION_BATCH_PAUSE, RETENTION_INTERVAL_HOURS
+)
+
+logger = logging.getLogger(__name__)
+
+
+class RetentionJob:
+    """Фоновая очистка данных старше OLD_DATA_RETENTION_DAYS.
+
+    Строки удаляются пачками по RETENTION_BATCH_SIZE id с commit после каждой
+    пачки; между пачками задача отдаёт управление event loop, а запросы
+    пользователей встают в очередь потока БД между пачками, а не ждут всю
+    очистку. После удаления — incremental_vacuum и checkpoint WAL.
+    Запускается по расписанию (RETENTION_INTERVAL_HOURS) и кнопкой админа.
+
+    Если передан archive (archive.Archive), строки не удаляются безвозвратно,
+    а переносятся в помесячные архивы; завершённые месяцы затем сжимаются.
+    """
+
+    def __init__(self, adb, archive=None, retention_days=OLD_DATA_RETENTION_DAYS, batch_size=RETENTION_BATCH_SIZE,
+                 pause=RETENTION_BATCH_PAUSE, interval_hours=RETENTION_INTERVAL_HOURS):
+        self.adb = adb
+        self.archive = archive
+        self.retention_days = retention_days
+        self.batch_size = batch_size
+        self.pause = pause
+        self.interval = interval_hours * 3600
+        self.running = False
+        self.deleted = {}
+        self.started_at = None
+        self.finished_at = None
+        self.duration = None
+        self.last_error = None
+        self._task = None
+        self._scheduler = None
+
+    def start(self):
+        """Запускает очистку по расписанию."""
+        if self._scheduler is None and self.interval > 0:
+            self._scheduler = asyncio.create_task(self._schedule())
+
+    async def close(self):
+        for task in (self._scheduler, self._task):
+            if task is not None:
+                task.cancel()
+        await asyncio.gather(*[t for t in (self._scheduler, self._task) if t], return_exceptions=True)
+        self._scheduler = self._task = None
+
+    def trigger(self) -> bool:
+        """Запускает очистку в фоне. False, если она уже идёт."""
+        if self.running:
+            return False
+        self._begin()
+        self._task = asyncio.create_task(self.run())
+        return True
+
+    async def _schedule(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            if not self.running:
+                await self.run()
+
+    def _begin(self):
+        self.running = True
+        self.deleted = {table: 0 for table in db.RETENTION_TABLES}
+        self.started_at = time.time()
+        self.finished_at = None
+        self.last_error = None
+
+    async def run(self):
+        if not self.running:
+            self._begin()
+        started = time.monotonic()
+        try:
+            cutoff_ts = db.retention_cutoff_ts(self.retention_days)
+            for table in db.RETENTION_TABLES:
+                await self._purge_table(table, cutoff_ts)
+            await self.adb.compact_database()
+            if self.archive is not None:
+                loop = asyncio.get_running_loop()
+                await loop.run_in_executor(None, self.archive.seal_before, cutoff_ts)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self.last_error = str(e)
+            logger.exception("Очистка старых данных завершилась с ошибкой")
+        finally:
+            self.duration = time.monotonic() - started
+            self.finished_at = time.time()
+            self.running = False
+        logger.info("Очистка старых данных: удалено %s за %.1f с", self.deleted, self.duration)
+        return self.deleted
+
+    async def _purge_table(self, table, cutoff_ts):
+        min_id, max_id = await self.adb.get_expired_id_range(table, cutoff_ts)
+        if min_id is None:
+            return
+        for from_id in range(min_id, max_id + 1, self.batch_size):
+            to_id = min(from_id + self.batch_size - 1, max_id)
+            if self.archive is not None:
+                count = await self.adb.archive_expired_batch(self.archive, table, cutoff_ts, from_id, to_id)
+            else:
+                count = await self.adb.delete_expired_batch(table, cutoff_ts, from_id, to_id)
+            self.deleted[table] += count
+            await asyncio.sleep(self.pause)
+
+    def _verb(self):
+        return "Перенесено в архив" if self.archive is not None else "Удалено"
+
+    def describe(self) -> str:
+        """Текст о состоянии очистки для панели администратора."""
+        if self.started_at is None:
+            return "Очистка ещё не запускалась."
+        deleted = ", ".join(f"{table}: {count}" for table, count in self.deleted.items())
+        if self.running:
+            elapsed = time.time() - self.started_at
+            return f"Очистка идёт {elapsed:.0f} с. {self._verb()}: {deleted}."
+        text = f"Последняя очистка: {self._verb().lower()} {deleted} за {self.duration:.1f} с."
+        if self.last_error:
+            text += f"\nОшибка: {self.last_error}"
+        return text
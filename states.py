@@ -11,3 +11,7 @@ class TransferFSM(StatesGroup):
     waiting_for_dish = State()
     waiting_for_quantity = State()
     waiting_for_label_date = State()
+    waiting_for_bulk_lines = State()
+
+class AdminFSM(StatesGroup):
+    waiting_for_dish = State()
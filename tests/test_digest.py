@@ -0,0 +1,117 @@
+# tests/test_digest.py
+import asyncio
+import datetime
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.update({
+    "DB_BACKEND": "memory",
+    "FSM_STORAGE": "memory",
+    "ARCHIVE_DIR": os.path.join(tempfile.mkdtemp(prefix="factory-test-"), "archive"),
+    "RETENTION_INTERVAL_HOURS": "0",
+    "EXPIRY_CHECK_INTERVAL_HOURS": "0",
+})
+
+import main  # noqa: E402
+from digest import AdminDigest  # noqa: E402
+
+
+class FakeNotifier:
+    def __init__(self):
+        self.sent = []
+
+    def send(self, chat_id, text, **kwargs):
+        self.sent.append((chat_id, text))
+
+
+class FakeMessage:
+    def __init__(self, tg_id):
+        self.from_user = type("User", (), {"id": tg_id})()
+        self.answers = []
+
+    async def answer(self, text, **kwargs):
+        self.answers.append(text)
+
+
+class FakeState:
+    def __init__(self, data):
+        self.data = data
+
+    async def get_data(self):
+        return dict(self.data)
+
+    async def finish(self):
+        self.data = {}
+
+
+def test_digest_shows_dish_name_and_sends_expired_labels_at_once():
+    async def scenario():
+        adb, digest = main.adb, main.digest
+        adb.start()
+        try:
+            await adb.create_user(1, "Админ", main.ROLE_ADMIN, "Упаковка")
+            admin = await adb.get_user_by_telegram_id(1)
+            await adb.approve_user(admin[0])
+            await adb.create_user(2, "Упаковщик", main.ROLE_WORKER, "Упаковка")
+            await adb.approve_user((await adb.get_user_by_telegram_id(2))[0])
+            await adb.add_dish("Хлеб", "Выпечка")
+            dish_id = (await adb.get_all_dishes())[0][0]
+
+            notifier = FakeNotifier()
+            digest.notifier = notifier
+            # id блюда строкой — как в состояниях FSM, сохранённых до проверки в select_dish
+            state = FakeState({"to_department": "Холодильник", "dish_id": str(dish_id), "quantity": 39})
+            tomorrow = main.timeutil.format_label_date(main.timeutil.today() + datetime.timedelta(days=1))
+            await main.finalize_transfer(FakeMessage(2), state, tomorrow)
+            assert notifier.sent == []  # событие ждёт сводки
+
+            assert await digest.flush() == 1
+            assert [chat_id for chat_id, _ in notifier.sent] == [1]
+            text = notifier.sent[0][1]
+            assert "Упаковка -> Холодильник" in text
+            assert "Хлеб: 39" in text
+            assert "блюдо #" not in text
+
+            # Дата на этикетке уже прошла — администраторам сразу, мимо сводки
+            notifier.sent.clear()
+            state = FakeState({"to_department": "Холодильник", "dish_id": dish_id, "quantity": 4})
+            await main.finalize_transfer(FakeMessage(2), state, "20.01.2025")
+            assert [chat_id for chat_id, _ in notifier.sent] == [1]
+            assert notifier.sent[0][1].startswith("[СРОЧНО] [AUTO] Упаковка -> Холодильник, Хлеб, кол-во=4")
+            assert digest.buffered == 0
+        finally:
+            await adb.close()
+
+    asyncio.run(scenario())
+
+
+def test_digest_escapes_names():
+    text = main.reports.render_admin_digest({("Упаковка", "Холодильник"): {"Соль & перец <1>": [2, 5]}}, 2, 0)
+    assert "Соль &amp; перец &lt;1&gt;: 5 (передач: 2)" in text
+
+
+def test_digest_keeps_events_when_flush_fails():
+    class FailingAdb:
+        fail = True
+
+        async def get_admin_telegram_ids(self):
+            if self.fail:
+                raise RuntimeError("БД недоступна")
+            return [1]
+
+    async def scenario():
+        adb, notifier = FailingAdb(), FakeNotifier()
+        digest = AdminDigest(adb, notifier, interval_minutes=60, urgent_quantity=0)
+        await digest.add("Упаковка", "Холодильник", [("Хлеб", 2)], "")
+        try:
+            await digest.flush()
+        except RuntimeError:
+            pass
+        await digest.add("Упаковка", "Холодильник", [("Хлеб", 3)], "")
+        adb.fail = False
+        assert await digest.flush() == 2
+        assert "Хлеб: 5 (передач: 2)" in notifier.sent[0][1]
+
+    asyncio.run(scenario())
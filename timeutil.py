@@ -0,0 +1,80 @@
+# timeutil.py
+import datetime
+from zoneinfo import ZoneInfo
+
+from config import TIMEZONE
+
+# Часовой пояс производства. Все "сегодня" и границы дней считаются в нём,
+# а в БД хранятся секунды Unix (UTC), чтобы фильтры по дате были диапазонами по индексу.
+TZ = ZoneInfo(TIMEZONE)
+
+
+def now() -> datetime.datetime:
+    """Текущее время в часовом поясе производства (aware datetime)."""
+    return datetime.datetime.now(TZ)
+
+def now_ts() -> int:
+    return int(now().timestamp())
+
+def today() -> datetime.date:
+    """Локальная дата производства, а не дата сервера."""
+    return now().date()
+
+def to_ts(dt: datetime.datetime) -> int:
+    """datetime -> секунды Unix. Наивное время считается местным временем производства."""
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=TZ)
+    return int(dt.timestamp())
+
+def parse_iso_ts(value):
+    """ISO-строка (как её писали старые версии бота) -> секунды Unix, None для пустых значений."""
+    if not value:
+        return None
+    return to_ts(datetime.datetime.fromisoformat(value))
+
+def day_start_ts(day: datetime.date) -> int:
+    """Начало локального дня производства в секундах Unix."""
+    return to_ts(datetime.datetime.combine(day, datetime.time.min))
+
+def day_bounds(day: datetime.date):
+    """Полуинтервал [начало дня, начало следующего дня) в секундах Unix.
+    Границы считаются через местную полночь, поэтому дни перехода на летнее время учитываются верно.
+    """
+    return day_start_ts(day), day_start_ts(day + datetime.timedelta(days=1))
+
+def local_day(ts) -> str:
+    """Секунды Unix -> локальная дата 'YYYY-MM-DD'."""
+    if ts is None:
+        return None
+    return datetime.datetime.fromtimestamp(ts, TZ).date().isoformat()
+
+def format_ts(ts) -> str:
+    """Секунды Unix -> местное время 'DD.MM.YYYY HH:MM' для сообщений."""
+    return datetime.datetime.fromtimestamp(ts, TZ).strftime("%d.%m.%Y %H:%M")
+
+
+# Как вводят дату на этикетке: 20.01.2025, 20.01.25, 2025-01-20, 20/01/2025
+LABEL_DATE_FORMATS = ("%d.%m.%Y", "%d.%m.%y", "%Y-%m-%d", "%d/%m/%Y", "%d-%m-%Y")
+
+def parse_label_date(text) -> datetime.date:
+    """Дата на этикетке в любом из LABEL_DATE_FORMATS -> date (ValueError, если это не дата)."""
+    text = (text or "").strip()
+    for fmt in LABEL_DATE_FORMATS:
+        try:
+            return datetime.datetime.strptime(text, fmt).date()
+        except ValueError:
+            continue
+    raise ValueError(text)
+
+def label_day(text):
+    """Дата на этикетке -> 'YYYY-MM-DD' (колонка label_day), None для пустых и неразборчивых значений."""
+    try:
+        return parse_label_date(text).isoformat()
+    except ValueError:
+        return None
+
+def format_label_date(day) -> str:
+    """date или 'YYYY-MM-DD' -> '20.01.2025', как дата пишется на этикетке."""
+    if isinstance(day, str):
+        day = datetime.date.fromisoformat(day)
+    return day.strftime("%d.%m.%Y")
@@ -0,0 +1,115 @@
+# webhook.py
+import asyncio
+import hmac
+import logging
+
+from aiohttp import web
+from aiogram import Bot, Dispatcher, types
+
+from config import WEBHOOK_WORKERS, WEBHOOK_QUEUE_SIZE, WEBHOOK_DRAIN_TIMEOUT
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+class WebhookServer:
+    """Приём апдейтов через webhook вместо long polling.
+
+    HTTP-обработчик только проверяет секрет, разбирает апдейт, кладёт его
+    в ограниченную очередь и сразу отвечает 200. Апдейты обрабатывают
+    воркеры через dp.process_update. Если очередь заполнена или сервер
+    останавливается, отвечаем 503 — Telegram повторит доставку позже,
+    апдейт не теряется.
+
+    GET /healthz — процесс жив; GET /readyz — готов принимать апдейты.
+    Для проверки без сети достаточно отправить POST с JSON апдейта на путь webhook.
+    """
+
+    def __init__(self, dispatcher: Dispatcher, path: str, secret: str = "",
+                 workers=WEBHOOK_WORKERS, queue_size=WEBHOOK_QUEUE_SIZE,
+                 drain_timeout=WEBHOOK_DRAIN_TIMEOUT):
+        self.dp = dispatcher
+        self.path = path
+        self.secret = secret
+        self.workers = workers
+        self.queue_size = queue_size
+        self.drain_timeout = drain_timeout
+        self.ready = False
+        self.counters = {"received": 0, "processed": 0, "failed": 0, "rejected": 0}
+        self._queue = None
+        self._tasks = []
+
+    def make_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post(self.path, self.handle_update)
+        app.router.add_get("/healthz", self.handle_health)
+        app.router.add_get("/readyz", self.handle_ready)
+        return app
+
+    # ---- жизненный цикл ----
+
+    async def start(self):
+        self._queue = asyncio.Queue(self.queue_size)
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        self.ready = True
+
+    async def drain(self):
+        """Перестаёт принимать апдейты и дожидается обработки уже принятых."""
+        self.ready = False
+        if not self._tasks:
+            return
+        try:
+            await asyncio.wait_for(self._queue.join(), self.drain_timeout)
+        except asyncio.TimeoutError:
+            logger.warning("Webhook: при остановке не обработано апдейтов: %s", self._queue.qsize())
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def stats(self):
+        return dict(self.counters, queued=self._queue.qsize() if self._queue else 0, ready=self.ready)
+
+    # ---- HTTP ----
+
+    async def handle_update(self, request: web.Request):
+        if self.secret and not hmac.compare_digest(request.headers.get(SECRET_HEADER, ""), self.secret):
+            return web.Response(status=401)
+        if not self.ready:
+            self.counters["rejected"] += 1
+            return web.Response(status=503)
+        try:
+            update = types.Update(**(await request.json()))
+        except Exception:
+            return web.Response(status=400)
+        try:
+            self._queue.put_nowait(update)
+        except asyncio.QueueFull:
+            self.counters["rejected"] += 1
+            return web.Response(status=503)
+        self.counters["received"] += 1
+        return web.Response(text="ok")
+
+    async def handle_health(self, request: web.Request):
+        return web.json_response({"status": "ok"})
+
+    async def handle_ready(self, request: web.Request):
+        status = 200 if self.ready and not self._queue.full() else 503
+        return web.json_response(self.stats(), status=status)
+
+    async def _worker(self):
+        Bot.set_current(self.dp.bot)
+        Dispatcher.set_current(self.dp)
+        while True:
+            update = await self._queue.get()
+            try:
+                # Каждый апдейт — в отдельной задаче: aiogram кэширует состояние FSM
+                # в contextvars, и без своего контекста оно "протекало" бы между апдейтами воркера
+                await asyncio.create_task(self.dp.process_update(update))
+                self.counters["processed"] += 1
+            except Exception:
+                self.counters["failed"] += 1
+                logger.exception("Webhook: ошибка обработки апдейта %s", update.update_id)
+            finally:
+                self._queue.task_done()